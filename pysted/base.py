@@ -85,12 +85,17 @@ import logging
 import numpy
 import scipy.constants
 import scipy.signal
+import scipy.special
 import pickle
+import collections
+import concurrent.futures
+import inspect
+import os
 
 # from pysted import cUtils, utils   # je dois changer ce import en les 2 autres en dessous pour que ça marche
 import tqdm
 
-from pysted import utils, cUtils, raster, bleach_funcs
+from pysted import utils, cUtils, raster, bleach_funcs, laser_cache
 # import cUtils
 
 # import mis par BT pour des tests
@@ -104,7 +109,40 @@ from functools import partial
 import pickle
 
 
-class GaussianBeam:
+class FingerprintMixin:
+    '''This mixin gives a component a fingerprint, a 64-bit integer computed
+    from a hash of its parameters. The fingerprint is computed once and
+    invalidated whenever an attribute is assigned, such that comparing two
+    components or validating a cache entry costs a single integer comparison.
+
+    .. important::
+       Modifying an attribute in place (e.g. ``fluo.sigma_abs[488] = 1e-21``)
+       is not detected. Assign the attribute instead, or call
+       :meth:`invalidate_fingerprint`.
+    '''
+
+    def __setattr__(self, name, value):
+        self.__dict__.pop("_fingerprint", None)
+        super().__setattr__(name, value)
+
+    @property
+    def fingerprint(self):
+        '''The fingerprint of the component (int).'''
+        fingerprint = self.__dict__.get("_fingerprint")
+        if fingerprint is None:
+            params = {key: value for key, value in vars(self).items() if key != "_fingerprint"}
+            fingerprint = int(laser_cache.stable_hash(type(self).__name__, params)[:16], 16)
+            self.__dict__["_fingerprint"] = fingerprint
+        return fingerprint
+
+    def invalidate_fingerprint(self):
+        '''Invalidate the fingerprint after an in-place modification of an
+        attribute.
+        '''
+        self.__dict__.pop("_fingerprint", None)
+
+
+class GaussianBeam(FingerprintMixin):
     '''This class implements a Gaussian beam (excitation).
 
     :param lambda_: The wavelength of the beam (m).
@@ -120,6 +158,17 @@ class GaussianBeam:
     | ``beta``         | ``pi/4``     | The beam incident angle, in            |
     |                  |              | :math:`[0, \pi/2]` (rad).              |
     +------------------+--------------+----------------------------------------+
+    | ``quadrature``   | ``"quad"``   | The method used to integrate the focal |
+    |                  |              | fields, either ``"quad"`` (adaptive)   |
+    |                  |              | or ``"gauss-legendre"`` (vectorized).  |
+    +------------------+--------------+----------------------------------------+
+    | ``quad_order``   | ``64``       | The number of Gauss-Legendre nodes.    |
+    +------------------+--------------+----------------------------------------+
+    | ``quad_tol``     | ``None``     | If given, the Gauss-Legendre integrals |
+    |                  |              | are verified against the adaptive      |
+    |                  |              | integrals, warning if the relative     |
+    |                  |              | error exceeds this tolerance.          |
+    +------------------+--------------+----------------------------------------+
 
     Polarization :
         * :math:`\pi/2` is left-circular
@@ -131,24 +180,21 @@ class GaussianBeam:
         self.lambda_ = lambda_
         self.polarization = kwargs.get("polarization", numpy.pi/2)
         self.beta = kwargs.get("beta", numpy.pi/4)
+        self.quadrature = kwargs.get("quadrature", "quad")
+        self.quad_order = kwargs.get("quad_order", 64)
+        self.quad_tol = kwargs.get("quad_tol", None)
 
     # FIXME: pass Objective object instead of f, n, na, transmission
-    def get_intensity(self, power, f, n, na, transmission, datamap_pixelsize):
-        '''Compute the transmitted excitation intensity field (W/m²). The
-        technique essentially follows the method described in [Xie2013]_,
-        where :math:`z = 0`, along with some equations from [Deng2010]_, and
-        [RPPhoto2015]_.
+    def get_radial_integrals(self, n, na, kr):
+        '''Compute the focal plane integrations :math:`i_1` to :math:`i_3`
+        [Xie2013]_. The integrals only depend on the radius, so they can be
+        evaluated once per unique radius.
 
-        :param power: The time averaged power of the beam (W).
-        :param f: The focal length of the objective (m).
         :param n: The refractive index of the objective.
         :param na: The numerical aperture of the objective.
-        :param transmission: The transmission ratio of the objective (given the
-                             wavelength of the excitation beam).
-        :param datamap_pixelsize: The size of an element in the intensity matrix (m).
-        :returns: A 2D array of the time averaged intensity (W/m^2).
+        :param kr: A 1D array of the values of :math:`kr`.
+        :returns: A tuple of 1D arrays of the integrals.
         '''
-
         def fun1(theta, kr):
             return numpy.sqrt(numpy.cos(theta)) * numpy.sin(theta) *\
                    scipy.special.jv(0, kr * numpy.sin(theta)) * (1 + numpy.cos(theta))
@@ -160,31 +206,35 @@ class GaussianBeam:
                    scipy.special.jv(2, kr * numpy.sin(theta)) * (1 - numpy.cos(theta))
 
         alpha = numpy.arcsin(na / n)
+        return utils.radial_integrals((fun1, fun2, fun3), 0, alpha, kr, method=self.quadrature,
+                                      order=self.quad_order, tol=self.quad_tol)
 
-        diameter = 2.233 * self.lambda_ / (na * datamap_pixelsize)
-        n_pixels = int(diameter / 2) * 2 + 1 # odd number of pixels
-        center = int(n_pixels / 2)
-
-        # [Deng2010]
-        k = 2 * numpy.pi * n / self.lambda_
-
-        # compute the focal plane integrations i1 to i3 [Xie2013]
-        i1 = numpy.empty((n_pixels, n_pixels))
-        i2 = numpy.empty((n_pixels, n_pixels))
-        i3 = numpy.empty((n_pixels, n_pixels))
-        phi = numpy.empty((n_pixels, n_pixels))
-        for y in range(n_pixels):
-            h_rel = (center - y)
-            for x in range(n_pixels):
-                w_rel = (x - center)
-
-                angle, radius = utils.cart2pol(w_rel, h_rel)
+    def get_intensity(self, power, f, n, na, transmission, datamap_pixelsize, profile=None):
+        '''Compute the transmitted excitation intensity field (W/m²). The
+        technique essentially follows the method described in [Xie2013]_,
+        where :math:`z = 0`, along with some equations from [Deng2010]_, and
+        [RPPhoto2015]_.
 
-                kr = k * radius * datamap_pixelsize
-                i1[y, x] = scipy.integrate.quad(fun1, 0, alpha, (kr,))[0]
-                i2[y, x] = scipy.integrate.quad(fun2, 0, alpha, (kr,))[0]
-                i3[y, x] = scipy.integrate.quad(fun3, 0, alpha, (kr,))[0]
-                phi[y, x] = angle
+        :param power: The time averaged power of the beam (W).
+        :param f: The focal length of the objective (m).
+        :param n: The refractive index of the objective.
+        :param na: The numerical aperture of the objective.
+        :param transmission: The transmission ratio of the objective (given the
+                             wavelength of the excitation beam).
+        :param datamap_pixelsize: The size of an element in the intensity matrix (m).
+        :param profile: A tuple of values of :math:`kr` and of the radial
+                        integrals (see :meth:`get_radial_integrals`) from which
+                        the integrals are interpolated instead of being
+                        computed (optional).
+        :returns: A 2D array of the time averaged intensity (W/m^2).
+        '''
+        phi, radius_idx, kr = utils.focal_grid(self.lambda_, n, na, datamap_pixelsize)
+        n_pixels = phi.shape[0]
+        if profile is None:
+            integrals = self.get_radial_integrals(n, na, kr)
+        else:
+            integrals = utils.resample_radial_integrals(profile, kr)
+        i1, i2, i3 = (values[radius_idx] for values in integrals)
 
         ax = numpy.sin(self.beta)
         ay = numpy.cos(self.beta) * numpy.exp(1j * self.polarization)
@@ -240,9 +290,7 @@ class GaussianBeam:
         """
         if not isinstance(other, GaussianBeam):
             return False
-        return all([
-            getattr(self, key) == getattr(other, key) for key in vars(self).keys()
-        ])
+        return self.fingerprint == other.fingerprint
 
     def __ne__(self, other):
         """
@@ -255,7 +303,7 @@ class GaussianBeam:
         """
         return not self == other
 
-class DonutBeam:
+class DonutBeam(FingerprintMixin):
     '''This class implements a donut beam (STED).
 
     :param lambda_: The wavelength of the beam (m).
@@ -281,6 +329,17 @@ class DonutBeam:
     | ``anti_stoke``   | ``True``     | Presence of anti-stoke (sted beam)     |
     |                  |              | excitation                             |
     +------------------+--------------+----------------------------------------+
+    | ``quadrature``   | ``"quad"``   | The method used to integrate the focal |
+    |                  |              | fields, either ``"quad"`` (adaptive)   |
+    |                  |              | or ``"gauss-legendre"`` (vectorized).  |
+    +------------------+--------------+----------------------------------------+
+    | ``quad_order``   | ``64``       | The number of Gauss-Legendre nodes.    |
+    +------------------+--------------+----------------------------------------+
+    | ``quad_tol``     | ``None``     | If given, the Gauss-Legendre integrals |
+    |                  |              | are verified against the adaptive      |
+    |                  |              | integrals, warning if the relative     |
+    |                  |              | error exceeds this tolerance.          |
+    +------------------+--------------+----------------------------------------+
 
 
     Polarization :
@@ -297,24 +356,21 @@ class DonutBeam:
         self.rate = kwargs.get("rate", 40e6)
         self.zero_residual = kwargs.get("zero_residual", 0)
         self.anti_stoke = kwargs.get("anti_stoke", True)
+        self.quadrature = kwargs.get("quadrature", "quad")
+        self.quad_order = kwargs.get("quad_order", 64)
+        self.quad_tol = kwargs.get("quad_tol", None)
 
     # FIXME: pass Objective object instead of f, n, na, transmission
-    def get_intensity(self, power, f, n, na, transmission, datamap_pixelsize):
-        '''Compute the transmitted STED intensity field (W/m²). The technique
-        essentially follows the method described in [Xie2013]_, where
-        :math:`z = 0`, along with some equations from [Deng2010]_, and
-        [RPPhoto2015]_.
+    def get_radial_integrals(self, n, na, kr):
+        '''Compute the angular integrations :math:`i_1` to :math:`i_5`
+        [Xie2013]_. The integrals only depend on the radius, so they can be
+        evaluated once per unique radius.
 
-        :param power: The power of the beam (W).
-        :param f: The focal length of the objective (m).
         :param n: The refractive index of the objective.
-        :param na: The numerical aperture.
-        :param transmission: The transmission ratio of the objective (given the
-                             wavelength of the STED beam).
-        :param datamap_pixelsize: The size of an element in the intensity matrix (m).
-        :returns: A 2D array of the instant intensity (W/m^2).
+        :param na: The numerical aperture of the objective.
+        :param kr: A 1D array of the values of :math:`kr`.
+        :returns: A tuple of 1D arrays of the integrals.
         '''
-
         def fun1(theta, kr):
             return numpy.sqrt(numpy.cos(theta)) * numpy.sin(theta) *\
                    scipy.special.jv(1, kr * numpy.sin(theta)) * (1 + numpy.cos(theta))
@@ -332,36 +388,35 @@ class DonutBeam:
                    scipy.special.jv(2, kr * numpy.sin(theta))
 
         alpha = numpy.arcsin(na / n)
+        return utils.radial_integrals((fun1, fun2, fun3, fun4, fun5), 0, alpha, kr, method=self.quadrature,
+                                      order=self.quad_order, tol=self.quad_tol)
 
-        diameter = 2.233 * self.lambda_ / (na * datamap_pixelsize)
-        n_pixels = int(diameter / 2) * 2 + 1 # odd number of pixels
-        center = int(n_pixels / 2)
-
-        # [Deng2010]
-        k = 2 * numpy.pi * n / self.lambda_
-
-        # compute the angular integrations i1 to i5 [Xie2013]
-        i1 = numpy.zeros((n_pixels, n_pixels))
-        i2 = numpy.zeros((n_pixels, n_pixels))
-        i3 = numpy.zeros((n_pixels, n_pixels))
-        i4 = numpy.zeros((n_pixels, n_pixels))
-        i5 = numpy.zeros((n_pixels, n_pixels))
-        phi = numpy.zeros((n_pixels, n_pixels))
-        for y in range(n_pixels):
-            h_rel = (center - y)
-            for x in range(n_pixels):
-                w_rel = (x - center)
-
-                angle, radius = utils.cart2pol(w_rel, h_rel)
-
-                kr = k * radius * datamap_pixelsize
+    def get_intensity(self, power, f, n, na, transmission, datamap_pixelsize, profile=None):
+        '''Compute the transmitted STED intensity field (W/m²). The technique
+        essentially follows the method described in [Xie2013]_, where
+        :math:`z = 0`, along with some equations from [Deng2010]_, and
+        [RPPhoto2015]_.
 
-                i1[y, x] = scipy.integrate.quad(fun1, 0, alpha, (kr,))[0]
-                i2[y, x] = scipy.integrate.quad(fun2, 0, alpha, (kr,))[0]
-                i3[y, x] = scipy.integrate.quad(fun3, 0, alpha, (kr,))[0]
-                i4[y, x] = scipy.integrate.quad(fun4, 0, alpha, (kr,))[0]
-                i5[y, x] = scipy.integrate.quad(fun5, 0, alpha, (kr,))[0]
-                phi[y, x] = angle
+        :param power: The power of the beam (W).
+        :param f: The focal length of the objective (m).
+        :param n: The refractive index of the objective.
+        :param na: The numerical aperture.
+        :param transmission: The transmission ratio of the objective (given the
+                             wavelength of the STED beam).
+        :param datamap_pixelsize: The size of an element in the intensity matrix (m).
+        :param profile: A tuple of values of :math:`kr` and of the radial
+                        integrals (see :meth:`get_radial_integrals`) from which
+                        the integrals are interpolated instead of being
+                        computed (optional).
+        :returns: A 2D array of the instant intensity (W/m^2).
+        '''
+        phi, radius_idx, kr = utils.focal_grid(self.lambda_, n, na, datamap_pixelsize)
+        n_pixels = phi.shape[0]
+        if profile is None:
+            integrals = self.get_radial_integrals(n, na, kr)
+        else:
+            integrals = utils.resample_radial_integrals(profile, kr)
+        i1, i2, i3, i4, i5 = (values[radius_idx] for values in integrals)
 
         ax = numpy.sin(self.beta)
         ay = numpy.cos(self.beta) * numpy.exp(1j * self.polarization)
@@ -443,9 +498,7 @@ class DonutBeam:
         """
         if not isinstance(other, DonutBeam):
             return False
-        return all([
-            getattr(self, key) == getattr(other, key) for key in vars(self).keys()
-        ])
+        return self.fingerprint == other.fingerprint
 
     def __ne__(self, other):
         """
@@ -458,7 +511,7 @@ class DonutBeam:
         """
         return not self == other
 
-class Detector:
+class Detector(FingerprintMixin):
     '''This class implements the photon detector component.
 
     :param parameters: One or more parameters as described in the following
@@ -519,7 +572,7 @@ class Detector:
         self.det_width = kwargs.get("det_width", 8e-9)
         assert self.det_delay >= 0 #Verify the detection delay is not negative
 
-    def get_detection_psf(self, lambda_, psf, na, transmission, datamap_pixelsize):
+    def get_detection_psf(self, lambda_, psf, na, transmission, datamap_pixelsize, method="auto"):
         '''Compute the detection PSF as a convolution between the fluorscence
         PSF and a pinhole, as described by the equation from [Willig2006]_. The
         pinhole raidus is determined using the :attr:`n_airy`, the fluorescence
@@ -532,12 +585,24 @@ class Detector:
         :param transmission: The transmission ratio of the objective for the
                              given fluorescence wavelength *lambda_*.
         :param datamap_pixelsize: The size of a pixel in the simulated image (m).
+        :param method: The convolution method, either ``"direct"``, ``"fft"``, or
+                       ``"auto"`` to select the fastest one given the size of
+                       the arrays (see :func:`scipy.signal.choose_conv_method`).
         :returns: A 2D array.
         '''
         radius = self.n_airy * 0.61 * lambda_ / na
-        pinhole = utils.pinhole(radius, datamap_pixelsize, psf.shape[0])
+        pinhole = utils.pinhole(radius, datamap_pixelsize, psf.shape[0]).astype(numpy.float64)
         # convolution [Willig2006] eq. 3
-        psf_det = scipy.signal.convolve2d(psf, pinhole, "same")
+        if method == "auto":
+            method = scipy.signal.choose_conv_method(psf, pinhole, mode="same")
+        if method == "fft":
+            # both arrays are positive, which removes the round-off of the FFT
+            # in the tails of the PSF
+            psf_det = numpy.maximum(scipy.signal.fftconvolve(psf, pinhole, "same"), 0)
+        elif method == "direct":
+            psf_det = scipy.signal.convolve2d(psf, pinhole, "same")
+        else:
+            raise ValueError(f"Unknown convolution method {method}, must be either 'auto', 'direct' or 'fft'")
         # normalization to 1
         psf_det = psf_det / numpy.max(psf_det)
 
@@ -556,42 +621,108 @@ class Detector:
 
         return ra_flipped
 
-    def get_signal(self, photons, dwelltime, rate, seed=None):
+    def get_signal(self, photons, dwelltime, rate, seed=None, frame=0, pixel=0, step=0, rng=None, expected=False,
+                   out=None):
         '''Compute the detected signal (in photons) given the number of emitted
         photons and the time spent by the detector.
 
+        The signal is detected in a single pass over the arrays by the C
+        detection model of the kernels (see :mod:`pysted.detector_model`),
+        without temporary arrays. The random numbers are drawn from the
+        counter-based streams of the kernels, whose key is given by the seed
+        and whose counter is given by the frame, the pixel and the step, such
+        that the global state of :mod:`numpy.random` is left untouched. The
+        element ``i`` is detected from the stream of the pixel ``pixel + i``.
+        The background and the dark counts are drawn together, in the same
+        Poisson draw as the noise if it is enabled, since a sum of Poisson
+        variables is a Poisson variable.
+
         :param photons: An array of number of emitted photons.
         :param dwelltime: The time spent to detect the emitted photons (s). It is
                           either a scalar or an array shaped like *nb_photons*.
+        :param seed: The seed of the random numbers. If ``None``, a seed is
+                     drawn from the entropy of the system and the signal is
+                     not reproducible.
+        :param frame: The index of the frame in a sequence of acquisitions with
+                      the same seed.
+        :param pixel: The index of the pixel when a single pixel is detected,
+                      e.g. in the decision steps of DyMIN.
+        :param step: The index of the step of the pixel.
+        :param rng: A :class:`numpy.random.Generator` from which the random
+                    numbers are drawn instead, in which case *seed*, *frame*,
+                    *pixel* and *step* are ignored. The draws of numpy then
+                    allocate temporary arrays.
+        :param expected: Whether the expected value of the signal is returned
+                         instead of a random sample.
+        :param out: A C contiguous float array shaped like *nb_photons* in
+                    which the signal is written, to avoid allocating it.
         :returns: An array shaped like *nb_photons*.
+
+        A subclass may override this method with the signature
+        ``get_signal(photons, dwelltime, rate, seed=None)``. The microscopes
+        only give *frame*, *pixel* and *step* to an override which accepts
+        them, except for a *frame* which is not 0 (see
+        :meth:`get_stream_kwargs`).
         '''
         detection_efficiency = self.pcef * self.pdef # ratio
-        if seed is None:
-            seed = int(str(time.time_ns())[-5:-1])
-            numpy.random.seed(seed)
-        else:
-            numpy.random.seed(seed)
-        try:
-            signal = numpy.random.binomial(photons.astype(numpy.int64),
-                                           detection_efficiency,
-                                           photons.shape) * dwelltime
-        except:
-            # on Windows numpy.random.binomial cannot generate 64-bit integers
-            signal = utils.approx_binomial(photons.astype(numpy.int64),
-                                           detection_efficiency,
-                                           photons.shape) * dwelltime
+        photons = numpy.asarray(photons)
+        if out is None:
+            out = numpy.empty(photons.shape)
+        elif out.shape != photons.shape or out.dtype != numpy.float64 or not out.flags.c_contiguous:
+            raise ValueError("out must be a C contiguous float64 array shaped like photons")
+        # background and dark counts per second, accounting for the detection gating
+        counts = (self.background + self.darkcount) * self.det_width * rate
+
+        if expected:
+            numpy.floor(photons, out=out)
+            out *= detection_efficiency
+            out += counts
+            out *= dwelltime
+            return out if photons.ndim else out[()]
+
+        if rng is None:
+            dwelltime = numpy.asarray(dwelltime, dtype=numpy.float64)
+            if dwelltime.size != 1:
+                dwelltime = numpy.broadcast_to(dwelltime, photons.shape)
+            raster.detect_signal(self, numpy.ascontiguousarray(photons, dtype=numpy.float64).reshape(-1),
+                                 numpy.ascontiguousarray(dwelltime).reshape(-1), rate, utils.seed_verifier(seed),
+                                 frame, pixel, step, out.reshape(-1))
+            return out if photons.ndim else out[()]
+
+        out[...] = rng.binomial(photons.astype(numpy.int64), detection_efficiency)
+        out *= dwelltime
         # add noise, background, and dark counts
         if self.noise:
-            signal = numpy.random.poisson(signal, signal.shape)
-        if self.background > 0:
-            # background counts per second, accounting for the detection gating
-            cts = numpy.random.poisson(self.background * self.det_width * rate * dwelltime, signal.shape)
-            signal += cts
-        if self.darkcount > 0:
-            # Dark counts per second, accounting for the detection gating
-            cts = numpy.random.poisson(self.darkcount * self.det_width * rate * dwelltime, signal.shape)
-            signal += cts
-        return signal
+            if counts > 0:
+                out += counts * numpy.asarray(dwelltime)
+            out[...] = rng.poisson(out)
+        elif counts > 0:
+            out += rng.poisson(counts * numpy.asarray(dwelltime), out.shape)
+        return out if photons.ndim else out[()]
+
+    def get_stream_kwargs(self, frame=0, pixel=0, step=0):
+        '''Returns the keywords of the random stream given to
+        :meth:`get_signal` by the microscopes.
+
+        All the keywords are given to :meth:`get_signal` if it is not
+        overridden, or if the override accepts them. Otherwise, *pixel* and
+        *step* are dropped, and *frame* is only given if it is not 0, such that
+        an override which cannot tell the frames of a sequence apart fails
+        instead of repeating the random numbers of the first frame.
+
+        :param frame: The index of the frame in a sequence of acquisitions with
+                      the same seed.
+        :param pixel: The index of the pixel when a single pixel is detected.
+        :param step: The index of the step of the pixel.
+        :returns: A dict of the keywords.
+        '''
+        kwargs = {"frame": frame, "pixel": pixel, "step": step}
+        if type(self).get_signal is Detector.get_signal:
+            return kwargs
+        parameters = inspect.signature(self.get_signal).parameters
+        if any(parameter.kind == inspect.Parameter.VAR_KEYWORD for parameter in parameters.values()):
+            return kwargs
+        return {key: value for key, value in kwargs.items() if key in parameters or (key == "frame" and value != 0)}
 
     def __eq__(self, other):
         """
@@ -604,9 +735,7 @@ class Detector:
         """
         if not isinstance(other, Detector):
             return False
-        return all([
-            getattr(self, key) == getattr(other, key) for key in vars(self).keys()
-        ])
+        return self.fingerprint == other.fingerprint
 
     def __ne__(self, other):
         """
@@ -619,7 +748,7 @@ class Detector:
         """
         return not self == other
 
-class Objective:
+class Objective(FingerprintMixin):
     '''
     This class implements the microscope objective component.
 
@@ -670,9 +799,7 @@ class Objective:
         """
         if not isinstance(other, Objective):
             return False
-        return all([
-            getattr(self, key) == getattr(other, key) for key in vars(self).keys()
-        ])
+        return self.fingerprint == other.fingerprint
 
     def __ne__(self, other):
         """
@@ -686,7 +813,7 @@ class Objective:
         return not self == other
 
 
-class Fluorescence:
+class Fluorescence(FingerprintMixin):
     '''This class implements a fluorescence molecule.
 
     :param lambda_: The fluorescence wavelength (m).
@@ -724,6 +851,20 @@ class Fluorescence:
     |                          |              | to the (very long) triplets dynamics.  |
     |                          |              | Caution: not based on rigorous theory  |
     +--------------------------+--------------+----------------------------------------+
+    | ``phy_react``            |``488: 1e-4``,| A dictionnary mapping wavelengths as   |
+    |                          |``575: 1e-8`` | integer (nm) to the probability that an|
+    |                          |              | absorbed or stimulated photon bleaches |
+    |                          |              | the molecule (``"proportional"``       |
+    |                          |              | bleaching model).                      |
+    +--------------------------+--------------+----------------------------------------+
+    | ``quadrature``           | ``"quad"``   | The method used to integrate the PSF   |
+    |                          |              | over every pixel, either ``"quad"``    |
+    |                          |              | (adaptive) or ``"gauss-legendre"``     |
+    |                          |              | (vectorized pixel supersampling).      |
+    +--------------------------+--------------+----------------------------------------+
+    | ``quad_order``           | ``8``        | The number of Gauss-Legendre nodes per |
+    |                          |              | pixel along each axis.                 |
+    +--------------------------+--------------+----------------------------------------+
 
     .. [#] EGFP (k1 and b for ATTO647N from [Oracz2017]_)
     '''
@@ -742,6 +883,9 @@ class Fluorescence:
         self.k1 = kwargs.get("k1", 1.3e-15) #Note: divided by (100**2)**1.4, assuming units where wrong in the paper (cm^2 instead of m^2)
         self.b = kwargs.get("b", 1.4)
         self.triplet_dynamic_frac = kwargs.get("triplet_dynamic_frac", 0)
+        self.phy_react = kwargs.get("phy_react", {488: 1e-4, 575: 1e-8})
+        self.quadrature = kwargs.get("quadrature", "quad")
+        self.quad_order = kwargs.get("quad_order", 8)
 
     def __eq__(self, other):
         """
@@ -754,9 +898,7 @@ class Fluorescence:
         """
         if not isinstance(other, Fluorescence):
             return False
-        return all([
-            getattr(self, key) == getattr(other, key) for key in vars(self).keys()
-        ])
+        return self.fingerprint == other.fingerprint
 
     def __ne__(self, other):
         """
@@ -802,6 +944,22 @@ class Fluorescence:
         fwhm = self.lambda_ / (2 * na)
 
         half_pixelsize = datamap_pixelsize / 2
+        if self.quadrature == "gauss-legendre":
+            # area average of the Airy pattern over every pixel using the same
+            # Gauss-Legendre nodes in all the pixels
+            offsets, weights = utils.gauss_legendre(-half_pixelsize, half_pixelsize, self.quad_order)
+            positions = (numpy.arange(n_pixels) - center) * datamap_pixelsize
+            nodes = (positions[:, numpy.newaxis] + offsets[numpy.newaxis, :]).ravel()
+            d_scaled = numpy.sqrt(nodes[:, numpy.newaxis]**2 + nodes[numpy.newaxis, :]**2) / fwhm
+            with numpy.errstate(divide="ignore", invalid="ignore"):
+                amplitude = (scipy.special.j1(numpy.pi * d_scaled) / (numpy.pi * d_scaled))**2
+            amplitude[d_scaled == 0] = 1
+            amplitude = amplitude.reshape(n_pixels, self.quad_order, n_pixels, self.quad_order)
+            gauss = numpy.einsum("i,j,aibj->ab", weights, weights, amplitude)
+            return numpy.real_if_close(gauss / numpy.max(gauss))
+        elif self.quadrature != "quad":
+            raise ValueError(f"Unknown integration method {self.quadrature}, must be either 'quad' or 'gauss-legendre'")
+
         gauss = numpy.zeros((n_pixels, n_pixels))
         for y in range(n_pixels):
             h_rel = (center - y) * datamap_pixelsize
@@ -886,6 +1044,65 @@ class Fluorescence:
 
         return mean_k_bleach
 
+    def get_k_bleach_proportional(self, lambda_ex, lambda_sted, phi_ex, phi_sted):
+        '''Compute spatial maps of the photobleaching rates when the bleaching is
+        proportional to the number of photons absorbed by the molecule (excitation)
+        or stimulating its emission (STED).
+
+        :param lambda_ex: Wavelength of the the excitation beam (m).
+        :param lambda_sted: Wavelength of the STED beam (m).
+        :param phi_ex: Spatial map of the excitation photon flux (:math:`m^{-2}s^{-1}`).
+        :param phi_sted: Spatial map of the STED photon flux, averaged over a period
+                         (:math:`m^{-2}s^{-1}`).
+        :returns: A tuple of 2D arrays of the bleaching rates due to the excitation
+                  and to the STED beams (:math:`s^{-1}`).
+        '''
+        exc_lambda_ = numpy.round(lambda_ex/1e-9)
+        sted_lambda_ = numpy.round(lambda_sted/1e-9)
+        k_ex = self.phy_react[exc_lambda_] * self.sigma_abs[exc_lambda_] * phi_ex
+        k_sted = self.phy_react[sted_lambda_] * self.sigma_ste[sted_lambda_] * phi_sted
+        return k_ex, k_sted
+
+def get_beam_intensity(beam, f, n, na, transmission, datamap_pixelsize, profile=None):
+    '''Compute the intensity of a beam for a power of 1 W along with the radial
+    integrals used to compute it. This is a module level function such that it
+    can be sent to worker processes.
+
+    :param beam: A :class:`~pysted.base.GaussianBeam` or a
+                 :class:`~pysted.base.DonutBeam` object.
+    :param f: The focal length of the objective (m).
+    :param n: The refractive index of the objective.
+    :param na: The numerical aperture of the objective.
+    :param transmission: The transmission ratio of the objective for the
+                         wavelength of the beam.
+    :param datamap_pixelsize: The size of a pixel in the simulated image (m).
+    :param profile: A tuple of values of :math:`kr` and of the radial integrals
+                    to interpolate (optional). By default, the integrals are
+                    computed.
+    :returns: A tuple of a 2D array of the intensity and of the profile.
+    '''
+    if profile is None:
+        _, _, kr = utils.focal_grid(beam.lambda_, n, na, datamap_pixelsize)
+        profile = (kr, numpy.array(beam.get_radial_integrals(n, na, kr)))
+    return beam.get_intensity(1, f, n, na, transmission, datamap_pixelsize, profile=profile), profile
+
+
+def get_detection_psf(fluo, detector, na, transmission, datamap_pixelsize):
+    '''Compute the fluorescence PSF and the resulting detection PSF. This is a
+    module level function such that it can be sent to worker processes.
+
+    :param fluo: A :class:`~pysted.base.Fluorescence` object.
+    :param detector: A :class:`~pysted.base.Detector` object.
+    :param na: The numerical aperture of the objective.
+    :param transmission: The transmission ratio of the objective for the
+                         fluorescence wavelength.
+    :param datamap_pixelsize: The size of a pixel in the simulated image (m).
+    :returns: A 2D array of the detection PSF.
+    '''
+    psf = fluo.get_psf(na, datamap_pixelsize)
+    return detector.get_detection_psf(fluo.lambda_, psf, na, transmission, datamap_pixelsize)
+
+
 class Microscope:
     '''This class implements a microscopy setup described by an excitation beam,
     a STED (depletion) beam, a detector, some fluorescence molecules, and the
@@ -902,15 +1119,25 @@ class Microscope:
     :param fluo: A :class:`~pysted.base.Fluorescence` object describing the
                  fluorescence molecules to be used.
     :param load_cache: A bool which determines whether or not the microscope's lasers will be generated from scratch
-                       (load_cache=False) or if they will be loaded from the previous save (load_cache=True). Generating
-                       the lasers from scratch can take a long time (takes longer as the pixel_size decreases), so
-                       loading the cache can save time when doing multiple experiments using the same pixel_size.
-                       It is
-                       important to use load_cache=True only if we know that the previously cached lasers were generated
-                       with the same pixel_size as the pixel_size which will be used in the current experiment.
+                       (load_cache=False) or if they will be loaded from the cache directory when available
+                       (load_cache=True). Generating the lasers from scratch can take a long time (takes longer as the
+                       pixel_size decreases), so loading the cache can save time when doing multiple experiments using
+                       the same pixel_size. The entries of the cache directory are identified by a hash of the
+                       parameters of the components and of the pixel size, such that an entry is only loaded if it was
+                       generated with the same parameters.
+    :param cache_dir: The path of the cache directory (see :class:`~pysted.laser_cache.LaserCache`).
+    :param cache_max_size: The maximal size of the cache directory (bytes). The least recently used entries are
+                           removed when it is exceeded.
+    :param resample_tol: If given, the lasers of a new pixel size are derived by interpolating the radial profiles of
+                         the beams computed for the previous pixel sizes, provided that the relative error of the
+                         interpolated integrals, verified on a few radii, does not exceed *resample_tol*. Otherwise,
+                         the profiles are computed from scratch. The detection PSF is always computed.
+    :param effective_cache_size: The maximal number of effective PSFs kept by :meth:`get_effective`. The least recently
+                                 used PSFs are discarded when it is exceeded. Use 0 to disable the cache.
     '''
 
-    def __init__(self, excitation, sted, detector, objective, fluo, load_cache=False):
+    def __init__(self, excitation, sted, detector, objective, fluo, load_cache=False,
+                 cache_dir=".microscope_cache", cache_max_size=2**30, resample_tol=None, effective_cache_size=128):
         self.excitation = excitation
         self.sted = sted
         self.detector = detector
@@ -921,22 +1148,15 @@ class Microscope:
 
         # caching system
         self.__cache = {}   # add all the elements used to compute lasers in the cache
-        cache_keys = ["lasers", "objective", "excitation", "sted", "fluo"]
-        if load_cache:
-            try:
-                self.__cache = pickle.load(open(".microscope_cache.pkl", "rb"))
-                flag = False
-                for key, values in self.__cache.items():
-                    if not all([ckey in values.keys() for ckey in cache_keys]):
-                        flag = True
-                if flag:
-                    self.__cache = {}
-
-            except Exception as e:
-                logging.warning("-----------------")
-                logging.warning(f"an error was caught while trying to load microscope cache")
-                logging.warning(e)
-                logging.warning("-----------------")
+        self.load_cache = load_cache
+        self.disk_cache = laser_cache.LaserCache(cache_dir, cache_max_size)
+        self.resample_tol = resample_tol
+        self.__profiles = {}   # radial profiles of the beams, reused with resample_tol
+        self.effective_cache_size = effective_cache_size
+        self.__effective = collections.OrderedDict()   # effective PSFs in least recently used order
+        self.effective_hits = 0
+        self.effective_misses = 0
+        self.__tables = {}   # interpolation tables of effective PSFs (see build_effective_table)
 
         # This will be used during the acquisition routine to make a better correspondance
         # between the microscope acquisition time steps and the Ca2+ flash time steps
@@ -946,80 +1166,348 @@ class Microscope:
     def __str__(self):
         return str(self.__cache.keys())
 
+    @property
+    def fingerprint(self):
+        '''The combined fingerprint of the components used to compute the
+        lasers (see :class:`~pysted.base.FingerprintMixin`).
+        '''
+        return hash((self.objective.fingerprint, self.excitation.fingerprint, self.sted.fingerprint,
+                     self.fluo.fingerprint, self.detector.fingerprint))
+
     def is_cached(self, datamap_pixelsize):
         '''Indicate the presence of a cache entry for the given pixel size.
 
         :param datamap_pixelsize: The size of a pixel in the simulated image (m).
         :returns: A boolean.
         '''
-        datamap_pixelsize_nm = int(datamap_pixelsize * 1e9)
-        return datamap_pixelsize_nm in self.__cache
+        return self.__is_valid(utils.pixelsize_key(datamap_pixelsize))
 
-    def cache(self, datamap_pixelsize, save_cache=False):
+    def cache(self, datamap_pixelsize, save_cache=False, executor=None, workers=None):
         '''Compute and cache the excitation and STED intensities, and the
         fluorescence PSF. These intensities are computed with a power of 1 W
         such that they can serve as a basis to compute intensities with any
         power.
 
+        The excitation intensity, the STED intensity and the detection PSF are
+        independent from each other. If an *executor* or a number of *workers*
+        is given, they are computed concurrently.
+
         :param datamap_pixelsize: The size of a pixel in the simulated image (m).
-        :param save_cache: A bool which determines whether or not the lasers will be saved to allow for faster load
-                           times for future experiments
+        :param save_cache: A bool which determines whether or not the lasers will be saved in the cache directory to
+                           allow for faster load times for future experiments
+        :param executor: A :class:`concurrent.futures.Executor` used to compute the
+                         components of the cache (optional).
+        :param workers: The number of worker processes used to compute the
+                        components of the cache if no *executor* is given
+                        (optional). By default, the components are computed
+                        sequentially.
         :returns: A tuple containing:
 
                   * A 2D array of the excitation intensity for a power of 1 W;
                   * A 2D array of the STED intensity for a a power of 1 W;
                   * A 2D array of the detection PSF.
         '''
+        key = utils.pixelsize_key(datamap_pixelsize)
+        if self.__is_valid(key) and not save_cache:
+            return self.__cache[key]["lasers"]
+        return self.cache_many([datamap_pixelsize], save_cache=save_cache, executor=executor, workers=workers)[0]
 
-        def compute_lasers(datamap_pixelsize_nm):
-            self.__cache[datamap_pixelsize_nm] = {}
-            f, n, na = self.objective.f, self.objective.n, self.objective.na
-
-            transmission = self.objective.get_transmission(self.excitation.lambda_)
-            i_ex = self.excitation.get_intensity(1, f, n, na,
-                                                 transmission, datamap_pixelsize)
-
-            transmission = self.objective.get_transmission(self.sted.lambda_)
-            i_sted = self.sted.get_intensity(1, f, n, na,
-                                             transmission, datamap_pixelsize)
-
-            transmission = self.objective.get_transmission(self.fluo.lambda_)
-            psf = self.fluo.get_psf(na, datamap_pixelsize)
-            # should take data_pixelsize instead of pixelsize, right? same for psf above?
-            psf_det = self.detector.get_detection_psf(self.fluo.lambda_, psf,
-                                                      na, transmission,
-                                                      datamap_pixelsize)
-            self.__cache[datamap_pixelsize_nm]["lasers"] = utils.resize(i_ex, i_sted, psf_det)
-            self.__cache[datamap_pixelsize_nm]["objective"] = self.objective
-            self.__cache[datamap_pixelsize_nm]["excitation"] = self.excitation
-            self.__cache[datamap_pixelsize_nm]["sted"] = self.sted
-            self.__cache[datamap_pixelsize_nm]["fluo"] = self.fluo
-
-        datamap_pixelsize_nm = int(datamap_pixelsize * 1e9)
-        if datamap_pixelsize_nm not in self.__cache:
-            compute_lasers(datamap_pixelsize_nm)
-        elif (self.__cache[datamap_pixelsize_nm]["objective"] != self.objective) or \
-             (self.__cache[datamap_pixelsize_nm]["excitation"] != self.excitation) or \
-             (self.__cache[datamap_pixelsize_nm]["sted"] != self.sted) or \
-             (self.__cache[datamap_pixelsize_nm]["fluo"] != self.fluo):
-            compute_lasers(datamap_pixelsize_nm)
+    def cache_many(self, datamap_pixelsizes, save_cache=False, executor=None, workers=None):
+        '''Compute and cache the excitation and STED intensities, and the
+        detection PSF for multiple pixel sizes at once. See
+        :meth:`~pysted.base.Microscope.cache`.
+
+        All the components of all the missing pixel sizes are submitted
+        together, which keeps every worker busy when using an *executor* or
+        multiple *workers*.
+
+        Example::
+
+            >>> microscope.cache_many([10e-9, 20e-9, 30e-9], workers=4)
+
+        :param datamap_pixelsizes: A sequence of pixel sizes of the simulated images (m).
+        :param save_cache: A bool which determines whether or not the lasers will be saved in the cache directory to
+                           allow for faster load times for future experiments
+        :param executor: A :class:`concurrent.futures.Executor` used to compute the
+                         components of the cache (optional).
+        :param workers: The number of worker processes used to compute the
+                        components of the cache if no *executor* is given
+                        (optional). By default, the components are computed
+                        sequentially.
+        :returns: A list of tuples of the excitation intensity, the STED
+                  intensity and the detection PSF, one per pixel size.
+        '''
+        missing = {}
+        for datamap_pixelsize in datamap_pixelsizes:
+            key = utils.pixelsize_key(datamap_pixelsize)
+            if self.__is_valid(key) or key in missing:
+                continue
+            lasers = self.disk_cache.load(self.__disk_key(key)) if self.load_cache else None
+            if lasers is None:
+                missing[key] = datamap_pixelsize
+            else:
+                self.__store(key, lasers)
+
+        if missing:
+            jobs = [self.__laser_jobs(datamap_pixelsize) for datamap_pixelsize in missing.values()]
+            if executor is None and workers is None:
+                results = [[func(*args) for func, args in job] for job in jobs]
+            else:
+                owns_executor = executor is None
+                if owns_executor:
+                    executor = concurrent.futures.ProcessPoolExecutor(max_workers=workers)
+                try:
+                    futures = [[executor.submit(func, *args) for func, args in job] for job in jobs]
+                    results = [[future.result() for future in job] for job in futures]
+                finally:
+                    if owns_executor:
+                        executor.shutdown()
+            for key, job, ((i_ex, profile_ex), (i_sted, profile_sted), psf_det) in zip(missing, jobs, results):
+                resampled = False
+                for name, beam, profile, (_, args) in zip(("excitation", "sted"), (self.excitation, self.sted),
+                                                          (profile_ex, profile_sted), job):
+                    if args[-1] is None:
+                        self.__add_profile(name, beam, profile)
+                    else:
+                        resampled = True
+                self.__store(key, utils.resize(i_ex, i_sted, psf_det), resampled)
 
         if save_cache:
-            pickle.dump(self.__cache, open(".microscope_cache.pkl", "wb"))
-        return self.__cache[datamap_pixelsize_nm]["lasers"]
+            for datamap_pixelsize in datamap_pixelsizes:
+                key = utils.pixelsize_key(datamap_pixelsize)
+                filename = self.disk_cache.filename(self.__disk_key(key))
+                if not self.__cache[key]["resampled"] and not os.path.exists(filename):
+                    self.disk_cache.save(self.__disk_key(key), self.__cache[key]["lasers"])
+        return [self.__cache[utils.pixelsize_key(datamap_pixelsize)]["lasers"]
+                for datamap_pixelsize in datamap_pixelsizes]
+
+    def __store(self, key, lasers, resampled=False):
+        '''Store the lasers of a pixel size in the cache with the components
+        used to compute them.
+
+        :param key: The key of the entry (see :func:`~pysted.utils.pixelsize_key`).
+        :param lasers: A tuple of the excitation intensity, the STED intensity
+                       and the detection PSF.
+        :param resampled: Whether the beams were interpolated from the profiles
+                          of other pixel sizes. Such entries are not saved in the
+                          cache directory.
+        '''
+        self.__cache[key] = {}
+        self.__cache[key]["lasers"] = lasers
+        self.__cache[key]["fingerprint"] = self.fingerprint
+        self.__cache[key]["resampled"] = resampled
+
+    def __add_profile(self, name, beam, profile):
+        '''Merge the radial profile of a beam computed for a pixel size with the
+        profiles computed for the other pixel sizes.
+
+        :param name: The name of the beam.
+        :param beam: The beam.
+        :param profile: A tuple of values of :math:`kr` and of the radial
+                        integrals.
+        '''
+        if self.resample_tol is None:
+            return
+        fingerprint = (beam.fingerprint, self.objective.fingerprint)
+        if name in self.__profiles and self.__profiles[name][0] == fingerprint:
+            nodes, values = self.__profiles[name][1]
+            nodes = numpy.concatenate((nodes, profile[0]))
+            values = numpy.concatenate((values, profile[1]), axis=1)
+            nodes, idx = numpy.unique(nodes, return_index=True)
+            profile = (nodes, values[:, idx])
+        self.__profiles[name] = (fingerprint, profile)
+
+    def __resampling_profile(self, name, beam, datamap_pixelsize):
+        '''Find a radial profile from which the intensity of a beam can be
+        interpolated within :attr:`resample_tol`.
+
+        :param name: The name of the beam.
+        :param beam: The beam.
+        :param datamap_pixelsize: The size of a pixel in the simulated image (m).
+        :returns: A tuple of values of :math:`kr` and of the radial integrals, or
+                  ``None`` if the intensity must be computed.
+        '''
+        if self.resample_tol is None or name not in self.__profiles:
+            return None
+        fingerprint, profile = self.__profiles[name]
+        if fingerprint != (beam.fingerprint, self.objective.fingerprint):
+            return None
+        n, na = self.objective.n, self.objective.na
+        _, _, kr = utils.focal_grid(beam.lambda_, n, na, datamap_pixelsize)
+        error = utils.resampling_error(profile, partial(beam.get_radial_integrals, n, na), kr)
+        return profile if error <= self.resample_tol else None
+
+    def __disk_key(self, key):
+        '''Compute the key of the entry of the cache directory of a pixel size.
+
+        :param key: The key of the pixel size (see :func:`~pysted.utils.pixelsize_key`).
+        :returns: An hexadecimal string.
+        '''
+        return laser_cache.stable_hash(self.objective, self.excitation, self.sted, self.fluo, self.detector, key)
+
+    def __is_valid(self, key):
+        '''Indicate whether the cache entry of the given pixel size exists and
+        was computed with the current components.
+
+        :param key: The key of the entry (see :func:`~pysted.utils.pixelsize_key`).
+        :returns: A boolean.
+        '''
+        entry = self.__cache.get(key)
+        return entry is not None and entry["fingerprint"] == self.fingerprint
+
+    def __laser_jobs(self, datamap_pixelsize):
+        '''List the independent computations required to cache the lasers of a
+        pixel size.
+
+        :param datamap_pixelsize: The size of a pixel in the simulated image (m).
+        :returns: A list of ``(function, arguments)`` tuples computing the
+                  excitation intensity, the STED intensity and the detection PSF.
+        '''
+        f, n, na = self.objective.f, self.objective.n, self.objective.na
+        transmission_ex = self.objective.get_transmission(self.excitation.lambda_)
+        transmission_sted = self.objective.get_transmission(self.sted.lambda_)
+        transmission_fluo = self.objective.get_transmission(self.fluo.lambda_)
+        profile_ex = self.__resampling_profile("excitation", self.excitation, datamap_pixelsize)
+        profile_sted = self.__resampling_profile("sted", self.sted, datamap_pixelsize)
+        return [
+            (get_beam_intensity, (self.excitation, f, n, na, transmission_ex, datamap_pixelsize, profile_ex)),
+            (get_beam_intensity, (self.sted, f, n, na, transmission_sted, datamap_pixelsize, profile_sted)),
+            (get_detection_psf, (self.fluo, self.detector, na, transmission_fluo, datamap_pixelsize))
+        ]
 
     def clear_cache(self):
         '''Empty the cache.
 
         .. important::
-           It is important to empty the cache if any of the components
-           :attr:`excitation`, :attr:`sted`, :attr:`detector`,
-           :attr:`objective`, or :attr:`fluorescence` are internally modified
-           or replaced.
+           Replacing a component or assigning one of its attributes is
+           detected through its fingerprint. It is important to empty the cache
+           if any of the components :attr:`excitation`, :attr:`sted`,
+           :attr:`detector`, :attr:`objective`, or :attr:`fluorescence` are
+           modified in place without calling
+           :meth:`~pysted.base.FingerprintMixin.invalidate_fingerprint`.
+
+        The entries of the cache directory are kept; use
+        ``microscope.disk_cache.clear()`` to remove them.
         '''
         self.__cache = {}
+        self.__profiles = {}
+        self.__effective = collections.OrderedDict()
+        self.__tables = {}
+
+    def build_effective_table(self, datamap_pixelsize, p_ex, p_sted, tol=None, save_cache=False):
+        '''Precompute the effective point spread functions on a grid of powers,
+        from which :meth:`get_effective` interpolates the powers within the
+        bounds of the grid with a bilinear interpolation. This makes spatially
+        varying powers about as cheap as uniform powers.
+
+        The error of the interpolation is estimated by computing the effective
+        PSFs at the center of every cell of the grid, where the interpolation
+        is the least accurate. Since the effective PSF varies the fastest at
+        low STED powers, a log-spaced grid of STED powers (e.g.
+        ``numpy.geomspace``) needs fewer nodes for the same error.
+
+        If :attr:`load_cache` is ``True``, the table is loaded from the cache
+        directory when it was saved with the same components and grid.
+
+        :param datamap_pixelsize: The size of one pixel of the simulated image (m).
+        :param p_ex: A 1D array of the time averaged powers of the excitation beam (W).
+        :param p_sted: A 1D array of the powers of the STED beam (W).
+        :param tol: The maximal relative error of the interpolation (optional).
+                    A :exc:`ValueError` is raised if the estimated error is
+                    larger, in which case the grid should be refined.
+        :param save_cache: Whether to save the table in the cache directory.
+        :returns: The estimated error, i.e. the largest absolute error at the
+                  center of a cell relative to the maximum of the effective PSF
+                  at this center.
+        '''
+        p_ex = numpy.unique(numpy.asarray(p_ex, dtype=numpy.float64))
+        p_sted = numpy.unique(numpy.asarray(p_sted, dtype=numpy.float64))
+        key = utils.pixelsize_key(datamap_pixelsize)
+        disk_key = laser_cache.stable_hash(self.objective, self.excitation, self.sted, self.fluo, self.detector, key,
+                                           "effective", p_ex, p_sted)
+
+        arrays = self.disk_cache.load(disk_key) if self.load_cache else None
+        if arrays is None:
+            effectives = self.get_effective_batch(datamap_pixelsize, numpy.repeat(p_ex, p_sted.size),
+                                                  numpy.tile(p_sted, p_ex.size))
+            effectives = effectives.reshape(p_ex.size, p_sted.size, *effectives.shape[1:])
+
+            # the bilinear interpolation at the center of a cell is the mean of its corners
+            ex_cells = (slice(None, -1), slice(1, None)) if p_ex.size > 1 else (slice(None), slice(None))
+            sted_cells = (slice(None, -1), slice(1, None)) if p_sted.size > 1 else (slice(None), slice(None))
+            interpolated = sum(effectives[i][:, j] for i in ex_cells for j in sted_cells) / 4
+            mid_ex = (p_ex[ex_cells[0]] + p_ex[ex_cells[1]]) / 2
+            mid_sted = (p_sted[sted_cells[0]] + p_sted[sted_cells[1]]) / 2
+            exact = self.get_effective_batch(datamap_pixelsize, numpy.repeat(mid_ex, mid_sted.size),
+                                             numpy.tile(mid_sted, mid_ex.size))
+            exact = exact.reshape(interpolated.shape)
+            peak = numpy.max(numpy.abs(exact), axis=(2, 3), keepdims=True)
+            peak[peak == 0] = 1
+            error_map = numpy.max(numpy.abs(interpolated - exact) / peak, axis=(0, 1))
+        else:
+            effectives = numpy.stack(arrays[:-1]).reshape(p_ex.size, p_sted.size, *arrays[-1].shape)
+            error_map = arrays[-1]
+
+        error = float(numpy.max(error_map))
+        if tol is not None and error > tol:
+            raise ValueError(f"The estimated error of the interpolation ({error:.3g}) exceeds the tolerance "
+                             f"({tol:.3g}), the grid of powers should be refined")
+
+        self.__tables[key] = {}
+        self.__tables[key]["p_ex"] = p_ex
+        self.__tables[key]["p_sted"] = p_sted
+        self.__tables[key]["effectives"] = effectives
+        self.__tables[key]["error"] = error
+        self.__tables[key]["fingerprint"] = self.fingerprint
+
+        if save_cache and arrays is None:
+            self.disk_cache.save(disk_key, list(effectives.reshape(-1, *error_map.shape)) + [error_map])
+        return error
 
     def get_effective(self, datamap_pixelsize, p_ex, p_sted):
+        '''Return the effective point spread function of the given pixel size
+        and powers (see :meth:`compute_effective`). The most recently used
+        effective PSFs are kept in memory, up to :attr:`effective_cache_size`,
+        and the numbers of hits and misses are counted in
+        :attr:`effective_hits` and :attr:`effective_misses`. If a table was
+        built for the pixel size (see :meth:`build_effective_table`), the
+        powers within its bounds are interpolated instead.
+
+        .. important::
+           The returned array is shared by the subsequent calls with the same
+           arguments, so it must not be modified in place.
+
+        :param datamap_pixelsize: The size of one pixel of the simulated image (m).
+        :param p_ex: The time averaged power of the excitation beam (W).
+        :param p_sted: The power of the STED beam (W).
+        :returns: A 2D array of the intensity (W/molecule)
+        '''
+        pixelsize_key = utils.pixelsize_key(datamap_pixelsize)
+        fingerprint = self.fingerprint
+        table = self.__tables.get(pixelsize_key)
+        if table is not None and table["fingerprint"] == fingerprint and \
+                table["p_ex"][0] <= p_ex <= table["p_ex"][-1] and table["p_sted"][0] <= p_sted <= table["p_sted"][-1]:
+            return utils.bilinear_interpolate(table["p_ex"], table["p_sted"], table["effectives"], p_ex, p_sted)
+
+        if self.effective_cache_size <= 0:
+            return self.compute_effective(datamap_pixelsize, p_ex, p_sted)
+
+        key = (pixelsize_key, float(p_ex), float(p_sted))
+        entry = self.__effective.get(key)
+        if entry is not None and entry[0] == fingerprint:
+            self.__effective.move_to_end(key)
+            self.effective_hits += 1
+            return entry[1]
+
+        self.effective_misses += 1
+        effective = self.compute_effective(datamap_pixelsize, p_ex, p_sted)
+        self.__effective[key] = (fingerprint, effective)
+        self.__effective.move_to_end(key)
+        while len(self.__effective) > self.effective_cache_size:
+            self.__effective.popitem(last=False)
+        return effective
+
+    def compute_effective(self, datamap_pixelsize, p_ex, p_sted):
         '''Computes the effective point spread function, defined here as the spatial map of time averaged detected power per molecule, taking the sted de-excitation, anti-stoke excitation and the detector properties (detection psf and gating) into account.
 
         :param datamap_pixelsize: The size of one pixel of the simulated image (m).
@@ -1035,6 +1523,24 @@ class Microscope:
 
         Anti-stokes excitation at the beginnning of the period was by added by modeling the sted beam as an infinitely small pulse, similarly to the excitation pulse. This leads to an underestimation of its effect on the detected signal, since excitation by the STED beam near the end of the STED beam, for example, would have less time to be depleted.
         '''
+        return self.get_effective_batch(datamap_pixelsize, [p_ex], [p_sted])[0]
+
+    def get_effective_batch(self, datamap_pixelsize, p_ex, p_sted):
+        '''Compute the effective point spread functions of many pairs of powers
+        at once (see :meth:`compute_effective`). The cached lasers are shared by
+        all the pairs, which are evaluated in a single broadcasted expression.
+
+        :param datamap_pixelsize: The size of one pixel of the simulated image (m).
+        :param p_ex: A 1D array of the time averaged powers of the excitation beam (W).
+        :param p_sted: A 1D array of the powers of the STED beam (W), of the same
+                       length as *p_ex*.
+        :returns: A 3D array of the intensities (W/molecule), one per pair of
+                  powers.
+        '''
+        p_ex = numpy.asarray(p_ex, dtype=numpy.float64).reshape(-1, 1, 1)
+        p_sted = numpy.asarray(p_sted, dtype=numpy.float64).reshape(-1, 1, 1)
+        if p_ex.shape != p_sted.shape:
+            raise ValueError(f"p_ex and p_sted must have the same length, got {p_ex.size} and {p_sted.size}")
 
         h, c = scipy.constants.h, scipy.constants.c
         f, n, na = self.objective.f, self.objective.n, self.objective.na
@@ -1083,14 +1589,104 @@ class Microscope:
         # effective intensity of a single molecule (W) [Willig2006] eq. 3
         return excitation_probability * eta * psf_det
 
+    def __effective_basis(self, datamap_pixelsize, p_ex, p_sted, max_size=None):
+        '''Express the effective PSFs of many pairs of powers as linear
+        combinations of a few effective PSFs, such that a linear operation on
+        the effective PSFs only needs to be applied on the basis. The pairs
+        within the bounds of an interpolation table (see
+        :meth:`build_effective_table`) are combined from its nodes, as in
+        :meth:`get_effective`, and every other unique pair is an element of the
+        basis.
+
+        :param datamap_pixelsize: The size of one pixel of the simulated image (m).
+        :param p_ex: A 1D array of the time averaged powers of the excitation beam (W).
+        :param p_sted: A 1D array of the powers of the STED beam (W).
+        :param max_size: The maximal number of elements of the basis (optional).
+        :returns: A tuple of a 3D array of the basis and of a 2D array of the
+                  weights of the basis, with one row per pair of powers, or
+                  ``None`` if the basis would be larger than *max_size*.
+        '''
+        pairs, inverse = numpy.unique(numpy.stack((p_ex, p_sted), axis=1), axis=0, return_inverse=True)
+        table = self.__tables.get(utils.pixelsize_key(datamap_pixelsize))
+        if table is not None and table["fingerprint"] != self.fingerprint:
+            table = None
+
+        columns = {}   # column of every element of the basis in the weights
+        stencils = []
+        for pair_ex, pair_sted in pairs:
+            if table is not None and table["p_ex"][0] <= pair_ex <= table["p_ex"][-1] and \
+                    table["p_sted"][0] <= pair_sted <= table["p_sted"][-1]:
+                stencil = [(("table", *idx), weight)
+                           for idx, weight in utils.bilinear_stencil(table["p_ex"], table["p_sted"], pair_ex, pair_sted)]
+            else:
+                stencil = [(("exact", pair_ex, pair_sted), 1.)]
+            for element, _ in stencil:
+                columns.setdefault(element, len(columns))
+            stencils.append(stencil)
+        if max_size is not None and len(columns) > max_size:
+            return None
+
+        weights = numpy.zeros((len(pairs), len(columns)))
+        for row, stencil in enumerate(stencils):
+            for element, weight in stencil:
+                weights[row, columns[element]] += weight
+
+        exact = [element for element in columns if element[0] == "exact"]
+        if exact:
+            _, exact_ex, exact_sted = zip(*exact)
+            exact = dict(zip(exact, self.get_effective_batch(datamap_pixelsize, exact_ex, exact_sted)))
+        basis = numpy.stack([exact[element] if element[0] == "exact" else table["effectives"][element[1:]]
+                             for element in columns])
+        return basis, weights[inverse.ravel()]
+
+    def __correlate(self, datamap_pixelsize, sub_datamaps_dict, acquired_intensity, pixel_list, ratio, p_ex, p_sted):
+        '''Acquire the intensity without bleaching by correlating the datamap
+        with the effective PSFs using the FFT. Non uniform powers are handled by
+        correlating every element of the basis of the effective PSFs (see
+        :meth:`__effective_basis`).
+
+        The correlation is only used when the estimated number of operations is
+        lower than the number of operations of the raster scan.
+
+        :param datamap_pixelsize: The size of one pixel of the simulated image (m).
+        :param sub_datamaps_dict: A dict of the sub datamaps to acquire.
+        :param acquired_intensity: A 2D array to which the acquired intensity is added.
+        :param pixel_list: A 2D array of the rows and columns of the pixels to acquire.
+        :param ratio: The ratio between the pixel size of the acquisition and *datamap_pixelsize*.
+        :param p_ex: A 2D array of the excitation power of every pixel of the ROI (W).
+        :param p_sted: A 2D array of the STED power of every pixel of the ROI (W).
+        :returns: Whether the intensity was acquired.
+        '''
+        rows, cols = pixel_list[:, 0], pixel_list[:, 1]
+        if rows.size == 0:
+            return True
+        datamap = sum(sub_datamaps_dict.values()).astype(numpy.float64)
+        h, w = self.cache(datamap_pixelsize)[0].shape
+        max_size = int(rows.size * h * w / (datamap.size * max(numpy.log2(datamap.size), 1)))
+        decomposition = self.__effective_basis(datamap_pixelsize, p_ex[rows, cols], p_sted[rows, cols], max_size)
+        if decomposition is None:
+            return False
+        basis, weights = decomposition
+
+        values = numpy.zeros(rows.size)
+        for element, element_weights in zip(basis, weights.T):
+            # both arrays are positive, which removes the round-off of the FFT
+            correlation = numpy.maximum(utils.correlate_valid(datamap, element), 0)
+            values += element_weights * correlation[rows, cols]
+        numpy.add.at(acquired_intensity, (rows // ratio, cols // ratio), values)
+        return True
+
     def get_signal_and_bleach(self, datamap, pixelsize, pdt, p_ex, p_sted, indices=None, acquired_intensity=None,
                               pixel_list=None, bleach=True, update=True, seed=None, filter_bypass=False,
                               bleach_func=bleach_funcs.default_update_survival_probabilities, steps=None,
-                              prob_ex=None, prob_sted=None, bleach_mode="default"):
+                              prob_ex=None, prob_sted=None, bleach_mode="default", num_threads=None, frame=0,
+                              workspace=None):
         """
         This function acquires the signal and bleaches simultaneously. It makes a call to compiled C code for speed,
         so make sure the raster.pyx file is compiled!
-        :param datamap: The datamap on which the acquisition is done, either a Datamap object or TemporalDatamap
+        :param datamap: The datamap on which the acquisition is done, either a Datamap object, a TemporalDatamap or a
+                        SparseDatamap. A SparseDatamap only supports the bleaching models of
+                        bleach_funcs.BLEACH_MODELS and no steps.
         :param pixelsize: The pixelsize of the acquisition. (m)
         :param pdt: The pixel dwelltime. Can be either a single float value or an array of the same size as the ROI
                     being imaged. (s)
@@ -1104,26 +1700,48 @@ class Microscope:
                                    flashes can occur mid acquisition. Leave as None if it is not the case. (array)
         :param pixel_list: The list of pixels to be iterated on. If none, a pixel_list of a raster scan will be
                            generated. (list of tuples (row, col))
-        :param bleach: Determines whether bleaching is active or not. (Bool)
+        :param bleach: Determines whether bleaching is active or not. Without bleaching, the intensity is computed as a
+                       correlation of the datamap with the effective PSF using the FFT when it is faster. (Bool)
         :param update: Determines whether the datamap is updated in place. If set to false, the datamap can still be
                        updated later with the returned bleached datamap. (Bool)
-        :param seed: Sets a seed for the random number generator.
+        :param seed: Sets a seed for the random number generator. If None, a seed is drawn from the entropy of the
+                     system (see utils.seed_verifier).
         :param filter_bypass: Whether or not to filter the pixel list.
                               This is useful if you know your pixel list is adequate and ordered differently from a
                               raster scan (i.e. a left to right, row by row scan), as filtering the list returns it
                               in raster order.
                               If pixel_list is none, this must be True then.
-        :param bleach_func: The bleaching function to be applied.
+        :param bleach_func: The bleaching function to be applied, or the name of a bleaching model of
+                            bleach_funcs.BLEACH_MODELS (e.g. "default" or "proportional"). The models of
+                            bleach_funcs.BLEACH_MODELS, given by name or by function, are evaluated in C, any other
+                            function is called for every pixel.
         :param steps: list containing the pixeldwelltimes for the sub steps of an acquisition. Is none by default.
                       Should be used if trying to implement a DyMin type acquisition, where decisions are made
                       after some time on whether or not to continue the acq.
+        :param num_threads: The number of threads on which a bleaching raster scan is distributed, or 0 to use all the
+                            cores. The rows of the scan are acquired concurrently, each one lagging the previous one by
+                            the width of the lasers. The random numbers are drawn from a counter-based generator, such
+                            that the result does not depend on the number of threads. Only supported for a raster scan
+                            (pixel_list is None) with uniform powers and dwelltime and a bleaching model of
+                            bleach_funcs.BLEACH_MODELS. If None,
+                            the sequential scan is used.
+        :param frame: The index of the frame in a sequence of acquisitions with the same seed. The random numbers of
+                      an acquisition are keyed by the seed, the frame and the pixel, such that they do not depend on the
+                      order in which the pixels are acquired.
+        :param workspace: An :class:`AcquisitionWorkspace` bound to this microscope, the datamap and the pixelsize,
+                          whose buffers are reused instead of being allocated by every acquisition. Not supported for a
+                          SparseDatamap.
         :return: returned_acquired_photons, the acquired photon for the acquisition.
                  bleached_sub_datamaps_dict, a dict containing the results of bleaching on the subdatamaps
                  acquired_intensity, the intensity of the acquisition, used for interrupted acquisitions
         """
 
-        if seed is not None:
-            numpy.random.seed(seed)
+        if isinstance(datamap, SparseDatamap):
+            if workspace is not None:
+                raise ValueError("An AcquisitionWorkspace is not supported for a SparseDatamap.")
+            return self.__get_signal_and_bleach_sparse(datamap, pixelsize, pdt, p_ex, p_sted, acquired_intensity,
+                                                       pixel_list, bleach, update, seed, filter_bypass, bleach_func,
+                                                       steps, frame)
         datamap_pixelsize = datamap.pixelsize
         i_ex, i_sted, psf_det = self.cache(datamap_pixelsize)
 
@@ -1136,11 +1754,29 @@ class Microscope:
 
         # convert scalar values to arrays if they aren't already arrays
         # C funcs need pre defined types, so in order to only have 1 general case C func, I convert scalars to arrays
-        pdt = utils.float_to_array_verifier(pdt, datamap_roi.shape)
-        p_ex = utils.float_to_array_verifier(p_ex, datamap_roi.shape)
-        p_sted = utils.float_to_array_verifier(p_sted, datamap_roi.shape)
-
-        if not filter_bypass:
+        if workspace is None:
+            pdt = utils.float_to_array_verifier(pdt, datamap_roi.shape)
+            p_ex = utils.float_to_array_verifier(p_ex, datamap_roi.shape)
+            p_sted = utils.float_to_array_verifier(p_sted, datamap_roi.shape)
+        else:
+            workspace.verify(self, datamap, pixelsize)
+            pdt = workspace.get_array("pdt", pdt)
+            p_ex = workspace.get_array("p_ex", p_ex)
+            p_sted = workspace.get_array("p_sted", p_sted)
+
+        bleach_model, _ = bleach_funcs.get_bleach_model(bleach_func)
+        if num_threads is not None and bleach:
+            if pixel_list is not None or steps is not None or bleach_model is None:
+                raise ValueError("num_threads is only supported for a raster scan with a bleaching model of "
+                                 "bleach_funcs.BLEACH_MODELS.")
+            if not (numpy.all(pdt == pdt[0, 0]) and numpy.all(p_ex == p_ex[0, 0]) and numpy.all(p_sted == p_sted[0, 0])):
+                raise ValueError("num_threads is only supported for uniform powers and dwelltime.")
+            if num_threads == 0:
+                num_threads = os.cpu_count()
+
+        if workspace is not None:
+            pixel_list = workspace.get_pixel_list(pixel_list, filter_bypass)
+        elif not filter_bypass:
             pixel_list = utils.pixel_list_filter(datamap_roi, pixel_list, pixelsize, datamap_pixelsize)
 
         # *** VÉRIFIER SI CE TO DO LÀ EST FAIT ***
@@ -1155,6 +1791,8 @@ class Microscope:
         rows_pad, cols_pad = datamap.roi_corners['tl'][0], datamap.roi_corners['tl'][1]
         laser_pad = i_ex.shape[0] // 2
 
+        if workspace is not None and prob_ex is None and prob_sted is None:
+            prob_ex, prob_sted = workspace.reset_prob()
         if prob_ex is None:
             prob_ex = numpy.ones(datamap.whole_datamap.shape)
         if prob_sted is None:
@@ -1163,11 +1801,13 @@ class Microscope:
         bleached_sub_datamaps_dict = {}
         if isinstance(indices, type(None)):
             indices = {"flashes": 0}
-        for key in datamap.sub_datamaps_dict:
-            bleached_sub_datamaps_dict[key] = numpy.copy(datamap.sub_datamaps_dict[key].astype(numpy.int64))
+        if workspace is not None:
+            bleached_sub_datamaps_dict = workspace.get_sub_datamaps()
+        else:
+            for key in datamap.sub_datamaps_dict:
+                bleached_sub_datamaps_dict[key] = numpy.copy(datamap.sub_datamaps_dict[key].astype(numpy.int64))
 
-        if seed is None:
-            seed = 0
+        seed = utils.seed_verifier(seed)
 
         if steps is None:
             steps = [pdt]   # what will happen if i input an array for pdt originally ???
@@ -1175,29 +1815,44 @@ class Microscope:
             for idx, step in enumerate(steps):
                 steps[idx] = utils.float_to_array_verifier(step, datamap_roi.shape)
 
-        raster_func = raster.raster_func_c_self_bleach_split_g
-        sample_func = bleach_funcs.sample_molecules
-        raster_func(self, datamap, acquired_intensity, numpy.array(pixel_list).astype(numpy.int32), ratio, rows_pad,
-                    cols_pad, laser_pad, prob_ex, prob_sted, pdt, p_ex, p_sted, bleach, bleached_sub_datamaps_dict,
-                    seed, bleach_func, sample_func, steps)
+        if workspace is None:
+            pixel_list = numpy.array(pixel_list).astype(numpy.int32).reshape(-1, 2)
+        if num_threads is not None and bleach:
+            raster.raster_func_wavefront(self, datamap, acquired_intensity, ratio, pdt[0, 0], p_ex[0, 0], p_sted[0, 0],
+                                         bleach, bleached_sub_datamaps_dict, seed, num_threads, frame, bleach_model)
+        elif bleach or not self.__correlate(datamap_pixelsize, bleached_sub_datamaps_dict, acquired_intensity,
+                                            pixel_list, ratio, p_ex, p_sted):
+            raster_func = raster.raster_func_c_self_bleach_split_g
+            sample_func = bleach_funcs.sample_molecules
+            raster_func(self, datamap, acquired_intensity, pixel_list, ratio, rows_pad, cols_pad, laser_pad, prob_ex,
+                        prob_sted, pdt, p_ex, p_sted, bleach, bleached_sub_datamaps_dict, seed, bleach_func,
+                        sample_func, steps, frame)
 
         # Bleaching is done, the rest is for intensity calculation
         photons = self.fluo.get_photons(acquired_intensity)
 
         if photons.shape == pdt.shape:
-            returned_acquired_photons = self.detector.get_signal(photons, pdt, self.sted.rate, seed=seed)
+            returned_acquired_photons = self.detector.get_signal(photons, pdt, self.sted.rate, seed=seed,
+                                                                 **self.detector.get_stream_kwargs(frame))
         else:
             pixeldwelltime_reshaped = numpy.zeros((int(numpy.ceil(pdt.shape[0] / ratio)),
                                                    int(numpy.ceil(pdt.shape[1] / ratio))))
             new_pdt_plist = utils.pixel_sampling(pixeldwelltime_reshaped, mode='all')
             for (row, col) in new_pdt_plist:
                 pixeldwelltime_reshaped[row, col] = pdt[row * ratio, col * ratio]
-            returned_acquired_photons = self.detector.get_signal(photons, pixeldwelltime_reshaped, self.sted.rate, seed=seed)
+            returned_acquired_photons = self.detector.get_signal(photons, pixeldwelltime_reshaped, self.sted.rate, seed=seed,
+                                                                 **self.detector.get_stream_kwargs(frame))
 
-        unbleached_whole_datamap = numpy.copy(datamap.whole_datamap)
+        if workspace is not None:
+            unbleached_whole_datamap = workspace.copy_whole_datamap()
+        else:
+            unbleached_whole_datamap = numpy.copy(datamap.whole_datamap)
 
         if update and bleach:
-            datamap.sub_datamaps_dict = bleached_sub_datamaps_dict
+            if workspace is not None:
+                datamap.sub_datamaps_dict = workspace.copy_sub_datamaps(bleached_sub_datamaps_dict)
+            else:
+                datamap.sub_datamaps_dict = bleached_sub_datamaps_dict
             datamap.base_datamap = datamap.sub_datamaps_dict["base"]
             datamap.whole_datamap = numpy.copy(datamap.base_datamap)
             # BLEACHER LES FLASHS FUTURS
@@ -1213,11 +1868,96 @@ class Microscope:
 
         return returned_acquired_photons, bleached_sub_datamaps_dict, temporal_acq_elts
 
-    def get_signal_rescue(self, datamap, pixelsize, pdt, p_ex, p_sted, pixel_list=None, bleach=True, update=True,
-                          lower_th=1, ltr=0.1, upper_th=100):
+    def __get_signal_and_bleach_sparse(self, datamap, pixelsize, pdt, p_ex, p_sted, acquired_intensity, pixel_list,
+                                       bleach, update, seed, filter_bypass, bleach_func, steps, frame):
         """
-        Function to bleach the datamap as the signal is acquired using RESCue method (EN PARLER PLUS ET METTRE UNE
-        CITATION AU PAPIER OU QQCHOSE UNE FOIS QUE J'AURAI RELU L'ARTICLE ET TOUT)
+        Implements :meth:`get_signal_and_bleach` for a :class:`SparseDatamap`. The powers and the dwelltime are kept as
+        (1, 1) arrays when they are scalars, such that no array of the size of the ROI is allocated except the image.
+        """
+        bleach_model, _ = bleach_funcs.get_bleach_model(bleach_func)
+        if bleach_model is None or steps is not None:
+            raise ValueError("A SparseDatamap only supports the bleaching models of bleach_funcs.BLEACH_MODELS, "
+                             "without steps.")
+        datamap_pixelsize = datamap.pixelsize
+        i_ex, _, _ = self.cache(datamap_pixelsize)
+        if datamap.roi is None:
+            datamap.set_roi(i_ex, "max")
+        roi_shape = datamap.roi_shape
+
+        if isinstance(pdt, (float, numpy.floating)):
+            pdt = numpy.full((1, 1), pdt)
+        else:
+            pdt = utils.float_to_array_verifier(pdt, roi_shape)
+        if isinstance(p_ex, (float, numpy.floating)):
+            p_ex = numpy.full((1, 1), p_ex)
+        else:
+            p_ex = utils.float_to_array_verifier(p_ex, roi_shape)
+        if isinstance(p_sted, (float, numpy.floating)):
+            p_sted = numpy.full((1, 1), p_sted)
+        else:
+            p_sted = utils.float_to_array_verifier(p_sted, roi_shape)
+
+        ratio = utils.pxsize_ratio(pixelsize, datamap_pixelsize)
+        rows, cols = numpy.meshgrid(numpy.arange(0, roi_shape[0], ratio), numpy.arange(0, roi_shape[1], ratio),
+                                    indexing="ij")
+        raster_list = numpy.stack((rows.ravel(), cols.ravel()), axis=-1)
+        if pixel_list is None:
+            pixel_list = raster_list
+        else:
+            pixel_list = numpy.array(pixel_list).reshape(-1, 2)
+            if not filter_bypass:
+                valid = (pixel_list[:, 0] % ratio == 0) & (pixel_list[:, 1] % ratio == 0) & \
+                        (pixel_list >= 0).all(axis=1) & (pixel_list[:, 0] < roi_shape[0]) & \
+                        (pixel_list[:, 1] < roi_shape[1])
+                pixel_list = pixel_list[valid]
+                _, first = numpy.unique(pixel_list, axis=0, return_index=True)
+                pixel_list = pixel_list[numpy.sort(first)]
+                if len(pixel_list) == 0:
+                    warnings.warn(" \nNo pixels in the list passed is valid given the ratio between pixel sizes, \n"
+                                  "Iterating on valid pixels in a raster scan instead.")
+                    pixel_list = raster_list
+        pixel_list = numpy.ascontiguousarray(pixel_list, dtype=numpy.int32)
+
+        if acquired_intensity is None:
+            acquired_intensity = numpy.zeros((int(numpy.ceil(roi_shape[0] / ratio)),
+                                              int(numpy.ceil(roi_shape[1] / ratio))))
+
+        bleached_sub_datamaps_dict = {}
+        for key in datamap.sub_datamaps_dict:
+            bleached_sub_datamaps_dict[key] = numpy.copy(datamap.sub_datamaps_dict[key].astype(numpy.int64))
+
+        seed = utils.seed_verifier(seed)
+
+        raster.raster_func_sparse(self, datamap, acquired_intensity, pixel_list, ratio, pdt, p_ex, p_sted, bleach,
+                                  bleached_sub_datamaps_dict, seed, frame, bleach_model)
+
+        photons = self.fluo.get_photons(acquired_intensity)
+        if pdt.shape == (1, 1):
+            pixeldwelltime_reshaped = pdt[0, 0]
+        else:
+            pixeldwelltime_reshaped = pdt[::ratio, ::ratio]
+        returned_acquired_photons = self.detector.get_signal(photons, pixeldwelltime_reshaped, self.sted.rate,
+                                                             seed=seed, **self.detector.get_stream_kwargs(frame))
+
+        if update and bleach:
+            datamap.sub_datamaps_dict = bleached_sub_datamaps_dict
+
+        temporal_acq_elts = {"intensity": acquired_intensity,
+                             "prob_ex": None,
+                             "prob_sted": None}
+
+        return returned_acquired_photons, bleached_sub_datamaps_dict, temporal_acq_elts
+
+    def get_signal_rescue(self, datamap, pixelsize, pdt, p_ex, p_sted, pixel_list=None, bleach=True, update=True,
+                          lower_th=1, ltr=0.1, upper_th=100, seed=None, filter_bypass=False,
+                          bleach_func=bleach_funcs.default_update_survival_probabilities, frame=0):
+        """
+        Function to bleach the datamap as the signal is acquired using RESCue method (Staudt et al., 2011, Far-field
+        optical nanoscopy with reduced number of state transition cycles). Every pixel is first illuminated for
+        (pdt * ltr) seconds: under lower_th photons, the illumination of the pixel is stopped and no photon is
+        returned. The pixel is otherwise illuminated for the remaining time: over upper_th photons, the photons of both
+        illuminations are extrapolated from their total dwelltime to pdt (see raster.step_table). The acquisition is
+        done by the compiled kernel raster.raster_func_adaptive.
         :param datamap: A Datamap object containing the relevant molecule disposition information, pixel size and ROI.
         :param pixelsize: Grid size for the laser movement. Has to be a multiple of datamap.pixelsize. (m)
         :param pdt: Time spent by the lasers on each pixel. Can be a float or an array of floats of same shape as
@@ -1232,20 +1972,18 @@ class Microscope:
         :param update: A bool which determines whether or not the Datamap object will be updated with the bleaching.
                        Set to True by default.
         :param lower_th: The minimum number of photons we wish to detect on a pixel in (pdt * ltr) seconds to determine
-                         if we continue illuminating the pixel.
+                         if we continue illuminating the pixel. If None, the illumination is never stopped.
         :param ltr: The ratio of the pdt time in which we will decide whether or not we continue illuminating the pixel.
-        :param upper_th: The maximum number of photons we wish to detect on a pixel in (pdt * utr) seconds before moving
-                         to the next pixel.
-        :param utr: The ratio of the pdt time in which we will decide wether or not enough photons have already been
-                    detected in order to move on to the next pixel before ellapsing the whole pdt time.
+        :param upper_th: The maximum number of photons we wish to detect on a pixel in the remaining (pdt * (1 - ltr))
+                         seconds. If None, the photons are never extrapolated.
+        :param seed: Sets a seed for the random number generator. If None, a seed is drawn from the entropy of the
+                     system (see utils.seed_verifier).
+        :param filter_bypass: Whether or not to filter the pixel list, see get_signal_and_bleach.
+        :param bleach_func: The bleaching function to be applied, or the name of a bleaching model of
+                            bleach_funcs.BLEACH_MODELS, see get_signal_and_bleach.
+        :param frame: The index of the frame in a sequence of acquisitions with the same seed.
         :returns: The acquired detected photons, and the bleached datamap.
         """
-        #TODO : Pouvoir mettre None à upper_th
-        datamap_roi = datamap.whole_datamap[datamap.roi]
-        pdt = utils.float_to_array_verifier(pdt, datamap_roi.shape)
-        p_ex = utils.float_to_array_verifier(p_ex, datamap_roi.shape)
-        p_sted = utils.float_to_array_verifier(p_sted, datamap_roi.shape)
-
         datamap_pixelsize = datamap.pixelsize
         i_ex, i_sted, psf_det = self.cache(datamap_pixelsize)
         if datamap.roi is None:
@@ -1253,58 +1991,39 @@ class Microscope:
             datamap.set_roi(i_ex)
 
         datamap_roi = datamap.whole_datamap[datamap.roi]
-        pixel_list = utils.pixel_list_filter(datamap_roi, pixel_list, pixelsize, datamap_pixelsize)
+        pdt = utils.float_to_array_verifier(pdt, datamap_roi.shape)
+        p_ex = utils.float_to_array_verifier(p_ex, datamap_roi.shape)
+        p_sted = utils.float_to_array_verifier(p_sted, datamap_roi.shape)
+
+        if not filter_bypass:
+            pixel_list = utils.pixel_list_filter(datamap_roi, pixel_list, pixelsize, datamap_pixelsize)
+        pixel_list = numpy.array(pixel_list).astype(numpy.int32).reshape(-1, 2)
 
         ratio = utils.pxsize_ratio(pixelsize, datamap_pixelsize)
-        rows_pad, cols_pad = datamap.roi_corners['tl'][0], datamap.roi_corners['tl'][1]
-        laser_pad = i_ex.shape[0] // 2
+        shape = (int(numpy.ceil(datamap_roi.shape[0] / ratio)), int(numpy.ceil(datamap_roi.shape[1] / ratio)))
+        returned_photons = numpy.zeros(shape)
+        steps_taken = numpy.zeros(shape, dtype=numpy.int32)
+        outcomes = numpy.zeros(shape, dtype=numpy.int32)
 
-        prob_ex = numpy.ones(datamap.whole_datamap.shape)
-        prob_sted = numpy.ones(datamap.whole_datamap.shape)
-        bleached_datamap = numpy.copy(datamap.whole_datamap)
-        returned_photons = numpy.zeros(datamap.whole_datamap[datamap.roi].shape)
-
-        for (row, col) in pixel_list:
-            effective = self.get_effective(datamap_pixelsize, p_ex[row, col], p_sted[row, col])
-            row_slice = slice(row + rows_pad - laser_pad, row + rows_pad + laser_pad + 1)
-            col_slice = slice(col + cols_pad - laser_pad, col + cols_pad + laser_pad + 1)
-
-            pixel_intensity = numpy.sum(effective * datamap.whole_datamap[row_slice, col_slice])
-            pixel_photons = self.detector.get_signal(self.fluo.get_photons(pixel_intensity), pdt[row, col], self.sted.rate)
-            photons_per_sec = pixel_photons / pdt[row, col]
-            lt_time_photons = photons_per_sec * ltr * pdt[row, col]
-            if lower_th is None:
-                pass
-            elif lt_time_photons < lower_th:
-                pdt[row, col] = ltr * pdt[row, col]
-            else:
-                if upper_th is None:
-                    pass
-                elif pixel_photons > upper_th:
-                    # jpense pas que je dois mult par utr, je dois mult par le temps requis pour arriver à upper_th
-                    time_to_ut = upper_th / photons_per_sec
-                    pdt[row, col] = time_to_ut
-                else:
-                    pass
-
-            # ça serait tu mieux de calculer mon nombre de photons avec le photons_per_sec?
-            # i think so right?
-            rescue_pixel_photons = photons_per_sec * pdt[row, col]
-            # rescue_pixel_photons = self.detector.get_signal(self.fluo.get_photons(pixel_intensity), pdt[row, col])
-            returned_photons[int(row / ratio), int(col / ratio)] = rescue_pixel_photons
-
-            if bleach is True:
-                kwargs = {'i_ex': i_ex, 'i_sted': i_sted, 'fluo': self.fluo, 'excitation': self.excitation,
-                          'sted': self.sted, 'p_ex': p_ex[row, col], 'p_sted': p_sted[row, col],
-                          'pdt': pdt[row, col], 'prob_ex': prob_ex, 'prob_sted': prob_sted,
-                          'region': (row_slice, col_slice)}
-                prob_ex, prob_sted = self.bleach_func(**kwargs)
-                bleached_datamap[row_slice, col_slice] = \
-                    numpy.random.binomial(bleached_datamap[row_slice, col_slice],
-                                          prob_ex[row_slice, col_slice] * prob_sted[row_slice, col_slice])
-
-        if update:
-            datamap.whole_datamap = bleached_datamap
+        bleached_sub_datamaps_dict = {}
+        for key in datamap.sub_datamaps_dict:
+            bleached_sub_datamaps_dict[key] = numpy.copy(datamap.sub_datamaps_dict[key].astype(numpy.int64))
+
+        seed = utils.seed_verifier(seed)
+
+        # The decision times are given as fractions of the pixel dwelltime
+        table = raster.step_table([1., 1.], [-ltr, -(1 - ltr)], [-1. if lower_th is None else lower_th, -1.],
+                                  [-1., -1. if upper_th is None else upper_th], [True, True])
+        c_detect = type(self.detector).get_signal is Detector.get_signal
+        raster.raster_func_adaptive(self, datamap, returned_photons, steps_taken, outcomes, pixel_list, ratio, table,
+                                    pdt, p_ex, p_sted, bleach, bleached_sub_datamaps_dict, seed, bleach_func,
+                                    bleach_funcs.sample_molecules, frame, c_detect)
+
+        bleached_datamap = sum(bleached_sub_datamaps_dict.values())
+        if update and bleach:
+            datamap.sub_datamaps_dict = bleached_sub_datamaps_dict
+            datamap.base_datamap = datamap.sub_datamaps_dict["base"]
+            datamap.whole_datamap = numpy.copy(datamap.base_datamap)
 
         return returned_photons, bleached_datamap
 
@@ -1450,6 +2169,320 @@ class Datamap:
         self.whole_datamap = bleached_datamap
 
 
+class SparseDatamap:
+    """
+    This class implements a sparse alternative to :class:`Datamap` for large fields of view containing few labelled
+    structures. Only the occupied positions are stored, as a list of coordinates sorted in raster order (row by row,
+    left to right), with the number of molecules of every sub datamap at each position. The positions of a row are
+    indexed by the offset of the first position of every row, as in the CSR format, such that the positions inside the
+    footprint of the lasers are found with a binary search per row. The memory and the cost of an acquisition thus
+    scale with the number of occupied positions instead of the area of the datamap.
+
+    The sub datamaps are 1D arrays of counts aligned with :attr:`rows` and :attr:`cols`. They are bleached by
+    :meth:`~pysted.base.Microscope.get_signal_and_bleach` like the ones of a :class:`Datamap`, with the default bleaching
+    and sampling functions.
+
+    .. code-block:: python
+
+        datamap = base.SparseDatamap(rows, cols, counts, shape=(100000, 100000), datamap_pixelsize=10e-9)
+        datamap.set_roi(i_ex, "max")
+        signal, bleached, _ = microscope.get_signal_and_bleach(datamap, 10e-9, 10e-6, 1e-6, 0.)
+
+    :param rows: The row of every emitter position. (array of int)
+    :param cols: The column of every emitter position. (array of int)
+    :param counts: The number of molecules at every position. The counts of repeated positions are summed and the
+                   empty positions are dropped. (array of int)
+    :param shape: The shape of the whole datamap. (tuple)
+    :param datamap_pixelsize: The size of a pixel of the datamap. (m)
+    """
+
+    def __init__(self, rows, cols, counts, shape, datamap_pixelsize):
+        self.whole_shape = tuple(int(size) for size in shape)
+        self.pixelsize = datamap_pixelsize
+        self.roi = None
+        self.roi_corners = None
+        self.contains_sub_datamaps = {"base": True,
+                                      "flashes": False}
+        self.rows = numpy.zeros(0, dtype=numpy.int64)
+        self.cols = numpy.zeros(0, dtype=numpy.int64)
+        self.sub_datamaps_dict = {}
+        self.add_sub_datamap("base", rows, cols, counts)
+
+    @classmethod
+    def from_dense(cls, whole_datamap, datamap_pixelsize):
+        """
+        Builds a sparse datamap from the occupied positions of a dense array.
+
+        :param whole_datamap: The disposition of the molecules in the sample. (numpy array)
+        :param datamap_pixelsize: The size of a pixel of the datamap. (m)
+        :returns: A `SparseDatamap`.
+        """
+        rows, cols = numpy.nonzero(whole_datamap)
+        return cls(rows, cols, whole_datamap[rows, cols], whole_datamap.shape, datamap_pixelsize)
+
+    def __getitem__(self, key):
+        return self.sub_datamaps_dict[key]
+
+    def __index(self, rows, cols):
+        return rows * self.whole_shape[1] + cols
+
+    def add_sub_datamap(self, key, rows, cols, counts):
+        """
+        Adds a sub datamap. The positions of the sub datamaps are merged, such that all the sub datamaps remain aligned
+        with :attr:`rows` and :attr:`cols`.
+
+        :param key: The name of the sub datamap, e.g. "flashes".
+        :param rows: The row of every emitter position. (array of int)
+        :param cols: The column of every emitter position. (array of int)
+        :param counts: The number of molecules at every position. (array of int)
+        """
+        rows = numpy.asarray(rows, dtype=numpy.int64).ravel()
+        cols = numpy.asarray(cols, dtype=numpy.int64).ravel()
+        counts = numpy.broadcast_to(numpy.asarray(counts, dtype=numpy.int64), rows.shape)
+        if numpy.any(rows < 0) or numpy.any(rows >= self.whole_shape[0]) or \
+           numpy.any(cols < 0) or numpy.any(cols >= self.whole_shape[1]):
+            raise ValueError(f"Emitter positions must be within a datamap of shape {self.whole_shape}.")
+        occupied = counts > 0
+        new_index = self.__index(rows[occupied], cols[occupied])
+        index = numpy.union1d(self.__index(self.rows, self.cols), new_index)
+
+        for other in self.sub_datamaps_dict:
+            expanded = numpy.zeros(index.size, dtype=numpy.int64)
+            expanded[numpy.searchsorted(index, self.__index(self.rows, self.cols))] = self.sub_datamaps_dict[other]
+            self.sub_datamaps_dict[other] = expanded
+        layer = numpy.zeros(index.size, dtype=numpy.int64)
+        numpy.add.at(layer, numpy.searchsorted(index, new_index), counts[occupied])
+        if key in self.sub_datamaps_dict:
+            layer += self.sub_datamaps_dict[key]
+        self.sub_datamaps_dict[key] = layer
+        self.rows, self.cols = numpy.divmod(index, self.whole_shape[1])
+
+    def compact(self):
+        """
+        Removes the positions where every sub datamap is empty, e.g. after bleaching.
+        """
+        occupied = numpy.zeros(self.rows.size, dtype=bool)
+        for key in self.sub_datamaps_dict:
+            occupied |= self.sub_datamaps_dict[key] > 0
+        self.rows, self.cols = self.rows[occupied], self.cols[occupied]
+        for key in self.sub_datamaps_dict:
+            self.sub_datamaps_dict[key] = self.sub_datamaps_dict[key][occupied]
+
+    def row_index(self):
+        """
+        Returns the offset of the first position of every row, followed by the number of positions.
+
+        :returns: A 1D array of length ``whole_shape[0] + 1``.
+        """
+        return numpy.searchsorted(self.rows, numpy.arange(self.whole_shape[0] + 1)).astype(numpy.int64)
+
+    def to_dense(self, key=None):
+        """
+        Converts a sub datamap, or the sum of the sub datamaps, to a dense array.
+
+        :param key: The name of the sub datamap. If None, the sub datamaps are summed.
+        :returns: An array of shape :attr:`whole_shape`.
+        """
+        keys = self.sub_datamaps_dict.keys() if key is None else [key]
+        dense = numpy.zeros(self.whole_shape, dtype=numpy.int64)
+        for key in keys:
+            dense[self.rows, self.cols] += self.sub_datamaps_dict[key]
+        return dense
+
+    def set_roi(self, laser, intervals):
+        """
+        Uses a laser generated by the microscope object to determine the biggest ROI allowed, sets the ROI if valid
+        :param laser: An array of the same shape as the lasers which will be used on the datamap
+        :param intervals: Values to set the ROI to. Either 'max' or a dict like {'rows': [min_row, max_row],
+                          'cols': [min_col, max_col]}. If 'max', the whole datamap is padded with empty positions,
+                          which only shifts the coordinates of the emitters, and the original datamap is used as ROI.
+        """
+        rows_min, cols_min = laser.shape[0] // 2, laser.shape[1] // 2
+        rows_max, cols_max = self.whole_shape[0] - rows_min - 1, self.whole_shape[1] - cols_min - 1
+
+        if intervals == 'max':
+            if laser.shape[0] % 2 == 0 or laser.shape[1] % 2 == 0:
+                raise Exception(f"Laser shape has to be odd in order to have a well defined single pixel center")
+            rows_pad, cols_pad = rows_min, cols_min
+            self.rows = self.rows + rows_pad
+            self.cols = self.cols + cols_pad
+            self.whole_shape = (self.whole_shape[0] + 2 * rows_pad, self.whole_shape[1] + 2 * cols_pad)
+            intervals = {'rows': [rows_pad, self.whole_shape[0] - rows_pad - 1],
+                         'cols': [cols_pad, self.whole_shape[1] - cols_pad - 1]}
+
+        elif type(intervals) is dict:
+            if intervals['rows'][0] < rows_min or intervals['rows'][0] > rows_max or \
+               intervals['rows'][1] < rows_min or intervals['rows'][1] > rows_max or \
+               intervals['cols'][0] < cols_min or intervals['cols'][0] > cols_max or \
+               intervals['cols'][1] < cols_min or intervals['cols'][1] > cols_max:
+                raise ValueError(f"ROI missplaced for datamap of shape {self.whole_shape} with lasers of shape"
+                                 f"{laser.shape}. ROI intervals must be within bounds "
+                                 f"rows:[{rows_min}, {rows_max}], cols:[{cols_min}, {cols_max}].")
+
+        else:
+            raise ValueError("intervals parameter must be either 'max' or dict")
+
+        self.roi_corners = {'tl': (intervals['rows'][0], intervals['cols'][0]),
+                            'tr': (intervals['rows'][0], intervals['cols'][1]),
+                            'bl': (intervals['rows'][1], intervals['cols'][0]),
+                            'br': (intervals['rows'][1], intervals['cols'][1])}
+        self.roi = (slice(self.roi_corners['tl'][0], self.roi_corners['bl'][0] + 1),
+                    slice(self.roi_corners['tl'][1], self.roi_corners['br'][1] + 1))
+
+    @property
+    def roi_shape(self):
+        """
+        The shape of the ROI.
+        """
+        return (self.roi[0].stop - self.roi[0].start, self.roi[1].stop - self.roi[1].start)
+
+
+class AcquisitionWorkspace:
+    """
+    This class holds the buffers of the acquisitions of a :class:`Microscope` on a :class:`Datamap`, such that they are
+    allocated once and reused from one acquisition to the next, e.g. in a loop of many short acquisitions on a small
+    ROI. A workspace is bound to the microscope, the datamap, its ROI and the pixelsize of the acquisition, and it is
+    given to :meth:`~pysted.base.Microscope.get_signal_and_bleach`.
+
+    .. code-block:: python
+
+        workspace = base.AcquisitionWorkspace(microscope, datamap, pixelsize=20e-9)
+        for frame in range(1000):
+            signal, bleached, _ = microscope.get_signal_and_bleach(datamap, 20e-9, 10e-6, 1e-6, 0.,
+                                                                   workspace=workspace, frame=frame)
+
+    The bleached sub datamaps returned by an acquisition are views of the buffers of the workspace, they are
+    overwritten by the next acquisition, as are the survival probabilities of the temporal elements.
+
+    :param microscope: The microscope of the acquisitions.
+    :param datamap: The datamap of the acquisitions, its ROI is set with the lasers of the microscope if it is None.
+    :param pixelsize: The pixelsize of the acquisitions. (m)
+    """
+
+    def __init__(self, microscope, datamap, pixelsize):
+        self.microscope = microscope
+        self.datamap = datamap
+        self.pixelsize = pixelsize
+        i_ex, _, _ = microscope.cache(datamap.pixelsize)
+        if datamap.roi is None:
+            datamap.set_roi(i_ex)
+        self.roi = datamap.roi
+        self.roi_shape = datamap.whole_datamap[datamap.roi].shape
+
+        whole_shape = datamap.whole_datamap.shape
+        self.prob_ex = numpy.ones(whole_shape)
+        self.prob_sted = numpy.ones(whole_shape)
+        self.unbleached_whole_datamap = numpy.empty(whole_shape, dtype=datamap.whole_datamap.dtype)
+        self.layers = numpy.empty((0,) + whole_shape, dtype=numpy.int64)
+        self.keys = []
+        self.raster_pixel_list = numpy.array(
+            utils.pixel_list_filter(datamap.whole_datamap[datamap.roi], None, pixelsize, datamap.pixelsize)
+        ).astype(numpy.int32).reshape(-1, 2)
+        self.__arrays = {}
+
+    def verify(self, microscope, datamap, pixelsize):
+        """
+        Verifies that the workspace is bound to the microscope, the datamap, its ROI and the pixelsize of an
+        acquisition.
+
+        :param microscope: The microscope of the acquisition.
+        :param datamap: The datamap of the acquisition.
+        :param pixelsize: The pixelsize of the acquisition. (m)
+        """
+        if microscope is not self.microscope or datamap is not self.datamap or datamap.roi != self.roi or \
+                pixelsize != self.pixelsize:
+            raise ValueError("The workspace is bound to another microscope, datamap, ROI or pixelsize.")
+
+    def get_array(self, name, float_or_array):
+        """
+        Equivalent of :func:`~pysted.utils.float_to_array_verifier` for the shape of the ROI, which writes the array in
+        the buffer *name* of the workspace instead of allocating it. A buffer filled with a float is only filled again
+        if the float changes.
+
+        :param name: The name of the buffer, e.g. ``"pdt"``.
+        :param float_or_array: Either a float or an array of the shape of the ROI.
+        :returns: The buffer.
+        """
+        if name not in self.__arrays:
+            self.__arrays[name] = [numpy.empty(self.roi_shape), None]
+        buffer = self.__arrays[name]
+        if isinstance(float_or_array, (float, numpy.floating)):
+            if buffer[1] != float_or_array:
+                buffer[0].fill(float_or_array)
+                buffer[1] = float_or_array
+        elif type(float_or_array) is numpy.ndarray and self.roi_shape == float_or_array.shape:
+            numpy.copyto(buffer[0], float_or_array)
+            buffer[1] = None
+        else:
+            raise TypeError("Has to be either a float or an array of same shape as the ROI")
+        return buffer[0]
+
+    def get_pixel_list(self, pixel_list, filter_bypass):
+        """
+        Converts the pixel list of an acquisition to an int32 array, the raster scan of the ROI being built once.
+
+        :param pixel_list: The pixel list of the acquisition, or None for a raster scan.
+        :param filter_bypass: Whether or not to filter the pixel list, see
+                              :meth:`~pysted.base.Microscope.get_signal_and_bleach`.
+        :returns: An array of shape (N, 2).
+        """
+        if pixel_list is None:
+            return self.raster_pixel_list
+        if not filter_bypass:
+            pixel_list = utils.pixel_list_filter(self.datamap.whole_datamap[self.roi], pixel_list, self.pixelsize,
+                                                 self.datamap.pixelsize)
+        return numpy.array(pixel_list).astype(numpy.int32).reshape(-1, 2)
+
+    def get_sub_datamaps(self):
+        """
+        Copies the sub datamaps of the datamap in the layers of the workspace, which are reallocated only if the sub
+        datamaps change.
+
+        :returns: A dict of the layers by key, see :func:`~pysted.raster.stack_layers`.
+        """
+        sub_datamaps_dict = self.datamap.sub_datamaps_dict
+        keys = list(sub_datamaps_dict.keys())
+        # the layers are bleached in place by the acquisition, they must never be the arrays of the datamap
+        if keys != self.keys or any(numpy.may_share_memory(sub_datamaps_dict[key], self.layers) for key in keys):
+            self.layers = numpy.empty((len(keys),) + self.datamap.whole_datamap.shape, dtype=numpy.int64)
+            self.keys = keys
+        for layer, key in enumerate(keys):
+            numpy.copyto(self.layers[layer], sub_datamaps_dict[key], casting="unsafe")
+        return {key: self.layers[layer] for layer, key in enumerate(keys)}
+
+    def copy_sub_datamaps(self, bleached_sub_datamaps_dict):
+        """
+        Copies the bleached sub datamaps of an acquisition in arrays owned by the datamap, such that the next
+        acquisitions, which bleach the layers of the workspace in place, do not modify the datamap.
+
+        :param bleached_sub_datamaps_dict: The bleached sub datamaps returned by :meth:`get_sub_datamaps`.
+        :returns: A dict of the copies by key.
+        """
+        return {key: numpy.copy(bleached_sub_datamaps_dict[key]) for key in bleached_sub_datamaps_dict}
+
+    def copy_whole_datamap(self):
+        """
+        Copies the whole datamap of the datamap in the buffer of the unbleached datamap.
+
+        :returns: The buffer.
+        """
+        whole_datamap = self.datamap.whole_datamap
+        if self.unbleached_whole_datamap.dtype != whole_datamap.dtype:
+            self.unbleached_whole_datamap = numpy.empty(whole_datamap.shape, dtype=whole_datamap.dtype)
+        numpy.copyto(self.unbleached_whole_datamap, whole_datamap)
+        return self.unbleached_whole_datamap
+
+    def reset_prob(self):
+        """
+        Resets the survival probabilities of the temporal elements to 1.
+
+        :returns: A tuple of arrays (prob_ex, prob_sted).
+        """
+        self.prob_ex.fill(1.)
+        self.prob_sted.fill(1.)
+        return self.prob_ex, self.prob_sted
+
+
 class TemporalDatamap(Datamap):
     """
     This class inherits from Datamap, adding the t dimension to it for managing Ca2+ flashes and diffusion.
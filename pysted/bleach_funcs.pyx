@@ -7,7 +7,9 @@ cimport cython
 import copy
 
 from libc.math cimport exp
+from libc.stdint cimport uint32_t, uint64_t
 from libc.stdlib cimport rand, srand, RAND_MAX
+from pysted.counter_rng cimport CounterRNG, rng_binomial, rng_init
 
 INTDTYPE = numpy.int32
 INT64DTYPE = numpy.int64
@@ -59,6 +61,69 @@ def default_update_survival_probabilities(object self,
         prob_ex[s, t] = prob_ex[s, t] * exp(-1. * k_ex[s, t] * step)
         prob_sted[s, t] = prob_sted[s, t] * exp(-1. * k_sted[s, t] * step)
 
+@cython.boundscheck(False)  # turn off bounds-checking for entire function
+@cython.wraparound(False)  # turn off negative index wrapping for entire function
+def proportional_update_survival_probabilities(object self,
+                   numpy.ndarray[FLOATDTYPE_t, ndim=2] i_ex,
+                   numpy.ndarray[FLOATDTYPE_t, ndim=2] i_sted,
+                   float p_ex,
+                   float p_sted,
+                   float step,
+                   dict bleached_sub_datamaps_dict,
+                   int row,
+                   int col,
+                   int h,
+                   int w,
+                   list mask,
+                   numpy.ndarray[FLOATDTYPE_t, ndim=2] prob_ex,
+                   numpy.ndarray[FLOATDTYPE_t, ndim=2] prob_sted,
+                   numpy.ndarray[FLOATDTYPE_t, ndim=2] k_ex=None,
+                   numpy.ndarray[FLOATDTYPE_t, ndim=2] k_sted=None,):
+    """
+    Equivalent of default_update_survival_probabilities in which the bleaching rates are proportional to the photon
+    fluxes of the beams, see Fluorescence.get_k_bleach_proportional.
+    """
+    cdef numpy.ndarray[FLOATDTYPE_t, ndim=2] photons_ex, photons_sted
+    cdef int s, t
+    cdef float duty_cycle
+
+    if k_sted is None:
+        photons_ex = self.fluo.get_photons(i_ex * p_ex, self.excitation.lambda_)
+        duty_cycle = self.sted.tau * self.sted.rate
+        photons_sted = self.fluo.get_photons(i_sted * p_sted * duty_cycle, self.sted.lambda_)
+        k_ex, k_sted = self.fluo.get_k_bleach_proportional(self.excitation.lambda_, self.sted.lambda_, photons_ex,
+                                                           photons_sted)
+    if k_ex is None:
+        k_ex = k_sted * 0.
+    for (s, t) in mask:
+        prob_ex[s, t] = prob_ex[s, t] * exp(-1. * k_ex[s, t] * step)
+        prob_sted[s, t] = prob_sted[s, t] * exp(-1. * k_sted[s, t] * step)
+
+# The bleaching models which have a C implementation in bleach_models.pxd, by name. The kernels of raster.pyx replace
+# these functions by their C implementation, any other bleach_func is called from Python.
+BLEACH_MODELS = {
+    "default": default_update_survival_probabilities,
+    "proportional": proportional_update_survival_probabilities,
+}
+
+def get_bleach_model(bleach_func):
+    """
+    Resolves a bleach_func given to Microscope.get_signal_and_bleach.
+    :param bleach_func: The name of a model of BLEACH_MODELS, the function of such a model, or any other function with
+                        the signature of default_update_survival_probabilities.
+    :returns: The name of the model, which is None if bleach_func is not a model of BLEACH_MODELS, and its function.
+    """
+    cdef str name
+    if isinstance(bleach_func, str):
+        if bleach_func not in BLEACH_MODELS:
+            raise ValueError("Unknown bleaching model {}, the models are {}.".format(bleach_func,
+                                                                                    list(BLEACH_MODELS)))
+        return bleach_func, BLEACH_MODELS[bleach_func]
+    for name in BLEACH_MODELS:
+        if bleach_func is BLEACH_MODELS[name]:
+            return name, bleach_func
+    return None, bleach_func
+
 @cython.boundscheck(False)  # turn off bounds-checking for entire function
 @cython.wraparound(False)  # turn off negative index wrapping for entire function
 def sample_molecules(object self,
@@ -69,19 +134,26 @@ def sample_molecules(object self,
                    int w,
                    list mask,
                    numpy.ndarray[FLOATDTYPE_t, ndim=2] prob_ex,
-                   numpy.ndarray[FLOATDTYPE_t, ndim=2] prob_sted):
-    cdef int s, sprime, t, tprime, o
+                   numpy.ndarray[FLOATDTYPE_t, ndim=2] prob_sted,
+                   uint64_t seed=0,
+                   uint32_t frame=0):
+    """
+    Samples the molecules which survive the acquisition of the pixel (row, col). The molecules are sampled from the
+    random stream of the pixel, which only depends on the seed, the frame and the position of the pixel (see
+    counter_rng.pxd), such that the result does not depend on the order in which the pixels are acquired.
+    """
+    cdef int s, sprime, t, tprime
     cdef int sampled_value
     cdef float prob
-    cdef float rsamp
-    cdef float maxval
-    cdef float sampled_prob
     cdef int current
     cdef numpy.ndarray[INT64DTYPE_t, ndim=2] datamap
     cdef str key
     cdef numpy.ndarray[INT64DTYPE_t, ndim=2] copied_datamap
+    cdef CounterRNG rng
 
-    maxval = float(RAND_MAX)
+    # the stream of the pixel
+    datamap = next(iter(bleached_sub_datamaps_dict.values()))
+    rng_init(&rng, seed, frame, <uint32_t>row * datamap.shape[1] + col, 0)
 
     for key in bleached_sub_datamaps_dict:
         datamap = bleached_sub_datamaps_dict[key]
@@ -90,14 +162,8 @@ def sample_molecules(object self,
             t = tprime + col
             current = datamap[s, t]
             if current > 0:
-                # Calculates the binomial sampling
-                sampled_value = 0
+                # Calculates the binomial sampling of the surviving molecules
                 prob = prob_ex[sprime, tprime] * prob_sted[sprime, tprime]
-                # For each count we sample a random variable
-                for o in range(current):
-                    rsamp = rand()
-                    sampled_prob = rsamp / maxval
-                    if sampled_prob <= prob:
-                        sampled_value += 1
+                sampled_value = rng_binomial(&rng, current, prob)
                 datamap[s, t] = sampled_value
         bleached_sub_datamaps_dict[key] = datamap
@@ -0,0 +1,112 @@
+
+# Bleaching models shared by the Cython kernels.
+#
+# A bleaching model computes the bleaching rates of the molecules of a position of the footprint (k_ex and k_sted, in
+# s^-1) from the excitation and STED photon fluxes at this position and from the dwelltime. The constants of a model
+# only depend on the fluorophore and on the beams, they are gathered in a parameter struct when the acquisition starts
+# such that the rates are computed without the GIL. The Python implementations of the models, used as fallbacks, are
+# registered by name in bleach_funcs.BLEACH_MODELS.
+
+cimport cython
+from libc.math cimport exp, floor, pow
+
+cdef struct OraczParams:
+    double photon_energy_ex
+    double photon_energy_sted
+    double duty_cycle
+    double tau_sted
+    double tau_rep
+    double sigma_abs
+    double phi_s
+    double k_vib
+    double k_s1
+    double k0
+    double k1
+    double b
+    double k_tri
+    double triplet_dynamic_frac
+
+cdef struct ProportionalParams:
+    double photon_energy_ex
+    double photon_energy_sted
+    double duty_cycle
+    double sigma_abs
+    double sigma_ste
+    double phy_react_ex
+    double phy_react_sted
+
+cdef union BleachParams:
+    OraczParams oracz
+    ProportionalParams proportional
+
+ctypedef void (*bleach_rate_t)(BleachParams *params, double i_ex, double i_sted, double dwelltime, double *k_ex,
+                               double *k_sted) noexcept nogil
+
+cdef struct BleachModel:
+    bleach_rate_t rate
+    BleachParams params
+
+cdef inline void oracz_rate(BleachParams *params, double i_ex, double i_sted, double dwelltime, double *k_ex,
+                            double *k_sted) noexcept nogil:
+    """
+    C equivalent of Fluorescence.get_k_bleach for the intensities i_ex and i_sted (W/m²), see
+    bleach_funcs.default_update_survival_probabilities.
+    """
+    cdef OraczParams *p = &params.oracz
+    cdef double phi_ex = floor(i_ex / p.photon_energy_ex)
+    cdef double phi_sted = floor(i_sted * p.duty_cycle / p.photon_energy_sted) * p.tau_rep / p.tau_sted
+    cdef double zeta = phi_sted / p.phi_s
+    cdef double gamma = (zeta * p.k_vib) / (zeta * p.k_s1 + p.k_vib)
+    cdef double S1_ini = 1 - exp(-p.sigma_abs * phi_ex * p.tau_rep)
+    cdef double I_sted = phi_sted * p.photon_energy_sted
+    cdef double k = p.k0 * I_sted + p.k1 * pow(I_sted, p.b)
+    cdef double B = k * S1_ini * (1 - exp(-p.k_s1 * p.tau_sted * (1 + gamma))) / (p.k_s1 * (1 + gamma))
+    cdef double mean_k_bleach = B / p.tau_rep
+    cdef double k_dwell
+    dwelltime += 1e-15
+    k_dwell = (p.k_tri * dwelltime + exp(-p.k_tri * dwelltime) - 1) / (p.k_tri * dwelltime)
+    k_ex[0] = 0.
+    k_sted[0] = mean_k_bleach * ((1 - p.triplet_dynamic_frac) + p.triplet_dynamic_frac * k_dwell)
+
+cdef inline void proportional_rate(BleachParams *params, double i_ex, double i_sted, double dwelltime, double *k_ex,
+                                   double *k_sted) noexcept nogil:
+    """
+    C equivalent of Fluorescence.get_k_bleach_proportional for the intensities i_ex and i_sted (W/m²), see
+    bleach_funcs.proportional_update_survival_probabilities.
+    """
+    cdef ProportionalParams *p = &params.proportional
+    k_ex[0] = p.phy_react_ex * p.sigma_abs * floor(i_ex / p.photon_energy_ex)
+    k_sted[0] = p.phy_react_sted * p.sigma_ste * floor(i_sted * p.duty_cycle / p.photon_energy_sted)
+
+cdef inline int bleach_model_init(BleachModel *model, str name, object microscope) except -1:
+    """
+    Fills the parameters of the bleaching model registered as name for the fluorophore and the beams of microscope.
+    """
+    cdef object fluo = microscope.fluo
+    cdef double lambda_ex = microscope.excitation.lambda_
+    cdef double lambda_sted = microscope.sted.lambda_
+    cdef int exc_lambda_ = int(round(lambda_ex / 1e-9))
+    cdef int sted_lambda_ = int(round(lambda_sted / 1e-9))
+    # same photon energy as Fluorescence.get_photons
+    cdef double photon_energy_ex = 299792458.0 * 6.62607015e-34 / lambda_ex
+    cdef double photon_energy_sted = 299792458.0 * 6.62607015e-34 / lambda_sted
+    if name == "default":
+        model.rate = oracz_rate
+        model.params.oracz = OraczParams(
+            photon_energy_ex=photon_energy_ex, photon_energy_sted=photon_energy_sted,
+            duty_cycle=microscope.sted.tau * microscope.sted.rate, tau_sted=microscope.sted.tau,
+            tau_rep=1 / microscope.sted.rate, sigma_abs=fluo.sigma_abs[exc_lambda_],
+            phi_s=1 / (fluo.tau * fluo.sigma_ste[sted_lambda_]), k_vib=1 / fluo.tau_vib, k_s1=1 / fluo.tau,
+            k0=fluo.k0, k1=fluo.k1, b=fluo.b, k_tri=1 / fluo.tau_tri, triplet_dynamic_frac=fluo.triplet_dynamic_frac
+        )
+    elif name == "proportional":
+        model.rate = proportional_rate
+        model.params.proportional = ProportionalParams(
+            photon_energy_ex=photon_energy_ex, photon_energy_sted=photon_energy_sted,
+            duty_cycle=microscope.sted.tau * microscope.sted.rate, sigma_abs=fluo.sigma_abs[exc_lambda_],
+            sigma_ste=fluo.sigma_ste[sted_lambda_], phy_react_ex=fluo.phy_react[exc_lambda_],
+            phy_react_sted=fluo.phy_react[sted_lambda_]
+        )
+    else:
+        raise ValueError("Unknown bleaching model {}.".format(name))
+    return 0
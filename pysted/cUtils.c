@@ -11,7 +11,9 @@ static PyObject* calculate_amplitude(PyObject *self, PyObject* args) {
     return : double
     */
     double x, y, d_airy;
-    PyArg_ParseTuple(args, "ddd", &x, &y, &d_airy);
+    if (!PyArg_ParseTuple(args, "ddd", &x, &y, &d_airy)) {
+        return NULL;
+    }
     
     double d = sqrt(pow(x, 2) + pow(y, 2));
     double d_scaled = d / d_airy;
@@ -0,0 +1,223 @@
+
+# Counter-based random number generator shared by the Cython kernels.
+#
+# The numbers are computed by the Philox4x32-10 generator (Salmon et al., 2011, Parallel random numbers: as easy as
+# 1, 2, 3) from a key, given by the 64 bits seed of the acquisition, and a counter, given by the frame, the pixel, the
+# step of the pixel (e.g. the decision steps of DyMIN) and the index of the draw. Every (seed, frame, pixel, step) is thus an
+# independent stream whose draws do not depend on the order in which the pixels are evaluated, nor on the thread which
+# evaluates them.
+
+cimport cython
+from libc.math cimport copysign, exp, fabs, floor, fmin, lgamma, log, sqrt
+from libc.stdint cimport int64_t, uint32_t, uint64_t
+
+cdef struct CounterRNG:
+    uint32_t key[2]
+    uint32_t counter[4]
+    uint32_t output[4]
+    int index
+
+@cython.boundscheck(False)  # turn off bounds-checking for entire function
+@cython.wraparound(False)  # turn off negative index wrapping for entire function
+cdef inline void philox(uint32_t *counter, uint32_t *key, uint32_t *output) noexcept nogil:
+    """
+    Computes the 10 rounds of the Philox4x32 generator on a counter and a key.
+    """
+    cdef uint32_t c0 = counter[0], c1 = counter[1], c2 = counter[2], c3 = counter[3]
+    cdef uint32_t k0 = key[0], k1 = key[1]
+    cdef uint64_t p0, p1
+    cdef int r
+    for r in range(10):
+        p0 = <uint64_t>0xD2511F53U * c0
+        p1 = <uint64_t>0xCD9E8D57U * c2
+        c0, c1, c2, c3 = <uint32_t>(p1 >> 32) ^ c1 ^ k0, <uint32_t>p1, <uint32_t>(p0 >> 32) ^ c3 ^ k1, <uint32_t>p0
+        k0 = k0 + 0x9E3779B9U
+        k1 = k1 + 0xBB67AE85U
+    output[0], output[1], output[2], output[3] = c0, c1, c2, c3
+
+cdef inline void rng_init(CounterRNG *rng, uint64_t seed, uint32_t frame, uint32_t pixel, uint32_t step) noexcept nogil:
+    """
+    Initializes the stream of a step of a pixel. The 64 bits of the seed are the key, the frame, the pixel and the step
+    are part of the counter.
+    """
+    rng.key[0], rng.key[1] = <uint32_t>seed, <uint32_t>(seed >> 32)
+    rng.counter[0], rng.counter[1] = 0, step
+    rng.counter[2], rng.counter[3] = pixel, frame
+    rng.index = 4
+
+cdef inline uint32_t rng_next(CounterRNG *rng) noexcept nogil:
+    """
+    Returns the next 32 bits of the stream.
+    """
+    cdef uint32_t value
+    if rng.index == 4:
+        philox(rng.counter, rng.key, rng.output)
+        rng.counter[0] += 1
+        rng.index = 0
+    value = rng.output[rng.index]
+    rng.index += 1
+    return value
+
+cdef inline double rng_double(CounterRNG *rng) noexcept nogil:
+    """
+    Returns the next number of the stream, uniformly distributed in [0, 1) with double precision.
+    """
+    cdef uint32_t a = rng_next(rng) >> 5
+    cdef uint32_t b = rng_next(rng) >> 6
+    return (a * 67108864.0 + b) * (1.0 / 9007199254740992.0)
+
+cdef inline double stirling_correction(int64_t k) noexcept nogil:
+    """
+    Returns log(k!) - [(k + 1/2) log(k + 1) - (k + 1) + log(2 pi) / 2], the error of the Stirling approximation.
+    """
+    cdef double kp1, kp1sq
+    if k < 10:
+        kp1 = k + 1.0
+        return lgamma(kp1) - ((k + 0.5) * log(kp1) - kp1 + 0.91893853320467274178)
+    kp1 = k + 1.0
+    kp1sq = kp1 * kp1
+    return (1.0 / 12 - (1.0 / 360 - 1.0 / 1260 / kp1sq) / kp1sq) / kp1
+
+cdef inline int64_t binomial_inversion(CounterRNG *rng, int64_t n, double p) noexcept nogil:
+    """
+    Samples a binomial distribution by inversion of its cumulative distribution, for small n * p.
+    """
+    cdef double q = 1.0 - p
+    cdef double qn = exp(n * log(q))
+    cdef double bound = fmin(n, n * p + 10.0 * sqrt(n * p * q + 1))
+    cdef double px = qn
+    cdef double u = rng_double(rng)
+    cdef int64_t x = 0
+    while u > px:
+        x += 1
+        if x > bound:
+            x = 0
+            px = qn
+            u = rng_double(rng)
+        else:
+            u -= px
+            px = ((n - x + 1) * p * px) / (x * q)
+    return x
+
+cdef inline int64_t binomial_btrd(CounterRNG *rng, int64_t n, double p) noexcept nogil:
+    """
+    Samples a binomial distribution with the transformed rejection method of Hörmann (1993, The generation of binomial
+    random variates, BTRD), for n * p >= 10 and p <= 1/2. The expected number of iterations is bounded.
+    """
+    cdef double r = p / (1.0 - p)
+    cdef double nr = (n + 1) * r
+    cdef double npq = n * p * (1.0 - p)
+    cdef double sqrt_npq = sqrt(npq)
+    cdef double b = 1.15 + 2.53 * sqrt_npq
+    cdef double a = -0.0873 + 0.0248 * b + 0.01 * p
+    cdef double c = n * p + 0.5
+    cdef double alpha = (2.83 + 5.1 / b) * sqrt_npq
+    cdef double v_r = 0.92 - 4.2 / b
+    cdef double urvr = 0.86 * v_r
+    cdef int64_t m = <int64_t>floor((n + 1) * p)
+    cdef double u, v, us, f, rho, t, h, km
+    cdef int64_t k, i
+
+    while True:
+        v = rng_double(rng)
+        if v <= urvr:
+            u = v / v_r - 0.43
+            return <int64_t>floor((2 * a / (0.5 - fabs(u)) + b) * u + c)
+        if v >= v_r:
+            u = rng_double(rng) - 0.5
+        else:
+            u = v / v_r - 0.93
+            u = copysign(0.5, u) - u
+            v = rng_double(rng) * v_r
+        us = 0.5 - fabs(u)
+        k = <int64_t>floor((2 * a / us + b) * u + c)
+        if k < 0 or k > n:
+            continue
+        v = v * alpha / (a / (us * us) + b)
+        km = fabs(k - m)
+        if km <= 15:
+            # recursive evaluation of f(k) / f(m)
+            f = 1.0
+            if m < k:
+                for i in range(m + 1, k + 1):
+                    f *= nr / i - r
+            elif m > k:
+                for i in range(k + 1, m + 1):
+                    v *= nr / i - r
+            if v <= f:
+                return k
+            continue
+        # squeeze acceptance and rejection
+        v = log(v)
+        rho = (km / npq) * (((km / 3.0 + 0.625) * km + 1.0 / 6) / npq + 0.5)
+        t = -km * km / (2 * npq)
+        if v < t - rho:
+            return k
+        if v > t + rho:
+            continue
+        h = (m + 0.5) * log((m + 1) / (r * (n - m + 1))) + stirling_correction(m) + stirling_correction(n - m)
+        if v <= h + (n + 1) * log(<double>(n - m + 1) / (n - k + 1)) \
+                + (k + 0.5) * log((n - k + 1) * r / (k + 1)) - stirling_correction(k) - stirling_correction(n - k):
+            return k
+
+cdef inline int64_t rng_binomial(CounterRNG *rng, int64_t n, double p) noexcept nogil:
+    """
+    Samples the number of successes of n trials of probability p from the stream, in O(1) expected time.
+    """
+    if n <= 0 or p <= 0:
+        return 0
+    if p >= 1:
+        return n
+    if p > 0.5:
+        return n - rng_binomial(rng, n, 1.0 - p)
+    if n * p < 10:
+        return binomial_inversion(rng, n, p)
+    return binomial_btrd(rng, n, p)
+
+cdef inline int64_t poisson_multiplication(CounterRNG *rng, double lam) noexcept nogil:
+    """
+    Samples a Poisson distribution by multiplication of uniform numbers, for small lam.
+    """
+    cdef double enlam = exp(-lam)
+    cdef double prod = rng_double(rng)
+    cdef int64_t x = 0
+    while prod > enlam:
+        x += 1
+        prod *= rng_double(rng)
+    return x
+
+cdef inline int64_t poisson_ptrs(CounterRNG *rng, double lam) noexcept nogil:
+    """
+    Samples a Poisson distribution with the transformed rejection method of Hörmann (1993, The transformed rejection
+    method for generating Poisson random variables, PTRS), for lam >= 10.
+    """
+    cdef double slam = sqrt(lam)
+    cdef double loglam = log(lam)
+    cdef double b = 0.931 + 2.53 * slam
+    cdef double a = -0.059 + 0.02483 * b
+    cdef double invalpha = 1.1239 + 1.1328 / (b - 3.4)
+    cdef double vr = 0.9277 - 3.6224 / (b - 2)
+    cdef double u, v, us
+    cdef int64_t k
+
+    while True:
+        u = rng_double(rng) - 0.5
+        v = rng_double(rng)
+        us = 0.5 - fabs(u)
+        k = <int64_t>floor((2 * a / us + b) * u + lam + 0.43)
+        if us >= 0.07 and v <= vr:
+            return k
+        if k < 0 or (us < 0.013 and v > us):
+            continue
+        if log(v) + log(invalpha) - log(a / (us * us) + b) <= -lam + k * loglam - lgamma(k + 1.0):
+            return k
+
+cdef inline int64_t rng_poisson(CounterRNG *rng, double lam) noexcept nogil:
+    """
+    Samples the number of events of a Poisson distribution of mean lam from the stream, in O(1) expected time.
+    """
+    if lam <= 0:
+        return 0
+    if lam < 10:
+        return poisson_multiplication(rng, lam)
+    return poisson_ptrs(rng, lam)
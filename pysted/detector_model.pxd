@@ -0,0 +1,49 @@
+
+# Photon detection model shared by the Cython kernels.
+#
+# C equivalent of Detector.get_signal, used by the decision steps of the adaptive acquisitions (see
+# raster.raster_func_adaptive) and by Detector.get_signal itself (see raster.detect_signal). The emitted photons are
+# detected with a binomial draw of the detection efficiency, to which are added the Poisson noise, the background and
+# the dark counts. The random numbers are drawn from the counter-based streams of counter_rng.pxd.
+
+cimport cython
+from libc.math cimport floor
+from libc.stdint cimport int64_t, uint32_t
+from pysted.counter_rng cimport CounterRNG, rng_binomial, rng_poisson
+
+# The streams of the detection are the steps DETECTION_STEP + i of a pixel, such that they never overlap with the
+# stream of the molecules sampled after the acquisition of the pixel (step 0)
+cdef enum:
+    DETECTION_STEP = 0x40000000
+
+cdef struct DetectorModel:
+    double photon_energy
+    double efficiency
+    bint noise
+    double counts
+
+cdef inline int detector_model_init(DetectorModel *model, object detector, double rate,
+                                    double photon_energy) except -1:
+    """
+    Fills the parameters of the detection model of detector, for a repetition rate of the lasers and the energy of the
+    photons of the intensities given to detect (1 for intensities given in photons).
+    """
+    model.photon_energy = photon_energy
+    model.efficiency = detector.pcef * detector.pdef
+    model.noise = detector.noise
+    # the background and dark counts per second of dwelltime, accounting for the detection gating
+    model.counts = (detector.background + detector.darkcount) * detector.det_width * rate
+    return 0
+
+cdef inline double detect(DetectorModel *model, CounterRNG *rng, double intensity, double dwelltime) noexcept nogil:
+    """
+    Returns the signal (in photons) detected during dwelltime from the fluorescence intensity of a pixel, see
+    Fluorescence.get_photons and Detector.get_signal. The background and the dark counts are drawn in the same Poisson
+    draw as the noise if it is enabled, since a sum of Poisson variables is a Poisson variable.
+    """
+    cdef double signal = rng_binomial(rng, <int64_t>floor(intensity / model.photon_energy), model.efficiency) * dwelltime
+    if model.noise:
+        signal = rng_poisson(rng, signal + model.counts * dwelltime)
+    elif model.counts > 0:
+        signal += rng_poisson(rng, model.counts * dwelltime)
+    return signal
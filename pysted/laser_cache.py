@@ -0,0 +1,168 @@
+'''This module implements a persistent cache of the lasers computed by a
+:class:`~pysted.base.Microscope`. Every entry is stored in its own ``.npy`` file
+whose name is a stable hash of the parameters of the optical components and of
+the pixel size, such that many processes can share the same cache directory.
+
+* Entries are loaded with memory-mapping (copy-on-write), which avoids reading
+  the whole file when only a part of it is used.
+* Entries are written to a temporary file which is then atomically renamed, so
+  a reader never sees a partially written entry.
+* The size of the directory is bounded by evicting the least recently used
+  entries.
+
+.. code-block:: python
+
+    store = laser_cache.LaserCache(".microscope_cache", max_size=2**30)
+    key = laser_cache.stable_hash(objective, excitation, sted, fluo, detector, 20e-9)
+    lasers = store.load(key)
+    if lasers is None:
+        lasers = compute_lasers()
+        store.save(key, lasers)
+'''
+
+import hashlib
+import os
+import tempfile
+
+import numpy
+
+
+def canonical(value):
+    '''Convert a value to a string which does not depend on the process, the
+    platform, or the insertion order of dictionaries.
+
+    :param value: A number, a string, a sequence, a dictionary, an object with
+                  a ``fingerprint``, or an object whose attributes are such
+                  values.
+    :returns: A string.
+    '''
+    if isinstance(value, (bool, numpy.bool_)):
+        return repr(bool(value))
+    elif isinstance(value, (int, numpy.integer)):
+        return repr(int(value))
+    elif isinstance(value, (float, numpy.floating)):
+        return repr(float(value))
+    elif isinstance(value, (str, type(None))):
+        return repr(value)
+    elif isinstance(value, dict):
+        items = sorted((canonical(key), canonical(item)) for key, item in value.items())
+        return "{" + ", ".join(f"{key}: {item}" for key, item in items) + "}"
+    elif isinstance(value, (list, tuple)):
+        return "[" + ", ".join(canonical(item) for item in value) + "]"
+    elif isinstance(value, numpy.ndarray):
+        return f"array({value.dtype.str}, {value.shape}, {hashlib.sha256(value.tobytes()).hexdigest()})"
+    elif hasattr(value, "fingerprint"):
+        return f"{type(value).__name__}#{value.fingerprint}"
+    elif hasattr(value, "__dict__"):
+        return type(value).__name__ + canonical(vars(value))
+    return repr(value)
+
+
+def stable_hash(*values):
+    '''Compute a hash of the given values which is stable across processes and
+    sessions.
+
+    :param values: Values supported by :func:`canonical`.
+    :returns: An hexadecimal string.
+    '''
+    return hashlib.sha256(canonical(values).encode("utf-8")).hexdigest()
+
+
+class LaserCache:
+    '''This class implements a directory of cached lasers.
+
+    :param path: The path of the cache directory. It is created on the first
+                 save.
+    :param max_size: The maximal size of the directory (bytes). The least
+                     recently used entries are removed when it is exceeded.
+    '''
+
+    def __init__(self, path=".microscope_cache", max_size=2**30):
+        self.path = path
+        self.max_size = max_size
+
+    def filename(self, key):
+        '''Return the path of the file of an entry.
+
+        :param key: The key of the entry, see :func:`stable_hash`.
+        :returns: A path.
+        '''
+        return os.path.join(self.path, f"{key}.npy")
+
+    def load(self, key):
+        '''Load an entry of the cache.
+
+        :param key: The key of the entry, see :func:`stable_hash`.
+        :returns: A tuple of 2D arrays, or ``None`` if the entry does not exist.
+        '''
+        filename = self.filename(key)
+        try:
+            stacked = numpy.load(filename, mmap_mode="c")
+        except (FileNotFoundError, ValueError, OSError):
+            return None
+        try:
+            # the access time is not reliable on every filesystem
+            os.utime(filename)
+        except OSError:
+            pass
+        return tuple(numpy.asarray(array) for array in stacked)
+
+    def save(self, key, arrays):
+        '''Atomically save an entry of the cache and evict the least recently
+        used entries if the cache is too large.
+
+        :param key: The key of the entry, see :func:`stable_hash`.
+        :param arrays: A sequence of 2D arrays of the same shape.
+        '''
+        os.makedirs(self.path, exist_ok=True)
+        fd, tmp_filename = tempfile.mkstemp(dir=self.path, suffix=".tmp")
+        try:
+            with os.fdopen(fd, "wb") as file:
+                numpy.save(file, numpy.stack(arrays))
+                file.flush()
+                os.fsync(file.fileno())
+            os.replace(tmp_filename, self.filename(key))
+        except BaseException:
+            if os.path.exists(tmp_filename):
+                os.remove(tmp_filename)
+            raise
+        self.evict(keep=key)
+
+    def evict(self, keep=None):
+        '''Remove the least recently used entries until the size of the cache
+        is below :attr:`max_size`.
+
+        :param keep: The key of an entry which is never removed (optional).
+        '''
+        entries = []
+        with os.scandir(self.path) as iterator:
+            for entry in iterator:
+                if not entry.name.endswith(".npy"):
+                    continue
+                try:
+                    stat = entry.stat()
+                except FileNotFoundError:
+                    continue
+                entries.append((stat.st_mtime, stat.st_size, entry.path))
+        total = sum(size for _, size, _ in entries)
+        for _, size, filename in sorted(entries):
+            if total <= self.max_size:
+                break
+            if keep is not None and filename == self.filename(keep):
+                continue
+            try:
+                os.remove(filename)
+            except FileNotFoundError:
+                pass
+            total -= size
+
+    def clear(self):
+        '''Remove all the entries of the cache.'''
+        if not os.path.isdir(self.path):
+            return
+        for name in os.listdir(self.path):
+            if name.endswith(".npy"):
+                try:
+                    os.remove(os.path.join(self.path, name))
+                except FileNotFoundError:
+                    pass
@@ -7,8 +7,12 @@ cimport numpy
 import scipy
 cimport cython
 
+from cython.parallel cimport prange, threadid
 from libc.math cimport exp
-from libc.stdlib cimport rand, srand, RAND_MAX
+from libc.stdint cimport uint32_t, uint64_t
+from pysted.counter_rng cimport CounterRNG, rng_binomial, rng_init
+from pysted.bleach_models cimport BleachModel, bleach_model_init
+from pysted.detector_model cimport DETECTION_STEP, DetectorModel, detect, detector_model_init
 
 INTDTYPE = numpy.int32
 INT64DTYPE = numpy.int64
@@ -18,19 +22,250 @@ ctypedef numpy.int32_t INTDTYPE_t
 ctypedef numpy.int64_t INT64DTYPE_t
 ctypedef numpy.float64_t FLOATDTYPE_t
 
+# A step of an adaptive acquisition, see step_table
+STEPDTYPE = numpy.dtype([("scale_power", numpy.float64), ("decision_time", numpy.float64),
+                         ("lower_threshold", numpy.float64), ("upper_threshold", numpy.float64),
+                         ("accumulate", numpy.int32)])
 
+cdef packed struct Step:
+    FLOATDTYPE_t scale_power
+    FLOATDTYPE_t decision_time
+    FLOATDTYPE_t lower_threshold
+    FLOATDTYPE_t upper_threshold
+    INTDTYPE_t accumulate
+
+
+
+def stack_layers(dict sub_datamaps_dict):
+    """
+    Stacks the sub datamaps in a contiguous int64 array whose layers replace the arrays of sub_datamaps_dict. If the
+    arrays of sub_datamaps_dict already are the layers of such an array, in order (e.g. the buffers of an
+    AcquisitionWorkspace), it is used in place.
+    :param sub_datamaps_dict: The sub datamaps, by key.
+    :returns: The stacked array, of shape (len(sub_datamaps_dict), rows, cols).
+    """
+    cdef list keys = list(sub_datamaps_dict.keys())
+    cdef object stack = sub_datamaps_dict[keys[0]].base
+    if isinstance(stack, numpy.ndarray) and stack.ndim == 3 and stack.shape[0] == len(keys) and \
+            stack.dtype == numpy.int64 and stack.flags.c_contiguous and \
+            all(sub_datamaps_dict[key].base is stack and sub_datamaps_dict[key].ctypes.data == stack[layer].ctypes.data
+                for layer, key in enumerate(keys)):
+        return stack
+    stack = numpy.ascontiguousarray(numpy.stack([sub_datamaps_dict[key] for key in keys]), dtype=numpy.int64)
+    for layer, key in enumerate(keys):
+        sub_datamaps_dict[key] = stack[layer]
+    return stack
+
+@cython.boundscheck(False)  # turn off bounds-checking for entire function
+@cython.wraparound(False)  # turn off negative index wrapping for entire function
+def occupancy_table(numpy.ndarray[INT64DTYPE_t, ndim=2] total):
+    """
+    Builds the summed-area table of the occupied positions of a datamap, stored as a 2D Fenwick tree such that both the
+    sum over a rectangle and the update of a position take O(log(rows) * log(cols)) operations.
+    """
+    cdef int i, j, parent
+    cdef numpy.ndarray[INT64DTYPE_t, ndim=2] table = numpy.zeros((total.shape[0] + 1, total.shape[1] + 1),
+                                                                 dtype=numpy.int64)
+    table[1:, 1:] = total > 0
+    for i in range(1, table.shape[0]):
+        for j in range(1, table.shape[1]):
+            parent = j + (j & -j)
+            if parent < table.shape[1]:
+                table[i, parent] += table[i, j]
+    for i in range(1, table.shape[0]):
+        parent = i + (i & -i)
+        if parent < table.shape[0]:
+            table[parent] += table[i]
+    return table
+
+@cython.boundscheck(False)  # turn off bounds-checking for entire function
+@cython.wraparound(False)  # turn off negative index wrapping for entire function
+cdef void occupancy_add(INT64DTYPE_t[:, ::1] table, int row, int col, INT64DTYPE_t delta) noexcept nogil:
+    """
+    Adds delta to the position (row, col) of the summed-area table.
+    """
+    cdef int i = row + 1
+    cdef int j
+    while i < table.shape[0]:
+        j = col + 1
+        while j < table.shape[1]:
+            table[i, j] += delta
+            j += j & -j
+        i += i & -i
+
+@cython.boundscheck(False)  # turn off bounds-checking for entire function
+@cython.wraparound(False)  # turn off negative index wrapping for entire function
+cdef INT64DTYPE_t occupancy_prefix(INT64DTYPE_t[:, ::1] table, int row, int col) noexcept nogil:
+    """
+    Returns the number of occupied positions in the rectangle [0, row) x [0, col).
+    """
+    cdef INT64DTYPE_t count = 0
+    cdef int i = row
+    cdef int j
+    while i > 0:
+        j = col
+        while j > 0:
+            count += table[i, j]
+            j -= j & -j
+        i -= i & -i
+    return count
+
+@cython.boundscheck(False)  # turn off bounds-checking for entire function
+@cython.wraparound(False)  # turn off negative index wrapping for entire function
+cdef bint is_empty_footprint(INT64DTYPE_t[:, ::1] table, int row, int col, int h, int w) noexcept nogil:
+    """
+    Indicates whether the footprint of shape (h, w) at (row, col) contains no molecule.
+    """
+    return occupancy_prefix(table, row + h, col + w) - occupancy_prefix(table, row, col + w) \
+           - occupancy_prefix(table, row + h, col) + occupancy_prefix(table, row, col) == 0
 
 @cython.boundscheck(False)  # turn off bounds-checking for entire function
 @cython.wraparound(False)  # turn off negative index wrapping for entire function
-def reset_prob(
-    list mask,
-    numpy.ndarray[FLOATDTYPE_t, ndim=2] prob_ex,
-    numpy.ndarray[FLOATDTYPE_t, ndim=2] prob_sted
+cdef FLOATDTYPE_t acquire_pixel(
+    INT64DTYPE_t[:, ::1] total,
+    FLOATDTYPE_t[:, :] effective,
+    int row,
+    int col,
+    bint bleach,
+    INTDTYPE_t[:, ::1] mask,
+    int *mask_len
+) noexcept nogil:
+    """
+    Returns the intensity acquired from the summed datamap under the footprint of the effective psf at (row, col) and
+    stores the position of the emitters in the mask (if bleach is True).
+    """
+    cdef int s, t
+    cdef INT64DTYPE_t count
+    cdef FLOATDTYPE_t value = 0.0
+
+    mask_len[0] = 0
+    for s in range(effective.shape[0]):
+        for t in range(effective.shape[1]):
+            count = total[row + s, col + t]
+            if bleach and (count > 0):
+                mask[mask_len[0], 0] = s
+                mask[mask_len[0], 1] = t
+                mask_len[0] += 1
+            value += effective[s, t] * count
+    return value
+
+@cython.boundscheck(False)  # turn off bounds-checking for entire function
+@cython.wraparound(False)  # turn off negative index wrapping for entire function
+cdef void update_survival_probabilities(
+    BleachModel *model,
+    FLOATDTYPE_t[:, :] i_ex,
+    FLOATDTYPE_t[:, :] i_sted,
+    double p_ex,
+    double p_sted,
+    double step,
+    FLOATDTYPE_t[:, :] prob_ex,
+    FLOATDTYPE_t[:, :] prob_sted,
+    INTDTYPE_t[:, ::1] mask,
+    int mask_len,
+    bint accumulate=False
+) noexcept nogil:
+    """
+    C equivalent of the functions of bleach_funcs.BLEACH_MODELS, using the bleaching model of bleach_models.pxd. The
+    survival probabilities are reset to 1 before being updated, unless accumulate is True in which case they are
+    multiplied by the survival probabilities of this step (e.g. the successive steps of an adaptive acquisition).
+    """
+    cdef int m, s, t
+    cdef double k_ex, k_sted
+    for m in range(mask_len):
+        s, t = mask[m, 0], mask[m, 1]
+        model.rate(&model.params, i_ex[s, t] * p_ex, i_sted[s, t] * p_sted, step, &k_ex, &k_sted)
+        if accumulate:
+            prob_ex[s, t] = prob_ex[s, t] * exp(-1. * k_ex * step)
+            prob_sted[s, t] = prob_sted[s, t] * exp(-1. * k_sted * step)
+        else:
+            prob_ex[s, t] = exp(-1. * k_ex * step)
+            prob_sted[s, t] = exp(-1. * k_sted * step)
+
+@cython.boundscheck(False)  # turn off bounds-checking for entire function
+@cython.wraparound(False)  # turn off negative index wrapping for entire function
+cdef tuple bleach_rates(
+    BleachModel *model,
+    FLOATDTYPE_t[:, :] i_ex,
+    FLOATDTYPE_t[:, :] i_sted,
+    double p_ex,
+    double p_sted,
+    double step
 ):
+    """
+    Computes the bleaching rates of the bleaching model on every position of the laser arrays.
+    :returns: A tuple of arrays (k_ex, k_sted).
+    """
     cdef int s, t
-    for (s, t) in mask:
-        prob_ex[s, t] = 1.0
-        prob_sted[s, t] = 1.0
+    cdef numpy.ndarray[FLOATDTYPE_t, ndim=2] k_ex = numpy.empty((i_ex.shape[0], i_ex.shape[1]), dtype=numpy.float64)
+    cdef numpy.ndarray[FLOATDTYPE_t, ndim=2] k_sted = numpy.empty_like(k_ex)
+    cdef FLOATDTYPE_t[:, :] k_ex_view = k_ex, k_sted_view = k_sted
+    with nogil:
+        for s in range(i_ex.shape[0]):
+            for t in range(i_ex.shape[1]):
+                model.rate(&model.params, i_ex[s, t] * p_ex, i_sted[s, t] * p_sted, step, &k_ex_view[s, t],
+                           &k_sted_view[s, t])
+    return k_ex, k_sted
+
+@cython.boundscheck(False)  # turn off bounds-checking for entire function
+@cython.wraparound(False)  # turn off negative index wrapping for entire function
+cdef void sample_molecules(
+    INT64DTYPE_t[:, :, ::1] layers,
+    INT64DTYPE_t[:, ::1] total,
+    INT64DTYPE_t[:, ::1] occupancy,
+    FLOATDTYPE_t[:, :] prob_ex,
+    FLOATDTYPE_t[:, :] prob_sted,
+    int row,
+    int col,
+    INTDTYPE_t[:, ::1] mask,
+    int mask_len,
+    CounterRNG *rng
+) noexcept nogil:
+    """
+    C equivalent of bleach_funcs.sample_molecules. The random numbers are drawn from the same stream, in the same
+    order. The summed datamap and its summed-area table of occupied positions are updated with the molecules which were
+    removed.
+    """
+    cdef int layer, m, s, t
+    cdef INT64DTYPE_t current, sampled_value
+    cdef float prob
+
+    for layer in range(layers.shape[0]):
+        for m in range(mask_len):
+            s, t = mask[m, 0], mask[m, 1]
+            current = layers[layer, row + s, col + t]
+            if current > 0:
+                # Calculates the binomial sampling of the surviving molecules
+                prob = prob_ex[s, t] * prob_sted[s, t]
+                sampled_value = rng_binomial(rng, current, prob)
+                layers[layer, row + s, col + t] = sampled_value
+                total[row + s, col + t] -= current - sampled_value
+                if total[row + s, col + t] == 0:
+                    occupancy_add(occupancy, row + s, col + t, -1)
+
+@cython.boundscheck(False)  # turn off bounds-checking for entire function
+@cython.wraparound(False)  # turn off negative index wrapping for entire function
+cdef void update_total(
+    INT64DTYPE_t[:, :, ::1] layers,
+    INT64DTYPE_t[:, ::1] total,
+    INT64DTYPE_t[:, ::1] occupancy,
+    int row,
+    int col,
+    INTDTYPE_t[:, ::1] mask,
+    int mask_len
+) noexcept nogil:
+    """
+    Sums the layers at the positions of the mask after they were modified by a sample function given as Python object.
+    """
+    cdef int layer, m, s, t
+    cdef bint was_occupied
+    for m in range(mask_len):
+        s, t = mask[m, 0], mask[m, 1]
+        was_occupied = total[row + s, col + t] > 0
+        total[row + s, col + t] = 0
+        for layer in range(layers.shape[0]):
+            total[row + s, col + t] += layers[layer, row + s, col + t]
+        if was_occupied != (total[row + s, col + t] > 0):
+            occupancy_add(occupancy, row + s, col + t, -1 if was_occupied else 1)
 
 @cython.boundscheck(False)  # turn off bounds-checking for entire function
 @cython.wraparound(False)  # turn off negative index wrapping for entire function
@@ -50,31 +285,35 @@ def raster_func_c_self_bleach_split_g(
         numpy.ndarray[FLOATDTYPE_t, ndim=2] p_sted_roi,
         bint bleach,   # bint is a bool
         dict bleached_sub_datamaps_dict,
-        int seed,
+        uint64_t seed,
         object bleach_func,   # uncertain of the type for a cfunc, but this seems to be working so ???
         object sample_func,
-        list steps
+        list steps,
+        int frame=0
 ):
-    cdef int row, col
-    cdef int sprime, tprime
+    cdef int row, col, p
     cdef int h, w
-    cdef int current
-    cdef int max_len = len(pixel_list)
+    cdef int num_pixels = pixel_list.shape[0]
+    cdef int mask_len
     cdef FLOATDTYPE_t value
-    cdef int sampled_value
-    cdef int prob
-    cdef int rsamp
     cdef FLOATDTYPE_t pdt, p_ex, p_sted
-    cdef numpy.ndarray[FLOATDTYPE_t, ndim=2] pre_effective, effective
+    cdef numpy.ndarray[FLOATDTYPE_t, ndim=2] effective
     cdef numpy.ndarray[FLOATDTYPE_t, ndim=2] k_ex, k_sted
     cdef numpy.ndarray[FLOATDTYPE_t, ndim=2] i_ex, i_sted
-    cdef numpy.ndarray[FLOATDTYPE_t, ndim=2] photons_ex, photons_sted
-    cdef numpy.ndarray[INT64DTYPE_t, ndim=2] bleached_datamap
-    cdef numpy.ndarray[INT64DTYPE_t, ndim=2] current_datamap
-    cdef FLOATDTYPE_t duty_cycle
-    cdef FLOATDTYPE_t step
-    cdef list mask
-    cdef bint uniform_sted, uniform_ex, uniform_pdt, is_uniform, is_single_datamap
+    cdef numpy.ndarray[INT64DTYPE_t, ndim=3] stacked_layers
+    cdef INT64DTYPE_t[:, :, ::1] layers
+    cdef INT64DTYPE_t[:, ::1] total, occupancy
+    cdef INTDTYPE_t[:, ::1] mask
+    cdef FLOATDTYPE_t[:, :] effective_view, prob_ex_view, prob_sted_view, i_ex_view, i_sted_view
+    cdef FLOATDTYPE_t[:, :] acquired_view = acquired_intensity
+    cdef INTDTYPE_t[:, :] pixel_view = pixel_list
+    cdef list keys
+    cdef bint uniform_sted, uniform_ex, uniform_pdt, is_uniform
+    cdef bint c_bleach, c_sample
+    cdef int num_cols
+    cdef CounterRNG rng
+    cdef str model_name
+    cdef BleachModel model
 
     """
     raster_func_c_self_bleach executes the simultaneous acquisition and bleaching routine for the case where the
@@ -83,13 +322,18 @@ def raster_func_c_self_bleach_split_g(
 
     Additionally, this function seperately bleaches the different parts composing the datamap (i.e. the base and flash
     components of the datamap are bleached separately).
-    """
 
-    if seed == 0:
-        # if no seed is passed, calculates a 'pseudo-random' seed form the time in ns
-        srand(int(str(time.time_ns())[-5:-1]))
-    else:
-        srand(seed)
+    The sub datamaps are stacked in a single array whose layers replace the arrays of bleached_sub_datamaps_dict, such
+    that the bleach_func and sample_func given as Python objects must update the arrays in place. The default
+    functions of bleach_funcs are replaced by their C equivalents, in which case the loop body runs without the GIL.
+    The bleach_func may also be given by the name of a model of bleach_funcs.BLEACH_MODELS, all of which have a C
+    equivalent. The sum of the layers is kept up to date as molecules are bleached, such that the cost of a pixel does not depend
+    on the number of sub datamaps. A summed-area table of the occupied positions is used to skip the pixels whose
+    footprint contains no molecule, for which the acquired intensity is 0.
+
+    The molecules under the footprint of a pixel are sampled from the random stream of the pixel, keyed by the seed,
+    the frame and the position of the pixel in the datamap (see counter_rng.pxd).
+    """
 
     i_ex, i_sted, _ = self.cache(datamap.pixelsize)
 
@@ -99,456 +343,709 @@ def raster_func_c_self_bleach_split_g(
     uniform_sted = numpy.all(p_sted_roi == p_sted_roi[0, 0])
     uniform_pdt = numpy.all(pdt_roi == pdt_roi[0, 0])
     is_uniform = uniform_sted and uniform_ex and uniform_pdt
+    model_name, bleach_func = bleach_funcs.get_bleach_model(bleach_func)
+    c_bleach = model_name is not None
+    c_sample = sample_func is bleach_funcs.sample_molecules
+    if c_bleach:
+        bleach_model_init(&model, model_name, self)
+
+    # Calculates effective psf to get the shape
+    effective = self.get_effective(datamap.pixelsize, p_ex_roi[0, 0], p_sted_roi[0, 0])
+    h, w = effective.shape[0], effective.shape[1]
 
     if is_uniform:
         p_ex = p_ex_roi[0, 0]
         p_sted = p_sted_roi[0, 0]
         pdt = pdt_roi[0, 0]
-        photons_ex = self.fluo.get_photons(i_ex * p_ex, self.excitation.lambda_)
-        duty_cycle = self.sted.tau * self.sted.rate
-        photons_sted = self.fluo.get_photons(i_sted * p_sted * duty_cycle, self.sted.lambda_)
-
-        # Calculates photobleaching constants
-        k_sted = self.fluo.get_k_bleach(self.excitation.lambda_, self.sted.lambda_, photons_ex, photons_sted, self.sted.tau, 1/self.sted.rate, pdt,)
-        k_ex = k_sted * 0.
-
-        # Calculates prob ex and sted once
+    if is_uniform and c_bleach:
+        # Calculates photobleaching constants, and prob ex and sted once
+        k_ex, k_sted = bleach_rates(&model, i_ex, i_sted, p_ex, p_sted, pdt)
         prob_ex = numpy.exp(-1. * k_ex * pdt)
         prob_sted = numpy.exp(-1. * k_sted * pdt)
-
-        # Calculates effective psf
-        effective = self.get_effective(datamap.pixelsize, p_ex, p_sted)
     else:
-        k_sted = None
-        k_ex = None
-
-        # Calculates effective psf to get the shape
-        effective = self.get_effective(datamap.pixelsize, p_ex_roi[0, 0], p_sted_roi[0, 0])
-
-    h, w = effective.shape[0], effective.shape[1]
-    is_single_datamap = len(bleached_sub_datamaps_dict.keys()) > 1
-
-    for (row, col) in pixel_list:
+        prob_ex = numpy.ones((h, w), dtype=numpy.float64)
+        prob_sted = numpy.ones((h, w), dtype=numpy.float64)
+
+    # Stacks the sub datamaps, the arrays of the dict become views of the stack
+    stacked_layers = stack_layers(bleached_sub_datamaps_dict)
+    layers = stacked_layers
+    total = stacked_layers.sum(axis=0)
+    occupancy = occupancy_table(stacked_layers.sum(axis=0))
+    mask = numpy.zeros((h * w, 2), dtype=numpy.int32)
+    num_cols = total.shape[1]
+
+    effective_view = effective
+    i_ex_view, i_sted_view = i_ex, i_sted
+    prob_ex_view, prob_sted_view = prob_ex, prob_sted
+
+    if is_uniform and c_bleach and c_sample:
+        with nogil:
+            for p in range(num_pixels):
+                row, col = pixel_view[p, 0], pixel_view[p, 1]
+                if is_empty_footprint(occupancy, row, col, h, w):
+                    continue
+                value = acquire_pixel(total, effective_view, row, col, bleach, mask, &mask_len)
+                acquired_view[row // ratio, col // ratio] += value
+                if bleach:
+                    rng_init(&rng, seed, frame, <uint32_t>row * num_cols + col, 0)
+                    sample_molecules(layers, total, occupancy, prob_ex_view, prob_sted_view, row, col, mask,
+                                     mask_len, &rng)
+        return
+
+    for p in range(num_pixels):
+        row, col = pixel_view[p, 0], pixel_view[p, 1]
+        if is_empty_footprint(occupancy, row, col, h, w):
+            continue
         if not is_uniform:
             pdt = pdt_roi[row, col]
             p_ex = p_ex_roi[row, col]
             p_sted = p_sted_roi[row, col]
             effective = self.get_effective(datamap.pixelsize, p_ex, p_sted)
+            effective_view = effective
 
-        mask = []
-
-        # Combines the datamaps into a single datamap
-        bleached_datamap = numpy.zeros(bleached_sub_datamaps_dict["base"].shape, dtype=numpy.int64)
-        for key in bleached_sub_datamaps_dict:
-            current_datamap = bleached_sub_datamaps_dict[key]
-            for s in range(row, row + h):
-                for t in range(col, col + w):
-                    bleached_datamap[s, t] += current_datamap[s, t]
-
-        # Calculates the acquired intensity and keeps track of the position
-        # of the emitters
-        value = 0.0
-        sprime = 0
-        for s in range(row, row + h):
-            tprime = 0
-            for t in range(col, col + w):
-                if bleach and (bleached_datamap[s, t] > 0):
-                    mask.append((sprime, tprime))
-                value += effective[sprime, tprime] * bleached_datamap[s, t]
-                tprime += 1
-            sprime += 1
-            
-        # Sets intensity value
-        acquired_intensity[int(row / ratio), int(col / ratio)] += value
+        with nogil:
+            value = acquire_pixel(total, effective_view, row, col, bleach, mask, &mask_len)
+            acquired_view[row // ratio, col // ratio] += value
 
         # Bleaches the sample
-        if bleach:
-            if not is_uniform:
-                # reset_prob(mask, prob_ex, prob_sted)
-                prob_ex = numpy.ones_like(prob_ex, dtype=numpy.float64)
-                prob_sted = numpy.ones_like(prob_sted, dtype=numpy.float64)
-                bleach_func(self, i_ex, i_sted, p_ex, p_sted, pdt, bleached_sub_datamaps_dict, row, col, h, w, mask, prob_ex,
-                            prob_sted, k_ex, k_sted)
-            sample_func(self, bleached_sub_datamaps_dict, row, col, h, w, mask, prob_ex, prob_sted)
+        if bleach and mask_len > 0:
+            if not (is_uniform and c_bleach):
+                if c_bleach:
+                    # the powers and dwelltime are single precision in the functions of bleach_funcs
+                    with nogil:
+                        update_survival_probabilities(&model, i_ex_view, i_sted_view, <float>p_ex, <float>p_sted,
+                                                      <float>pdt, prob_ex_view, prob_sted_view, mask, mask_len)
+                else:
+                    prob_ex = numpy.ones((h, w), dtype=numpy.float64)
+                    prob_sted = numpy.ones((h, w), dtype=numpy.float64)
+                    bleach_func(self, i_ex, i_sted, p_ex, p_sted, pdt, bleached_sub_datamaps_dict, row, col, h, w,
+                                [tuple(item) for item in mask[:mask_len]], prob_ex, prob_sted, None, None)
+                    prob_ex_view, prob_sted_view = prob_ex, prob_sted
+            if c_sample:
+                with nogil:
+                    rng_init(&rng, seed, frame, <uint32_t>row * num_cols + col, 0)
+                    sample_molecules(layers, total, occupancy, prob_ex_view, prob_sted_view, row, col, mask,
+                                     mask_len, &rng)
+            else:
+                sample_func(self, bleached_sub_datamaps_dict, row, col, h, w,
+                            [tuple(item) for item in mask[:mask_len]], prob_ex, prob_sted)
+                with nogil:
+                    update_total(layers, total, occupancy, row, col, mask, mask_len)
+
+@cython.boundscheck(False)  # turn off bounds-checking for entire function
+@cython.wraparound(False)  # turn off negative index wrapping for entire function
+cdef FLOATDTYPE_t acquire_pixel_sparse(
+    INT64DTYPE_t[::1] row_ptr,
+    INT64DTYPE_t[::1] cols,
+    INT64DTYPE_t[::1] total,
+    FLOATDTYPE_t[:, :] effective,
+    int row,
+    int col,
+    bint bleach,
+    INTDTYPE_t[:, ::1] mask,
+    INT64DTYPE_t[::1] emitters,
+    int *mask_len
+) noexcept nogil:
+    """
+    Sparse equivalent of acquire_pixel. The emitters of every row of the footprint are found with a binary search in
+    the row index, such that only the occupied positions are visited. The emitters are visited in raster order, as in
+    acquire_pixel, and their index is stored with their position in the mask (if bleach is True).
+    """
+    cdef int s
+    cdef INT64DTYPE_t lo, hi, mid, k
+    cdef INT64DTYPE_t count
+    cdef FLOATDTYPE_t value = 0.0
+
+    mask_len[0] = 0
+    for s in range(effective.shape[0]):
+        lo, hi = row_ptr[row + s], row_ptr[row + s + 1]
+        while lo < hi:
+            mid = (lo + hi) // 2
+            if cols[mid] < col:
+                lo = mid + 1
+            else:
+                hi = mid
+        k = lo
+        while k < row_ptr[row + s + 1] and cols[k] < col + effective.shape[1]:
+            count = total[k]
+            if bleach and (count > 0):
+                mask[mask_len[0], 0] = s
+                mask[mask_len[0], 1] = cols[k] - col
+                emitters[mask_len[0]] = k
+                mask_len[0] += 1
+            value += effective[s, cols[k] - col] * count
+            k += 1
+    return value
 
 @cython.boundscheck(False)  # turn off bounds-checking for entire function
 @cython.wraparound(False)  # turn off negative index wrapping for entire function
-def raster_func_dymin(
+cdef void sample_molecules_sparse(
+    INT64DTYPE_t[:, ::1] layers,
+    INT64DTYPE_t[::1] total,
+    FLOATDTYPE_t[:, :] prob_ex,
+    FLOATDTYPE_t[:, :] prob_sted,
+    INTDTYPE_t[:, ::1] mask,
+    INT64DTYPE_t[::1] emitters,
+    int mask_len,
+    CounterRNG *rng
+) noexcept nogil:
+    """
+    Sparse equivalent of sample_molecules. The random numbers are drawn from the same stream, in the same order.
+    """
+    cdef int layer, m, s, t
+    cdef INT64DTYPE_t k, current, sampled_value
+    cdef float prob
+
+    for layer in range(layers.shape[0]):
+        for m in range(mask_len):
+            s, t, k = mask[m, 0], mask[m, 1], emitters[m]
+            current = layers[layer, k]
+            if current > 0:
+                prob = prob_ex[s, t] * prob_sted[s, t]
+                sampled_value = rng_binomial(rng, current, prob)
+                layers[layer, k] = sampled_value
+                total[k] -= current - sampled_value
+
+@cython.boundscheck(False)  # turn off bounds-checking for entire function
+@cython.wraparound(False)  # turn off negative index wrapping for entire function
+def raster_func_sparse(
         object self,
         object datamap,
         numpy.ndarray[FLOATDTYPE_t, ndim=2] acquired_intensity,
         numpy.ndarray[INTDTYPE_t, ndim=2] pixel_list,
         int ratio,
-        int rows_pad,
-        int cols_pad,
-        int laser_pad,
-        numpy.ndarray[FLOATDTYPE_t, ndim=2] prob_ex,
-        numpy.ndarray[FLOATDTYPE_t, ndim=2] prob_sted,
-        numpy.ndarray[FLOATDTYPE_t, ndim=2] returned_photons,
-        numpy.ndarray[FLOATDTYPE_t, ndim=2] scaled_power,
         numpy.ndarray[FLOATDTYPE_t, ndim=2] pdt_roi,
         numpy.ndarray[FLOATDTYPE_t, ndim=2] p_ex_roi,
         numpy.ndarray[FLOATDTYPE_t, ndim=2] p_sted_roi,
         bint bleach,   # bint is a bool
         dict bleached_sub_datamaps_dict,
-        int seed,
-        object bleach_func,   # uncertain of the type for a cfunc, but this seems to be working so ???
-        object sample_func,
-        list steps
+        uint64_t seed,
+        int frame=0,
+        str bleach_model="default"
 ):
-    cdef int row, col, i
-    cdef int sprime, tprime
+    cdef int row, col, p
     cdef int h, w
-    cdef int current
-    cdef int max_len = len(pixel_list)
+    cdef int num_pixels = pixel_list.shape[0]
+    cdef int mask_len
     cdef FLOATDTYPE_t value
-    cdef int sampled_value
-    cdef int prob
-    cdef int rsamp
-    cdef FLOATDTYPE_t pdt, p_ex, p_sted, _pdt, _p_ex, _p_sted
-    cdef float scale_power, decision_time, threshold_count
-    cdef int pixel_photons
-    cdef numpy.ndarray[FLOATDTYPE_t, ndim=2] pre_effective, effective
-    cdef numpy.ndarray[FLOATDTYPE_t, ndim=3] effectives, k_exs, k_steds
+    cdef FLOATDTYPE_t pdt, p_ex, p_sted
+    cdef numpy.ndarray[FLOATDTYPE_t, ndim=2] effective
     cdef numpy.ndarray[FLOATDTYPE_t, ndim=2] k_ex, k_sted
     cdef numpy.ndarray[FLOATDTYPE_t, ndim=2] i_ex, i_sted
-    cdef numpy.ndarray[FLOATDTYPE_t, ndim=2] photons_ex, photons_sted
-    cdef numpy.ndarray[FLOATDTYPE_t, ndim=1] pdts, p_exs, p_steds
-    cdef numpy.ndarray[FLOATDTYPE_t, ndim=1] SCALE_POWER, DECISION_TIME, THRESHOLD_COUNT
-    cdef numpy.ndarray[INT64DTYPE_t, ndim=2] bleached_datamap, current_datamap
-    cdef FLOATDTYPE_t duty_cycle
-    cdef FLOATDTYPE_t step
-    cdef list mask
-    cdef int num_steps
-    cdef bint uniform_sted, uniform_ex, uniform_pdt, is_uniform
+    cdef numpy.ndarray[FLOATDTYPE_t, ndim=2] prob_ex, prob_sted
+    cdef numpy.ndarray[INT64DTYPE_t, ndim=2] stacked_layers
+    cdef INT64DTYPE_t[:, ::1] layers
+    cdef INT64DTYPE_t[::1] total, emitters
+    cdef INT64DTYPE_t[::1] row_ptr = datamap.row_index()
+    cdef INT64DTYPE_t[::1] cols = datamap.cols
+    cdef INTDTYPE_t[:, ::1] mask
+    cdef FLOATDTYPE_t[:, :] effective_view, prob_ex_view, prob_sted_view, i_ex_view, i_sted_view
+    cdef FLOATDTYPE_t[:, :] acquired_view = acquired_intensity
+    cdef INTDTYPE_t[:, :] pixel_view = pixel_list
+    cdef list keys
+    cdef bint is_uniform
+    cdef int num_cols = datamap.whole_shape[1]
+    cdef CounterRNG rng
+    cdef BleachModel model
 
-    if seed == 0:
-        # if no seed is passed, calculates a 'pseudo-random' seed form the time in ns
-        srand(int(str(time.time_ns())[-5:-1]))
-    else:
-        srand(seed)
+    """
+    raster_func_sparse executes the simultaneous acquisition and bleaching routine on a SparseDatamap. It is equivalent
+    to raster_func_c_self_bleach_split_g with the bleaching model named bleach_model (see bleach_funcs.BLEACH_MODELS)
+    and the default sample_func, and gives the same results for the same seed, but its cost scales with the number of
+    occupied positions in the footprints instead of their area.
+
+    The sub datamaps of bleached_sub_datamaps_dict are 1D arrays of counts aligned with the positions of the datamap.
+    They are stacked in a single array whose layers replace the arrays of the dict. The powers and the dwelltime are
+    either (1, 1) arrays or arrays of the same shape as the ROI.
+    """
 
     i_ex, i_sted, _ = self.cache(datamap.pixelsize)
-    # Calculate the bleaching rate once if the scanning powers and dwelltimes do not vary to
-    # increase speed
-    uniform_ex = numpy.all(p_ex_roi == p_ex_roi[0, 0])
-    uniform_sted = numpy.all(p_sted_roi == p_sted_roi[0, 0])
-    uniform_pdt = numpy.all(pdt_roi == pdt_roi[0, 0])
-    if uniform_sted and uniform_ex and uniform_pdt:
+
+    is_uniform = numpy.all(p_ex_roi == p_ex_roi[0, 0]) and numpy.all(p_sted_roi == p_sted_roi[0, 0]) and \
+                 numpy.all(pdt_roi == pdt_roi[0, 0])
+
+    effective = self.get_effective(datamap.pixelsize, p_ex_roi[0, 0], p_sted_roi[0, 0])
+    h, w = effective.shape[0], effective.shape[1]
+    bleach_model_init(&model, bleach_model, self)
+
+    if is_uniform:
         p_ex = p_ex_roi[0, 0]
         p_sted = p_sted_roi[0, 0]
         pdt = pdt_roi[0, 0]
-        photons_ex = self.fluo.get_photons(i_ex * p_ex, self.excitation.lambda_)
-        duty_cycle = self.sted.tau * self.sted.rate
-        photons_sted = self.fluo.get_photons(i_sted * p_sted * duty_cycle, self.sted.lambda_)
-        k_sted = self.fluo.get_k_bleach(self.excitation.lambda_, self.sted.lambda_, photons_ex, photons_sted, self.sted.tau, 1/self.sted.rate, pdt,)
-        k_ex = k_sted * 0.
+        k_ex, k_sted = bleach_rates(&model, i_ex, i_sted, p_ex, p_sted, pdt)
+        prob_ex = numpy.exp(-1. * k_ex * pdt)
+        prob_sted = numpy.exp(-1. * k_sted * pdt)
     else:
-        k_sted = None
-        k_ex = None
+        prob_ex = numpy.ones((h, w), dtype=numpy.float64)
+        prob_sted = numpy.ones((h, w), dtype=numpy.float64)
 
-    pre_effective = self.get_effective(datamap.pixelsize, p_ex_roi[0, 0], p_sted_roi[0, 0])
-    h, w = pre_effective.shape[0], pre_effective.shape[1]
+    stacked_layers = stack_layers(bleached_sub_datamaps_dict)
+    layers = stacked_layers
+    total = stacked_layers.sum(axis=0)
+    mask = numpy.zeros((h * w, 2), dtype=numpy.int32)
+    emitters = numpy.zeros(h * w, dtype=numpy.int64)
 
-    prob_ex = numpy.ones_like(pre_effective, dtype=numpy.float64)
-    prob_sted = numpy.ones_like(pre_effective, dtype=numpy.float64)
+    effective_view = effective
+    i_ex_view, i_sted_view = i_ex, i_sted
+    prob_ex_view, prob_sted_view = prob_ex, prob_sted
 
-    # Extracts DyMIN parameters
-    SCALE_POWER = self.opts["scale_power"]
-    DECISION_TIME = self.opts["decision_time"]
-    THRESHOLD_COUNT = self.opts["threshold_count"]
-    num_steps = len(self.opts["scale_power"])
-
-    is_uniform = uniform_sted and uniform_ex and uniform_pdt
     if is_uniform:
-        # Pre-calculates necessary variables
-        effectives = numpy.zeros((num_steps, h, w), dtype=numpy.float64)
-        k_steds = numpy.zeros((num_steps, h, w), dtype=numpy.float64)
-        k_exs = numpy.zeros((num_steps, h, w), dtype=numpy.float64)
-        for i in range(num_steps):
-            effective = self.get_effective(datamap.pixelsize, p_ex, SCALE_POWER[i] * p_sted)
-            effectives[i] = effective
-
-            decision_time = DECISION_TIME[i]
-            if decision_time < 0.:
-                decision_time = pdt_roi[0, 0]
-
-            # Must be recalculated
-            photons_ex = self.fluo.get_photons(i_ex * p_ex, self.excitation.lambda_)
-            photons_sted = self.fluo.get_photons(i_sted * SCALE_POWER[i] * p_sted * duty_cycle, self.sted.lambda_)
-
-            k_steds[i] = self.fluo.get_k_bleach(self.excitation.lambda_, self.sted.lambda_, photons_ex, photons_sted, self.sted.tau, 1/self.sted.rate, decision_time, )
-            k_exs[i] = k_steds[i] * 0.
-
-    pdts, p_exs, p_steds = numpy.zeros(num_steps, dtype=numpy.float64), numpy.zeros(num_steps, dtype=numpy.float64), numpy.zeros(num_steps, dtype=numpy.float64)
-
-    for (row, col) in pixel_list:
-        pdts = pdts * 0.
-        p_exs = p_exs * 0.
-        p_steds = p_steds * 0.
-        mask = []
-
-        # Uses the bleached datamap
-        bleached_datamap = numpy.zeros(bleached_sub_datamaps_dict["base"].shape, dtype=numpy.int64)
-        for key in bleached_sub_datamaps_dict:
-            current_datamap = bleached_sub_datamaps_dict[key]
-            for s in range(row, row + h):
-                for t in range(col, col + w):
-                    bleached_datamap[s, t] += current_datamap[s, t]
-
-        # Creates the masked values
-        sprime = 0
-        for s in range(row, row + h):
-            tprime = 0
-            for t in range(col, col + w):
-                if bleach and (bleached_datamap[s, t] > 0):
-                    mask.append((sprime, tprime))
-                tprime += 1
-            sprime += 1
-
-        # DyMIN implementation for every step
-        for i in range(num_steps):
+        with nogil:
+            for p in range(num_pixels):
+                row, col = pixel_view[p, 0], pixel_view[p, 1]
+                value = acquire_pixel_sparse(row_ptr, cols, total, effective_view, row, col, bleach, mask, emitters,
+                                             &mask_len)
+                acquired_view[row // ratio, col // ratio] += value
+                if bleach:
+                    rng_init(&rng, seed, frame, <uint32_t>row * num_cols + col, 0)
+                    sample_molecules_sparse(layers, total, prob_ex_view, prob_sted_view, mask, emitters, mask_len,
+                                            &rng)
+        return
+
+    for p in range(num_pixels):
+        row, col = pixel_view[p, 0], pixel_view[p, 1]
+        pdt = pdt_roi[row, col]
+        p_ex = p_ex_roi[row, col]
+        p_sted = p_sted_roi[row, col]
+        effective = self.get_effective(datamap.pixelsize, p_ex, p_sted)
+        effective_view = effective
 
-            scale_power = SCALE_POWER[i]
-            decision_time = DECISION_TIME[i]
-            threshold_count = THRESHOLD_COUNT[i]
+        with nogil:
+            value = acquire_pixel_sparse(row_ptr, cols, total, effective_view, row, col, bleach, mask, emitters,
+                                         &mask_len)
+            acquired_view[row // ratio, col // ratio] += value
 
-            if decision_time < 0.:
-                decision_time = pdt_roi[row, col]
+        if bleach and mask_len > 0:
+            # the powers and dwelltime are single precision in the functions of bleach_funcs
+            with nogil:
+                update_survival_probabilities(&model, i_ex_view, i_sted_view, <float>p_ex, <float>p_sted, <float>pdt,
+                                              prob_ex_view, prob_sted_view, mask, mask_len)
+                rng_init(&rng, seed, frame, <uint32_t>row * num_cols + col, 0)
+                sample_molecules_sparse(layers, total, prob_ex_view, prob_sted_view, mask, emitters, mask_len, &rng)
 
-            if not is_uniform:
-                effective = self.get_effective(datamap.pixelsize, p_ex_roi[row, col], scale_power * p_sted_roi[row, col])
-            else:
-                effective = effectives[i]
+@cython.boundscheck(False)  # turn off bounds-checking for entire function
+@cython.wraparound(False)  # turn off negative index wrapping for entire function
+cdef void sample_molecules_counter(
+    INT64DTYPE_t[:, :, ::1] layers,
+    INT64DTYPE_t[:, ::1] total,
+    FLOATDTYPE_t[:, :] prob_ex,
+    FLOATDTYPE_t[:, :] prob_sted,
+    int row,
+    int col,
+    INTDTYPE_t[:, ::1] mask,
+    int mask_len,
+    CounterRNG *rng
+) noexcept nogil:
+    """
+    Equivalent of sample_molecules which does not update the summed-area table of the occupied positions. Only the
+    positions of the footprint are written, such that the pixels whose footprints do not overlap can be sampled
+    concurrently.
+    """
+    cdef int layer, m, s, t
+    cdef INT64DTYPE_t current, sampled_value
+    cdef float prob
+
+    for layer in range(layers.shape[0]):
+        for m in range(mask_len):
+            s, t = mask[m, 0], mask[m, 1]
+            current = layers[layer, row + s, col + t]
+            if current > 0:
+                prob = prob_ex[s, t] * prob_sted[s, t]
+                sampled_value = rng_binomial(rng, current, prob)
+                layers[layer, row + s, col + t] = sampled_value
+                total[row + s, col + t] -= current - sampled_value
 
-            # pixel_intensity = numpy.sum(effective * bleached_datamap[row_slice, col_slice])
-            value = 0.0
-            for (sprime, tprime) in mask:
-                s = sprime + row
-                t = tprime + col
-                value += effective[sprime, tprime] * bleached_datamap[s, t]
+@cython.boundscheck(False)  # turn off bounds-checking for entire function
+@cython.wraparound(False)  # turn off negative index wrapping for entire function
+cdef void wavefront_pixel(
+    INT64DTYPE_t[:, :, ::1] layers,
+    INT64DTYPE_t[:, ::1] total,
+    INT64DTYPE_t[:, ::1] occupancy,
+    FLOATDTYPE_t[:, :] effective,
+    FLOATDTYPE_t[:, :] prob_ex,
+    FLOATDTYPE_t[:, :] prob_sted,
+    FLOATDTYPE_t[:, :] acquired,
+    int i,
+    int j,
+    int ratio,
+    bint bleach,
+    INTDTYPE_t[:, ::1] mask,
+    uint64_t seed,
+    uint32_t frame
+) noexcept nogil:
+    """
+    Acquires and bleaches the pixel (i, j) of the grid of the acquisition, using the random stream of the pixel.
+    """
+    cdef int row = i * ratio
+    cdef int col = j * ratio
+    cdef int mask_len
+    cdef CounterRNG rng
+
+    if is_empty_footprint(occupancy, row, col, effective.shape[0], effective.shape[1]):
+        return
+    acquired[i, j] += acquire_pixel(total, effective, row, col, bleach, mask, &mask_len)
+    if bleach and mask_len > 0:
+        rng_init(&rng, seed, frame, <uint32_t>row * total.shape[1] + col, 0)
+        sample_molecules_counter(layers, total, prob_ex, prob_sted, row, col, mask, mask_len, &rng)
 
-            pixel_photons = self.detector.get_signal(self.fluo.get_photons(value), decision_time, self.sted.rate)
+@cython.boundscheck(False)  # turn off bounds-checking for entire function
+@cython.wraparound(False)  # turn off negative index wrapping for entire function
+def raster_func_wavefront(
+        object self,
+        object datamap,
+        numpy.ndarray[FLOATDTYPE_t, ndim=2] acquired_intensity,
+        int ratio,
+        FLOATDTYPE_t pdt,
+        FLOATDTYPE_t p_ex,
+        FLOATDTYPE_t p_sted,
+        bint bleach,   # bint is a bool
+        dict bleached_sub_datamaps_dict,
+        uint64_t seed,
+        int num_threads,
+        int frame=0,
+        str bleach_model="default"
+):
+    cdef int i, j, t, tid
+    cdef int h, w, lag
+    cdef int first, last
+    cdef int num_rows = acquired_intensity.shape[0]
+    cdef int num_cols = acquired_intensity.shape[1]
+    cdef int num_wavefronts
+    cdef numpy.ndarray[FLOATDTYPE_t, ndim=2] effective
+    cdef numpy.ndarray[FLOATDTYPE_t, ndim=2] k_ex, k_sted
+    cdef numpy.ndarray[FLOATDTYPE_t, ndim=2] i_ex, i_sted
+    cdef numpy.ndarray[FLOATDTYPE_t, ndim=2] prob_ex, prob_sted
+    cdef numpy.ndarray[INT64DTYPE_t, ndim=3] stacked_layers
+    cdef INT64DTYPE_t[:, :, ::1] layers
+    cdef INT64DTYPE_t[:, ::1] total, occupancy
+    cdef INTDTYPE_t[:, :, ::1] masks
+    cdef FLOATDTYPE_t[:, :] effective_view, prob_ex_view, prob_sted_view
+    cdef FLOATDTYPE_t[:, :] acquired_view = acquired_intensity
+    cdef list keys
+    cdef BleachModel model
 
-            # Stores the action taken for futures bleaching
-            pdts[i] = decision_time
-            p_exs[i] = p_ex_roi[row, col]
-            p_steds[i] = scale_power * p_sted_roi[row, col]
+    """
+    raster_func_wavefront executes the simultaneous acquisition and bleaching routine of a raster scan with uniform
+    powers and dwelltime, using the bleaching model named bleach_model (see bleach_funcs.BLEACH_MODELS) and the default
+    sample_func, on num_threads threads.
+
+    A pixel only depends on the previous pixels whose footprint overlaps its own. The row i of the grid is thus started
+    lag = ceil(w / ratio) pixels after the row i - 1, such that the pixels (i, t - i * lag) of the wavefront t never
+    overlap and are acquired concurrently. Every pixel draws its random numbers from its own stream of the counter-based
+    generator, such that the result does not depend on the number of threads and is the same as the one of
+    raster_func_c_self_bleach_split_g.
+
+    The summed-area table of the occupied positions is only built once, before the scan. Since bleaching only removes
+    molecules, a footprint which is initially empty stays empty.
+    """
 
-            # If signal is less than threshold count then skip pixel
-            scaled_power[row, col] = scale_power
-            if pixel_photons < threshold_count:
-                break
+    i_ex, i_sted, _ = self.cache(datamap.pixelsize)
+    effective = self.get_effective(datamap.pixelsize, p_ex, p_sted)
+    h, w = effective.shape[0], effective.shape[1]
 
-            # Update the photon counts only on the last pixel power scale
-            if i == num_steps - 1:
-                returned_photons[row, col] += pixel_photons
+    bleach_model_init(&model, bleach_model, self)
+    k_ex, k_sted = bleach_rates(&model, i_ex, i_sted, p_ex, p_sted, pdt)
+    prob_ex = numpy.exp(-1. * k_ex * pdt)
+    prob_sted = numpy.exp(-1. * k_sted * pdt)
+
+    stacked_layers = stack_layers(bleached_sub_datamaps_dict)
+    layers = stacked_layers
+    total = stacked_layers.sum(axis=0)
+    occupancy = occupancy_table(stacked_layers.sum(axis=0))
+    masks = numpy.zeros((max(num_threads, 1), h * w, 2), dtype=numpy.int32)
+
+    effective_view = effective
+    prob_ex_view, prob_sted_view = prob_ex, prob_sted
+
+    if num_threads <= 1:
+        with nogil:
+            for i in range(num_rows):
+                for j in range(num_cols):
+                    wavefront_pixel(layers, total, occupancy, effective_view, prob_ex_view, prob_sted_view,
+                                    acquired_view, i, j, ratio, bleach, masks[0], seed, frame)
+        return
+
+    lag = (w - 1) // ratio + 1
+    num_wavefronts = num_cols + (num_rows - 1) * lag
+    with nogil:
+        for t in range(num_wavefronts):
+            first = max(0, (t - num_cols) // lag + 1)
+            last = min(num_rows - 1, t // lag)
+            for i in prange(first, last + 1, num_threads=num_threads, schedule="static"):
+                tid = threadid()
+                wavefront_pixel(layers, total, occupancy, effective_view, prob_ex_view, prob_sted_view,
+                                acquired_view, i, t - i * lag, ratio, bleach, masks[tid], seed, frame)
 
-        # Bleaches the sample after pixel is scanned
-        if bleach:
-            for i in range(num_steps):
-                if pdts[i] > 0:
-                    if is_uniform:
-                        k_sted, k_ex = k_steds[i], k_exs[i]
-                    bleach_func(self, i_ex, i_sted, p_exs[i], p_steds[i],
-                                pdts[i], bleached_sub_datamaps_dict,
-                                row, col, h, w, mask, prob_ex, prob_sted, k_ex, k_sted)
-            sample_func(self, bleached_sub_datamaps_dict, row, col, h, w, mask, prob_ex, prob_sted)
+@cython.boundscheck(False)  # turn off bounds-checking for entire function
+@cython.wraparound(False)  # turn off negative index wrapping for entire function
+def detect_signal(
+        object detector,
+        const FLOATDTYPE_t[::1] photons,
+        const FLOATDTYPE_t[::1] dwelltime,
+        FLOATDTYPE_t rate,
+        uint64_t seed,
+        uint32_t frame,
+        uint32_t pixel,
+        uint32_t step,
+        FLOATDTYPE_t[::1] out
+):
+    """
+    Writes in out the signal detected by detector from the photons emitted during dwelltime, in a single pass without
+    temporary arrays (see Detector.get_signal). The dwelltime is either of the size of photons or of size 1. The
+    element i is detected from the stream of the step DETECTION_STEP + step of the pixel pixel + i, such that the
+    decision steps of an adaptive acquisition detected by Detector.get_signal draw the same numbers as the ones of
+    raster_func_adaptive.
+    """
+    cdef Py_ssize_t i
+    cdef Py_ssize_t num_photons = photons.shape[0]
+    cdef bint is_uniform = dwelltime.shape[0] == 1
+    cdef DetectorModel model
+    cdef CounterRNG rng
+
+    detector_model_init(&model, detector, rate, 1.0)
+    with nogil:
+        for i in range(num_photons):
+            rng_init(&rng, seed, frame, <uint32_t>(pixel + i), DETECTION_STEP + step)
+            out[i] = detect(&model, &rng, photons[i], dwelltime[0 if is_uniform else i])
+
+def step_table(scale_power, decision_time, lower_threshold, upper_threshold, accumulate):
+    """
+    Builds the step table of an adaptive acquisition (see raster_func_adaptive), one row per step.
+    :param scale_power: The scale of the STED power of the steps.
+    :param decision_time: The dwelltime of the steps (s), or a negative value -r for the fraction r of the dwelltime of
+                          the pixel (e.g. -1 for the dwelltime of the pixel).
+    :param lower_threshold: The number of photons under which the acquisition of the pixel is stopped, or a value
+                            smaller than or equal to 0 to never stop.
+    :param upper_threshold: The number of photons over which the acquisition of the pixel is stopped, or a value
+                            smaller than or equal to 0 to never stop. The photons of the step and the ones accumulated
+                            by the previous steps are then extrapolated from their dwelltime to the dwelltime of the
+                            pixel.
+    :param accumulate: Whether the photons of the steps which do not stop the acquisition are added to the image.
+    :returns: A structured array of dtype STEPDTYPE.
+    """
+    cdef int i
+    table = numpy.zeros(len(scale_power), dtype=STEPDTYPE)
+    for i, name in enumerate(STEPDTYPE.names):
+        table[name] = (scale_power, decision_time, lower_threshold, upper_threshold, accumulate)[i]
+    return table
 
-            # We reset the survival probabilty
-            reset_prob(mask, prob_ex, prob_sted)
+@cython.boundscheck(False)  # turn off bounds-checking for entire function
+@cython.wraparound(False)  # turn off negative index wrapping for entire function
+cdef void combine_survival_probabilities(
+    FLOATDTYPE_t[:, :, ::1] survival_ex,
+    FLOATDTYPE_t[:, :, ::1] survival_sted,
+    int num_steps,
+    FLOATDTYPE_t[:, :] prob_ex,
+    FLOATDTYPE_t[:, :] prob_sted,
+    INTDTYPE_t[:, ::1] mask,
+    int mask_len
+) noexcept nogil:
+    """
+    Sets the survival probabilities of the mask to the product of the precomputed survival probabilities of the first
+    num_steps steps.
+    """
+    cdef int i, m, s, t
+    for m in range(mask_len):
+        s, t = mask[m, 0], mask[m, 1]
+        prob_ex[s, t] = 1.0
+        prob_sted[s, t] = 1.0
+        for i in range(num_steps):
+            prob_ex[s, t] = prob_ex[s, t] * survival_ex[i, s, t]
+            prob_sted[s, t] = prob_sted[s, t] * survival_sted[i, s, t]
 
 @cython.boundscheck(False)  # turn off bounds-checking for entire function
 @cython.wraparound(False)  # turn off negative index wrapping for entire function
-def raster_func_rescue(
+def raster_func_adaptive(
         object self,
         object datamap,
-        numpy.ndarray[FLOATDTYPE_t, ndim=2] acquired_intensity,
+        numpy.ndarray[FLOATDTYPE_t, ndim=2] returned_photons,
+        numpy.ndarray[INTDTYPE_t, ndim=2] steps_taken,
+        numpy.ndarray[INTDTYPE_t, ndim=2] outcomes,
         numpy.ndarray[INTDTYPE_t, ndim=2] pixel_list,
         int ratio,
-        int rows_pad,
-        int cols_pad,
-        int laser_pad,
-        numpy.ndarray[FLOATDTYPE_t, ndim=2] prob_ex,
-        numpy.ndarray[FLOATDTYPE_t, ndim=2] prob_sted,
-        numpy.ndarray[FLOATDTYPE_t, ndim=2] returned_photons,
-        numpy.ndarray[FLOATDTYPE_t, ndim=2] thresholds,
+        numpy.ndarray table,
         numpy.ndarray[FLOATDTYPE_t, ndim=2] pdt_roi,
         numpy.ndarray[FLOATDTYPE_t, ndim=2] p_ex_roi,
         numpy.ndarray[FLOATDTYPE_t, ndim=2] p_sted_roi,
         bint bleach,   # bint is a bool
         dict bleached_sub_datamaps_dict,
-        int seed,
-        object bleach_func,   # uncertain of the type for a cfunc, but this seems to be working so ???
+        uint64_t seed,
+        object bleach_func,
         object sample_func,
-        list steps
+        int frame=0,
+        bint c_detect=True
 ):
-    cdef int row, col, i
-    cdef int sprime, tprime
+    cdef int row, col, p, i
     cdef int h, w
-    cdef int current
-    cdef int max_len = len(pixel_list)
-    cdef FLOATDTYPE_t value
-    cdef int sampled_value
-    cdef int prob
-    cdef int rsamp
-    cdef FLOATDTYPE_t pdt, p_ex, p_sted, _pdt, _p_ex, _p_sted
-    cdef float scale_power, decision_time, threshold_count
+    cdef int num_pixels = pixel_list.shape[0]
+    cdef int num_steps = table.shape[0]
+    cdef int num_taken, outcome
+    cdef int mask_len
     cdef int pixel_photons
-    cdef numpy.ndarray[FLOATDTYPE_t, ndim=2] pre_effective, effective
-    cdef numpy.ndarray[FLOATDTYPE_t, ndim=3] effectives, k_exs, k_steds
-    cdef numpy.ndarray[FLOATDTYPE_t, ndim=2] k_ex, k_sted
+    cdef FLOATDTYPE_t value, decision_time, accumulated_photons, accumulated_time
+    cdef FLOATDTYPE_t pdt, p_ex, p_sted
+    cdef bint is_uniform, c_bleach, c_sample, empty
+    cdef numpy.ndarray[FLOATDTYPE_t, ndim=2] effective, prob_ex, prob_sted
     cdef numpy.ndarray[FLOATDTYPE_t, ndim=2] i_ex, i_sted
-    cdef numpy.ndarray[FLOATDTYPE_t, ndim=2] photons_ex, photons_sted
-    cdef numpy.ndarray[FLOATDTYPE_t, ndim=1] pdts, p_exs, p_steds
-    cdef numpy.ndarray[FLOATDTYPE_t, ndim=1] LOWER_THRESHOLD, UPPER_THRESHOLD, DECISION_TIME
-    cdef numpy.ndarray[INT64DTYPE_t, ndim=2] bleached_datamap, current_datamap
-    cdef FLOATDTYPE_t duty_cycle
-    cdef FLOATDTYPE_t step
-    cdef list mask
-    cdef int num_steps
-    cdef bint uniform_sted, uniform_ex, uniform_pdt, is_uniform
-
-    if seed == 0:
-        # if no seed is passed, calculates a 'pseudo-random' seed form the time in ns
-        srand(int(str(time.time_ns())[-5:-1]))
-    else:
-        srand(seed)
+    cdef numpy.ndarray[FLOATDTYPE_t, ndim=3] effectives, survival_ex, survival_sted
+    cdef numpy.ndarray[FLOATDTYPE_t, ndim=1] decision_times
+    cdef numpy.ndarray[INT64DTYPE_t, ndim=3] stacked_layers
+    cdef INT64DTYPE_t[:, :, ::1] layers
+    cdef INT64DTYPE_t[:, ::1] total, occupancy
+    cdef INTDTYPE_t[:, ::1] mask, footprint
+    cdef FLOATDTYPE_t[:, :] effective_view, prob_ex_view, prob_sted_view, i_ex_view, i_sted_view
+    cdef FLOATDTYPE_t[:, :, ::1] survival_ex_view, survival_sted_view
+    cdef INTDTYPE_t[:, :] pixel_view = pixel_list
+    cdef Step[::1] steps = table
+    cdef list keys, mask_list
+    cdef int num_cols
+    cdef str model_name
+    cdef BleachModel model
+    cdef DetectorModel detector
+    cdef CounterRNG rng
 
-    i_ex, i_sted, _ = self.cache(datamap.pixelsize)
-    # Calculate the bleaching rate once if the scanning powers and dwelltimes do not vary to
-    # increase speed
-    uniform_ex = numpy.all(p_ex_roi == p_ex_roi[0, 0])
-    uniform_sted = numpy.all(p_sted_roi == p_sted_roi[0, 0])
-    uniform_pdt = numpy.all(pdt_roi == pdt_roi[0, 0])
-    if uniform_sted and uniform_ex and uniform_pdt:
-        p_ex = p_ex_roi[0, 0]
-        p_sted = p_sted_roi[0, 0]
-        pdt = pdt_roi[0, 0]
-        photons_ex = self.fluo.get_photons(i_ex * p_ex, self.excitation.lambda_)
-        duty_cycle = self.sted.tau * self.sted.rate
-        photons_sted = self.fluo.get_photons(i_sted * p_sted * duty_cycle, self.sted.lambda_)
-        k_sted = self.fluo.get_k_bleach(self.excitation.lambda_, self.sted.lambda_, photons_ex, photons_sted, self.sted.tau, 1/self.sted.rate, pdt,)
-        k_ex = k_sted * 0.
-    else:
-        k_sted = None
-        k_ex = None
+    """
+    raster_func_adaptive executes the simultaneous acquisition and bleaching routine of an adaptive illumination scheme
+    (DyMIN, RESCue, DyMIN-RESCue, or a plain raster scan) described by a step table (see step_table).
+
+    Every pixel is acquired in successive steps, each one with its own scale of the STED power and its own dwelltime.
+    The photons of a step are compared with the thresholds of the step to decide whether the acquisition of the pixel
+    continues. The molecules are then bleached by all the steps which were acquired. For every pixel of pixel_list,
+    the image returned_photons receives the photons, steps_taken the number of steps which were acquired and outcomes
+    how the acquisition ended (0 under the lower threshold, 2 over the upper threshold, 1 otherwise).
+
+    The sub datamaps are stacked as in raster_func_c_self_bleach_split_g, and the default bleach_func (or any model of
+    bleach_funcs.BLEACH_MODELS) and sample_func are replaced by their C equivalents. The photons of the steps are
+    detected by the C equivalent of Detector.get_signal (see detector_model.pxd), unless c_detect is False in which case
+    self.detector.get_signal is called, e.g. for a detector which overrides it.
+    """
 
-    pre_effective = self.get_effective(datamap.pixelsize, p_ex_roi[0, 0], p_sted_roi[0, 0])
-    h, w = pre_effective.shape[0], pre_effective.shape[1]
+    model_name, bleach_func = bleach_funcs.get_bleach_model(bleach_func)
+    c_bleach = model_name is not None
+    c_sample = sample_func is bleach_funcs.sample_molecules
+    if c_bleach:
+        bleach_model_init(&model, model_name, self)
+    if c_detect:
+        # same photon energy as Fluorescence.get_photons
+        detector_model_init(&detector, self.detector, self.sted.rate, 299792458.0 * 6.62607015e-34 / self.fluo.lambda_)
 
-    prob_ex = numpy.ones_like(pre_effective, dtype=numpy.float64)
-    prob_sted = numpy.ones_like(pre_effective, dtype=numpy.float64)
+    i_ex, i_sted, _ = self.cache(datamap.pixelsize)
+    is_uniform = numpy.all(p_ex_roi == p_ex_roi[0, 0]) and numpy.all(p_sted_roi == p_sted_roi[0, 0]) and \
+                 numpy.all(pdt_roi == pdt_roi[0, 0])
 
-    # Extracts RESCue parameters
-    LOWER_THRESHOLD = self.opts["lower_threshold"]
-    UPPER_THRESHOLD = self.opts["upper_threshold"]
-    DECISION_TIME = self.opts["decision_time"]
-    num_steps = len(self.opts["decision_time"])
+    effective = self.get_effective(datamap.pixelsize, p_ex_roi[0, 0], p_sted_roi[0, 0])
+    h, w = effective.shape[0], effective.shape[1]
+    mask = numpy.zeros((h * w, 2), dtype=numpy.int32)
+    decision_times = numpy.zeros(num_steps, dtype=numpy.float64)
+    i_ex_view, i_sted_view = i_ex, i_sted
 
-    is_uniform = uniform_sted and uniform_ex and uniform_pdt
     if is_uniform:
-        # Pre-calculates necessary variables
-        effectives = numpy.zeros((num_steps, h, w), dtype=numpy.float64)
-        k_steds = numpy.zeros((num_steps, k_sted.shape[0], k_sted.shape[1]), dtype=numpy.float64)
-        k_exs = numpy.zeros((num_steps, k_ex.shape[0], k_ex.shape[1]), dtype=numpy.float64)
+        # Pre-calculates the effective psf and the survival probabilities of the steps
+        p_ex = p_ex_roi[0, 0]
+        p_sted = p_sted_roi[0, 0]
+        pdt = pdt_roi[0, 0]
+        effectives = self.get_effective_batch(datamap.pixelsize, numpy.full(num_steps, p_ex),
+                                              table["scale_power"] * p_sted)
+        if c_bleach:
+            footprint = numpy.ascontiguousarray(numpy.argwhere(numpy.ones((h, w))), dtype=numpy.int32)
+            survival_ex = numpy.ones((num_steps, h, w), dtype=numpy.float64)
+            survival_sted = numpy.ones((num_steps, h, w), dtype=numpy.float64)
+            for i in range(num_steps):
+                decision_time = steps[i].decision_time if steps[i].decision_time >= 0. else -steps[i].decision_time * pdt
+                # the powers and dwelltime are single precision in the functions of bleach_funcs
+                update_survival_probabilities(&model, i_ex_view, i_sted_view, <float>p_ex,
+                                              <float>(steps[i].scale_power * p_sted), <float>decision_time,
+                                              survival_ex[i], survival_sted[i], footprint, h * w)
+            survival_ex_view, survival_sted_view = survival_ex, survival_sted
+
+    prob_ex = numpy.ones((h, w), dtype=numpy.float64)
+    prob_sted = numpy.ones((h, w), dtype=numpy.float64)
+    prob_ex_view, prob_sted_view = prob_ex, prob_sted
+
+    # Stacks the sub datamaps, the arrays of the dict become views of the stack
+    stacked_layers = stack_layers(bleached_sub_datamaps_dict)
+    layers = stacked_layers
+    total = stacked_layers.sum(axis=0)
+    occupancy = occupancy_table(stacked_layers.sum(axis=0))
+    num_cols = total.shape[1]
+
+    for p in range(num_pixels):
+        row, col = pixel_view[p, 0], pixel_view[p, 1]
+        if not is_uniform:
+            pdt = pdt_roi[row, col]
+            p_ex = p_ex_roi[row, col]
+            p_sted = p_sted_roi[row, col]
+        empty = is_empty_footprint(occupancy, row, col, h, w)
+        mask_len = 0
 
+        num_taken, outcome = 0, 1
+        accumulated_photons, accumulated_time = 0.0, 0.0
         for i in range(num_steps):
-            effective = self.get_effective(datamap.pixelsize, p_ex, p_sted)
-            effectives[i] = effective
-
-            decision_time = DECISION_TIME[i]
-            if decision_time < 0.:
-                decision_time = pdt_roi[0, 0]
-            k_steds[i] = self.fluo.get_k_bleach(self.excitation.lambda_, self.sted.lambda_, photons_ex, photons_sted, self.sted.tau, 1/self.sted.rate, decision_time, )
-            k_exs[i] = k_steds[i] * 0.
-
-    pdts, p_exs, p_steds = numpy.zeros(num_steps, dtype=numpy.float64), numpy.zeros(num_steps, dtype=numpy.float64), numpy.zeros(num_steps, dtype=numpy.float64)
-    for (row, col) in pixel_list:
-        pdts = pdts * 0.
-        p_exs = p_exs * 0.
-        p_steds = p_steds * 0.
-        mask = []
-
-        # Uses the bleached datamap
-        bleached_datamap = numpy.zeros(bleached_sub_datamaps_dict["base"].shape, dtype=numpy.int64)
-        for key in bleached_sub_datamaps_dict:
-            current_datamap = bleached_sub_datamaps_dict[key]
-            for s in range(row, row + h):
-                for t in range(col, col + w):
-                    bleached_datamap[s, t] += current_datamap[s, t]
-
-        # Creates the masked values
-        sprime = 0
-        for s in range(row, row + h):
-            tprime = 0
-            for t in range(col, col + w):
-                if bleach and (bleached_datamap[s, t] > 0):
-                    mask.append((sprime, tprime))
-                tprime += 1
-            sprime += 1
-
-        # RESCue steps
-        for i in range(num_steps):
-
-            # Extract parameters
-            lower_threshold = LOWER_THRESHOLD[i]
-            upper_threshold = UPPER_THRESHOLD[i]
-            decision_time = DECISION_TIME[i]
-
-            if decision_time < 0.:
-                decision_time = pdt_roi[row, col]
-
-            # If non uniform laser powers we recalculate
-            if not is_uniform:
-                effective = self.get_effective(datamap.pixelsize, p_ex_roi[row, col], p_sted_roi[row, col])
+            decision_time = steps[i].decision_time if steps[i].decision_time >= 0. else -steps[i].decision_time * pdt
+            decision_times[i] = decision_time
+            value = 0.0
+            if not empty:
+                if is_uniform:
+                    effective_view = effectives[i]
+                else:
+                    effective = self.get_effective(datamap.pixelsize, p_ex, steps[i].scale_power * p_sted)
+                    effective_view = effective
+                with nogil:
+                    value = acquire_pixel(total, effective_view, row, col, bleach, mask, &mask_len)
+
+            if c_detect:
+                with nogil:
+                    rng_init(&rng, seed, frame, <uint32_t>row * num_cols + col, DETECTION_STEP + i)
+                    pixel_photons = <int>detect(&detector, &rng, value, decision_time)
             else:
-                effective = effectives[i]
+                pixel_photons = self.detector.get_signal(
+                    self.fluo.get_photons(value), decision_time, self.sted.rate, seed=seed,
+                    **self.detector.get_stream_kwargs(frame, row * num_cols + col, i))
+            num_taken = i + 1
 
-            # Convolve the effective and the datamap
-            value = 0.0
-            for (sprime, tprime) in mask:
-                s = sprime + row
-                t = tprime + col
-                value += effective[sprime, tprime] * bleached_datamap[s, t]
-
-            pixel_photons = self.detector.get_signal(self.fluo.get_photons(value), decision_time, self.sted.rate)
-
-            # Stores the action taken for futures bleaching
-            pdts[i] = decision_time
-            p_exs[i] = p_ex_roi[row, col]
-            p_steds[i] = scale_power * p_sted_roi[row, col]
-
-            # STEPS
-            # if number of photons is less than lower_threshold
-            # we skip
-            # if number of photons is higher than upper_threshold
-            # we stop acquisition and assign number of count as total_time/decision_time
-            # if number of photons is between
-            # We continue to the next step
-            # At the final step we assign the number of acquired photons
-
-            if (lower_threshold > 0) and (pixel_photons < lower_threshold):
-                thresholds[row, col] = 0
-                # returned_photons[row, col] += (pixel_photons * pdt[row, col] / decision_time).astype(int)
+            if pixel_photons < steps[i].lower_threshold:
+                outcome = 0
                 break
-            elif (upper_threshold > 0) and (pixel_photons > upper_threshold):
-                thresholds[row, col] = 2
-                returned_photons[row, col] += pixel_photons * pdt_roi[row, col] / decision_time
+            elif (steps[i].upper_threshold > 0) and (pixel_photons > steps[i].upper_threshold):
+                # the photons accumulated so far and the ones of the step are extrapolated to the pixel dwelltime
+                outcome = 2
+                accumulated_photons = (accumulated_photons + pixel_photons) * pdt / (accumulated_time + decision_time)
                 break
+            elif steps[i].accumulate:
+                accumulated_photons += pixel_photons
+                accumulated_time += decision_time
+        returned_photons[row // ratio, col // ratio] += accumulated_photons
+        steps_taken[row // ratio, col // ratio] = num_taken
+        outcomes[row // ratio, col // ratio] = outcome
+
+        # Bleaches the sample with all the steps which were acquired
+        if bleach and mask_len > 0:
+            if c_bleach and is_uniform:
+                with nogil:
+                    combine_survival_probabilities(survival_ex_view, survival_sted_view, num_taken, prob_ex_view,
+                                                   prob_sted_view, mask, mask_len)
+            elif c_bleach:
+                with nogil:
+                    for i in range(num_taken):
+                        update_survival_probabilities(&model, i_ex_view, i_sted_view, <float>p_ex,
+                                                      <float>(steps[i].scale_power * p_sted),
+                                                      <float>decision_times[i], prob_ex_view, prob_sted_view, mask,
+                                                      mask_len, i > 0)
             else:
-                thresholds[row, col] = 1
-                returned_photons[row, col] += pixel_photons
-
-        # Bleaches the sample once the pixel was acquired
-        if bleach:
-            for i in range(num_steps):
-                if pdts[i] > 0:
-                    if is_uniform:
-                        k_sted, k_ex = k_steds[i], k_exs[i]
-                    bleach_func(self, i_ex, i_sted, p_exs[i], p_steds[i],
-                                pdts[i], bleached_sub_datamaps_dict,
-                                row, col, h, w, mask, prob_ex, prob_sted, k_ex, k_sted)
-            sample_func(self, bleached_sub_datamaps_dict, row, col, h, w, mask, prob_ex, prob_sted)
-
-            reset_prob(mask, prob_ex, prob_sted)
+                prob_ex = numpy.ones((h, w), dtype=numpy.float64)
+                prob_sted = numpy.ones((h, w), dtype=numpy.float64)
+                mask_list = [tuple(item) for item in mask[:mask_len]]
+                for i in range(num_taken):
+                    bleach_func(self, i_ex, i_sted, p_ex, steps[i].scale_power * p_sted, decision_times[i],
+                                bleached_sub_datamaps_dict, row, col, h, w, mask_list, prob_ex, prob_sted, None, None)
+                prob_ex_view, prob_sted_view = prob_ex, prob_sted
+            if c_sample:
+                with nogil:
+                    rng_init(&rng, seed, frame, <uint32_t>row * num_cols + col, 0)
+                    sample_molecules(layers, total, occupancy, prob_ex_view, prob_sted_view, row, col, mask,
+                                     mask_len, &rng)
+            else:
+                sample_func(self, bleached_sub_datamaps_dict, row, col, h, w,
+                            [tuple(item) for item in mask[:mask_len]], prob_ex, prob_sted)
+                with nogil:
+                    update_total(layers, total, occupancy, row, col, mask, mask_len)
@@ -8,9 +8,10 @@ For use by FLClab (@CERVO) authorized people
 
 import numpy
 import numpy as np
-import scipy, scipy.constants, scipy.integrate
+import scipy, scipy.constants, scipy.integrate, scipy.interpolate, scipy.signal
 
 # import mis par BT
+import fractions
 import math
 import random
 import warnings
@@ -79,6 +80,236 @@ def complex_quadrature(func, a, b, args):
     return real_integral[0] + 1j * imag_integral[0]
 
 
+def polar_grid(n_pixels):
+    '''Compute the polar coordinates of every pixel of a square grid centered
+    on its middle pixel. The rows increase downwards while the :math:`y` axis
+    points upwards.
+
+    :param n_pixels: The (odd) number of pixels on a side of the grid.
+    :returns: A tuple of 2D arrays of the angle :math:`\\theta` and the length
+              :math:`rho` (pixels).
+    '''
+    center = int(n_pixels / 2)
+    rows, cols = numpy.mgrid[:n_pixels, :n_pixels]
+    return cart2pol(cols - center, center - rows)
+
+
+def gauss_legendre(a, b, order):
+    '''Compute the Gauss-Legendre nodes and weights over the interval
+    :math:`[a, b]`.
+
+    :param a: The lower bound of the interval.
+    :param b: The upper bound of the interval.
+    :param order: The number of nodes.
+    :returns: A tuple of 1D arrays of the nodes and the weights.
+    '''
+    nodes, weights = numpy.polynomial.legendre.leggauss(order)
+    half_width = (b - a) / 2
+    return half_width * nodes + (a + b) / 2, half_width * weights
+
+
+def quadrature_error(funcs, a, b, kr, order=64):
+    '''Compare the fixed-order Gauss-Legendre quadrature with the adaptive
+    Gauss-Kronrod quadrature (:func:`scipy.integrate.quad`) used as reference.
+
+    :param funcs: A sequence of functions with signature ``func(theta, kr)``.
+    :param a: The lower bound of the integration.
+    :param b: The upper bound of the integration.
+    :param kr: A 1D array of the values of :math:`kr` to verify.
+    :param order: The number of Gauss-Legendre nodes.
+    :returns: The largest absolute error, relative to the largest absolute value
+              of the reference integrals.
+    '''
+    references = radial_integrals(funcs, a, b, kr, method="quad")
+    estimates = radial_integrals(funcs, a, b, kr, method="gauss-legendre", order=order)
+    error = 0.
+    for reference, estimate in zip(references, estimates):
+        scale = numpy.max(numpy.abs(reference))
+        if scale > 0:
+            error = max(error, numpy.max(numpy.abs(estimate - reference)) / scale)
+    return error
+
+
+def radial_integrals(funcs, a, b, kr, method="quad", order=64, tol=None):
+    '''Integrate functions of :math:`(\\theta, kr)` over :math:`\\theta` once for
+    every given value of :math:`kr`. This is useful for fields with a radial
+    symmetry, where the integrals only have to be evaluated on the unique radii
+    of the grid.
+
+    With ``method="gauss-legendre"``, every function is evaluated on all the
+    nodes and all the values of :math:`kr` in a single call, so the functions
+    must support broadcasting of numpy arrays.
+
+    :param funcs: A sequence of functions with signature ``func(theta, kr)``.
+    :param a: The lower bound of the integration.
+    :param b: The upper bound of the integration.
+    :param kr: A 1D array of the values of :math:`kr`.
+    :param method: Either ``"quad"`` (adaptive Gauss-Kronrod quadrature of every
+                   integral) or ``"gauss-legendre"`` (vectorized fixed-order
+                   quadrature).
+    :param order: The number of Gauss-Legendre nodes.
+    :param tol: If given, the Gauss-Legendre quadrature is verified against the
+                adaptive quadrature on a few values of :math:`kr` and a warning
+                is issued if the relative error exceeds *tol*.
+    :returns: A tuple of 1D arrays (one per function) shaped like *kr*.
+    '''
+    kr = numpy.asarray(kr, dtype=numpy.float64)
+    if method == "quad":
+        return tuple(numpy.array([scipy.integrate.quad(func, a, b, (value,))[0] for value in kr])
+                     for func in funcs)
+    elif method == "gauss-legendre":
+        theta, weights = gauss_legendre(a, b, order)
+        integrals = tuple(weights @ func(theta[:, numpy.newaxis], kr[numpy.newaxis, :]) for func in funcs)
+        if tol is not None and kr.size > 0:
+            samples = kr[numpy.unique(numpy.linspace(0, kr.size - 1, 8).astype(int))]
+            error = quadrature_error(funcs, a, b, samples, order=order)
+            if error > tol:
+                warnings.warn(f"Gauss-Legendre quadrature of order {order} has a relative error of {error:.3e}, "
+                              f"which exceeds the tolerance of {tol:.3e}. Consider increasing the order.")
+        return integrals
+    else:
+        raise ValueError(f"Unknown integration method {method}, must be either 'quad' or 'gauss-legendre'")
+
+
+def focal_grid(lambda_, n, na, datamap_pixelsize):
+    '''Compute the grid on which the focal field of a beam is evaluated. The
+    grid spans about two times the Airy disk of the beam.
+
+    :param lambda_: The wavelength of the beam (m).
+    :param n: The refractive index of the objective.
+    :param na: The numerical aperture of the objective.
+    :param datamap_pixelsize: The size of a pixel of the grid (m).
+    :returns: A tuple containing:
+
+              * A 2D array of the angle of every pixel;
+              * A 2D array of the index of the radius of every pixel in *kr*;
+              * A 1D array of the unique values of :math:`kr` of the grid.
+    '''
+    diameter = 2.233 * lambda_ / (na * datamap_pixelsize)
+    n_pixels = int(diameter / 2) * 2 + 1 # odd number of pixels
+
+    # [Deng2010]
+    k = 2 * numpy.pi * n / lambda_
+
+    phi, radius = polar_grid(n_pixels)
+    radii, radius_idx = numpy.unique(radius, return_inverse=True)
+    return phi, radius_idx.reshape(radius.shape), k * radii * datamap_pixelsize
+
+
+def resample_radial_integrals(profile, kr):
+    '''Interpolate radial integrals (see :func:`radial_integrals`) computed on
+    other values of :math:`kr` using cubic splines.
+
+    :param profile: A tuple of a 1D array of increasing values of :math:`kr` and
+                    a 2D array of the integrals (one row per function).
+    :param kr: A 1D array of the values of :math:`kr` to interpolate.
+    :returns: A tuple of 1D arrays (one per function) shaped like *kr*.
+    '''
+    nodes, values = profile
+    if numpy.array_equal(nodes, kr):
+        return tuple(values)
+    spline = scipy.interpolate.CubicSpline(nodes, values, axis=1)
+    return tuple(spline(kr))
+
+
+def resampling_error(profile, func, kr, num=8):
+    '''Estimate the error of :func:`resample_radial_integrals`. The integrals
+    are computed exactly on the *num* values of *kr* which are the farthest
+    from the nodes of the profile, where the interpolation is the least
+    accurate.
+
+    :param profile: A tuple of a 1D array of increasing values of :math:`kr` and
+                    a 2D array of the integrals (one row per function).
+    :param func: A function which computes the integrals exactly on a 1D array
+                 of values of :math:`kr`.
+    :param kr: A 1D array of the values of :math:`kr` to interpolate.
+    :param num: The number of values of :math:`kr` to verify.
+    :returns: The largest absolute error, relative to the largest absolute value
+              of every integral, or ``inf`` if *kr* is not covered by the
+              profile.
+    '''
+    nodes, values = profile
+    if kr.min() < nodes[0] or kr.max() > nodes[-1]:
+        return numpy.inf
+    idx = numpy.clip(numpy.searchsorted(nodes, kr), 1, nodes.size - 1)
+    distance = numpy.minimum(kr - nodes[idx - 1], nodes[idx] - kr)
+    probes = kr[numpy.argsort(distance)[-num:]]
+    exact = numpy.array(func(probes))
+    estimate = numpy.array(resample_radial_integrals(profile, probes))
+    scale = numpy.max(numpy.abs(values), axis=1)
+    scale[scale == 0] = 1
+    return numpy.max(numpy.abs(estimate - exact) / scale[:, numpy.newaxis])
+
+
+def pixelsize_key(datamap_pixelsize):
+    '''Compute an exact key for a pixel size. The pixel size is rounded to the
+    femtometre, such that pixel sizes which only differ by floating point
+    round-off (e.g. ``7.5e-9`` and ``0.75e-8``) share the same key while
+    sub-nanometre differences (e.g. 7 nm and 7.5 nm) are preserved.
+
+    :param datamap_pixelsize: The size of a pixel (m).
+    :returns: A :class:`fractions.Fraction` of the pixel size (m).
+    '''
+    return fractions.Fraction(round(datamap_pixelsize * 1e15), 10**15)
+
+
+def bilinear_weights(nodes, value):
+    '''Compute the index of the cell of a grid containing a value and the
+    weight of its upper node for a linear interpolation.
+
+    :param nodes: A 1D array of increasing values.
+    :param value: A value between the first and the last node.
+    :returns: A tuple of the index of the lower node and of the weight of the
+              upper node (between 0 and 1).
+    '''
+    if nodes.size == 1:
+        return 0, 0.
+    idx = min(max(int(numpy.searchsorted(nodes, value, side="right")) - 1, 0), nodes.size - 2)
+    return idx, (value - nodes[idx]) / (nodes[idx + 1] - nodes[idx])
+
+
+def bilinear_stencil(x, y, xi, yi):
+    '''Compute the nodes of a grid and their weights for the bilinear
+    interpolation of a point.
+
+    :param x: A 1D array of the increasing coordinates of the first axis.
+    :param y: A 1D array of the increasing coordinates of the second axis.
+    :param xi: The coordinate of the first axis to interpolate.
+    :param yi: The coordinate of the second axis to interpolate.
+    :returns: A list of tuples of the index of a node and of its weight.
+    '''
+    i, wx = bilinear_weights(x, xi)
+    j, wy = bilinear_weights(y, yi)
+    i1, j1 = min(i + 1, x.size - 1), min(j + 1, y.size - 1)
+    return [((i, j), (1 - wx) * (1 - wy)), ((i, j1), (1 - wx) * wy),
+            ((i1, j), wx * (1 - wy)), ((i1, j1), wx * wy)]
+
+
+def bilinear_interpolate(x, y, values, xi, yi):
+    '''Interpolate a grid of images with a bilinear interpolation.
+
+    :param x: A 1D array of the increasing coordinates of the first axis.
+    :param y: A 1D array of the increasing coordinates of the second axis.
+    :param values: A 4D array of the images, of shape ``(x.size, y.size, h, w)``.
+    :param xi: The coordinate of the first axis to interpolate.
+    :param yi: The coordinate of the second axis to interpolate.
+    :returns: A 2D array of the interpolated image.
+    '''
+    return sum(weight * values[idx] for idx, weight in bilinear_stencil(x, y, xi, yi))
+
+
+def correlate_valid(image, kernel):
+    '''Compute the correlation of an image with a kernel at every position
+    where the kernel fits entirely in the image, using the FFT. The value at
+    ``(row, col)`` is ``numpy.sum(kernel * image[row:row + h, col:col + w])``.
+
+    :param image: A 2D array.
+    :param kernel: A 2D array of shape ``(h, w)``.
+    :returns: A 2D array of shape ``(image.shape[0] - h + 1, image.shape[1] - w + 1)``.
+    '''
+    return scipy.signal.fftconvolve(image, kernel[::-1, ::-1], mode="valid")
+
+
 def fwhm(values):
     '''Compute the full width at half maximum of the Gaussian-shaped values.
 
@@ -668,6 +899,19 @@ def float_to_array_verifier(float_or_array, shape):
     return returned_array
 
 
+def seed_verifier(seed):
+    """
+    Returns the seed of the random streams of an acquisition as an integer in [0, 2**64), which is the key of the
+    counter-based generator of the kernels and of the detector. If the seed is None, a seed is drawn from the entropy
+    of the system, such that two acquisitions without a seed are not correlated.
+    :param seed: An integer or None
+    :returns: An integer in [0, 2**64)
+    """
+    if seed is None:
+        seed = numpy.random.SeedSequence().entropy
+    return int(seed) % 2**64
+
+
 def dict_write_func(file, dictio):
     """
     Write a dict to a text file in a good way :)
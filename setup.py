@@ -1,4 +1,6 @@
 
+import sys
+
 from distutils.command.build_py import build_py
 from distutils.core import setup, Extension
 from Cython.Build import cythonize
@@ -12,9 +14,18 @@ import pysted
 #                Extension("pysted.raster", ["pysted/raster.c"]),
 #                Extension("pysted.bleach_funcs", ["pysted/bleach_funcs.c"])]
 
+# the wavefront scheduler of raster.pyx runs on a single thread without OpenMP
+if sys.platform == "win32":
+    openmp_args = ["/openmp"]
+elif sys.platform == "darwin":
+    openmp_args = []
+else:
+    openmp_args = ["-fopenmp"]
+
 ext_modules = [Extension("pysted.cUtils", ["pysted/cUtils.c"]),
                Extension("pysted._draw", ["pysted/_draw.pyx"]),
-               Extension("pysted.raster", ["pysted/raster.pyx"]),
+               Extension("pysted.raster", ["pysted/raster.pyx"],
+                         extra_compile_args=openmp_args, extra_link_args=openmp_args),
                Extension("pysted.bleach_funcs", ["pysted/bleach_funcs.pyx"])]
 
 setup(name="pysted",